@@ -0,0 +1,58 @@
+"""
+Benchmark: bytes on the wire vs. build CPU time for pkpass compression policies.
+
+Rebuilds the sample passes from ``tests/data/apple_passes`` with different
+`CompressionPolicy` settings using the streaming writer.
+
+Usage::
+
+    python benchmarks/bench_compression.py [repetitions]
+"""
+
+from edutap.wallet_apple.archive import CompressionPolicy
+from edutap.wallet_apple.archive import PkPassStream
+from pathlib import Path
+
+import sys
+import time
+import zipfile
+
+SAMPLES = Path(__file__).parents[1] / "tests" / "data" / "apple_passes"
+
+POLICIES = {
+    "stored": CompressionPolicy(method="stored"),
+    "auto level 1": CompressionPolicy(level=1),
+    "auto level 6": CompressionPolicy(level=6),
+    "auto level 9": CompressionPolicy(level=9),
+    "deflated level 6": CompressionPolicy(method="deflated", level=6),
+}
+
+
+def load_samples() -> dict[str, dict[str, bytes]]:
+    samples = {}
+    for path in sorted(SAMPLES.glob("*.pkpass")):
+        with zipfile.ZipFile(path) as zf:
+            samples[path.stem] = {name: zf.read(name) for name in zf.namelist()}
+    return samples
+
+
+def main(repetitions: int = 50):
+    samples = load_samples()
+    print(f"{'pass':<14}{'policy':<18}{'bytes':>10}{'ratio':>8}{'build µs':>12}")
+    for sample, files in samples.items():
+        raw = sum(len(data) for data in files.values())
+        for label, policy in POLICIES.items():
+            start = time.perf_counter()
+            for _ in range(repetitions):
+                stream = PkPassStream(files, compression=policy)
+                for _chunk in stream:
+                    pass
+            elapsed = (time.perf_counter() - start) / repetitions
+            print(
+                f"{sample:<14}{label:<18}{len(stream):>10}"
+                f"{len(stream) / raw:>8.3f}{elapsed * 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,62 @@
+"""
+Benchmark: import time of the package.
+
+Imports the modules in fresh interpreters with ``python -X importtime``
+and reports the best cumulative import time of each, and the slowest
+modules imported by ``edutap.wallet_apple.api``.
+
+Usage::
+
+    python benchmarks/bench_import.py [runs]
+"""
+
+import subprocess
+import sys
+
+MODULES = [
+    "edutap.wallet_apple.api",
+    "edutap.wallet_apple.models.passes",
+    "edutap.wallet_apple.handlers.fastapi",
+]
+
+
+def importtime(module: str) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def best(module: str, runs: int) -> dict[str, int]:
+    results = [importtime(module) for _ in range(runs)]
+    return {name: min(result.get(name, 0) for result in results) for name in results[0]}
+
+
+def main(runs: int = 5):
+    print(f"{'module':<40}{'import ms':>12}")
+    for module in MODULES:
+        times = best(module, runs)
+        print(f"{module:<40}{times[module] / 1000:>12.1f}")
+
+    times = best(MODULES[0], runs)
+    top_level = {
+        name: time
+        for name, time in times.items()
+        if "." not in name and name not in ("site", "encodings")
+    }
+    print(f"\nslowest top-level imports of {MODULES[0]}:")
+    for name, time in sorted(top_level.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {name:<50}{time / 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,105 @@
+"""
+Benchmark: parsing pass.json files, strict vs. tolerant JSON vs. YAML.
+
+Uses the ``tests/data/jsons`` corpus and the pass.json files of the Apple
+sample passes in ``tests/data/apple_passes``. Every document is parsed as
+it is (strict JSON, the fast path) and with added quirks (trailing commas,
+a BOM and comments), which forces the tolerant path. YAML was the former
+fallback for trailing commas, it does not understand the other quirks. PyYAML is only used
+for comparison if it is installed.
+
+Usage::
+
+    python benchmarks/bench_json.py [repetitions]
+"""
+
+from edutap.wallet_apple import lenient_json
+from pathlib import Path
+
+import json
+import re
+import sys
+import time
+import zipfile
+
+DATA = Path(__file__).parents[1] / "tests" / "data"
+
+
+def load_corpus() -> dict[str, bytes]:
+    corpus = {
+        path.name: path.read_bytes() for path in sorted((DATA / "jsons").glob("*.json"))
+    }
+    for path in sorted((DATA / "apple_passes").glob("*.pkpass")):
+        with zipfile.ZipFile(path) as zf:
+            corpus[f"{path.stem}/pass.json"] = zf.read("pass.json")
+    return corpus
+
+
+def add_trailing_commas(data: bytes) -> bytes:
+    return re.sub(rb'(["\d\]}el])(\s*\n\s*[\]}])', rb"\1,\2", data)
+
+
+def add_bom_and_comments(data: bytes) -> bytes:
+    return "\ufeff// generated\n".encode() + data.replace(
+        b"{\n", b"{ /* block comment */\n"
+    )
+
+
+def is_strict(data: bytes) -> bool:
+    try:
+        json.loads(data)
+    except ValueError:
+        return False
+    return True
+
+
+def parses(func, document: bytes) -> bool:
+    try:
+        func(document)
+    except Exception:
+        return False
+    return True
+
+
+def measure(func, documents: list[bytes], repetitions: int) -> str:
+    """µs per document, only over the documents the parser accepts"""
+    accepted = [document for document in documents if parses(func, document)]
+    failed = len(documents) - len(accepted)
+    if not accepted:
+        return "fails"
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for document in accepted:
+            func(document)
+    elapsed = (time.perf_counter() - start) / repetitions / len(accepted) * 1e6
+    return f"{elapsed:.1f}" + (f" ({failed} fail)" if failed else "")
+
+
+def main(repetitions: int = 200):
+    corpus = load_corpus()
+    parsers = {"json.loads": json.loads, "lenient_json.loads": lenient_json.loads}
+    try:
+        import yaml  # type: ignore[import-untyped]
+
+        parsers["yaml.safe_load"] = yaml.safe_load
+    except ImportError:
+        print("PyYAML not installed, skipping it")
+
+    strict = [data for data in corpus.values() if is_strict(data)]
+    commas = [add_trailing_commas(data) for data in strict]
+    variants = {
+        "strict": strict,
+        "commas": commas,
+        "commas+bom+comm": [add_bom_and_comments(data) for data in commas],
+    }
+    print(f"{len(strict)} documents, µs per document")
+    print(f"{'parser':<22}" + "".join(f"{name:>17}" for name in variants))
+    for label, parser in parsers.items():
+        row = f"{label:<22}"
+        for documents in variants.values():
+            row += f"{measure(parser, documents, repetitions):>17}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,89 @@
+"""
+Benchmark: updatable passes of a device from the SQLite ledger.
+
+Fills a ledger with one device per pass, updates a few passes and asks for
+the passes of a device updated since the tag before the updates. The time
+of the query depends on the number of changes, not on the number of
+passes. For comparison, the same question is answered by a scan over the
+update times of all passes, as plugins without a ledger typically do.
+
+Usage::
+
+    python benchmarks/bench_ledger.py [repetitions]
+"""
+
+from edutap.wallet_apple.ledger import SQLiteLedger
+from pathlib import Path
+
+import sqlite3
+import sys
+import tempfile
+import time
+
+SIZES = [1000, 10000, 100000]
+CHANGES = 10
+
+
+def fill(path: Path, size: int) -> tuple[SQLiteLedger, sqlite3.Connection, str]:
+    ledger = SQLiteLedger(path / "ledger.sqlite3")
+    scan = sqlite3.connect(path / "scan.sqlite3")
+    scan.execute("CREATE TABLE passes (serial_number TEXT, device TEXT, updated REAL)")
+    with ledger._lock:
+        ledger._db.execute("BEGIN")
+        ledger._db.executemany(
+            "INSERT INTO registrations VALUES (?, 'pass.demo', ?, NULL)",
+            ((f"device-{i}", str(i)) for i in range(size)),
+        )
+        ledger._db.executemany(
+            "INSERT INTO updates VALUES ('pass.demo', ?, 0)",
+            ((str(i),) for i in range(size)),
+        )
+        ledger._db.execute("COMMIT")
+    scan.executemany(
+        "INSERT INTO passes VALUES (?, ?, 0)",
+        ((str(i), f"device-{i}") for i in range(size)),
+    )
+    scan.commit()
+    tag = ledger.updated_since("device-0", "pass.demo").lastUpdated
+    for i in range(CHANGES):
+        ledger.record_update("pass.demo", str(i * (size // CHANGES)))
+        scan.execute(
+            "UPDATE passes SET updated = 1 WHERE serial_number = ?",
+            (str(i * (size // CHANGES)),),
+        )
+    scan.commit()
+    return ledger, scan, tag
+
+
+def measure(func, repetitions: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        func()
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def main(repetitions: int = 1000):
+    print(f"{'passes':>8}{'ledger µs':>12}{'scan µs':>12}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            ledger, scan, tag = fill(Path(tmp), size)
+            by_ledger = measure(
+                lambda: ledger.updated_since("device-0", "pass.demo", tag),
+                repetitions,
+            )
+            by_scan = measure(
+                lambda: scan.execute(
+                    "SELECT serial_number FROM passes"
+                    " WHERE device = ? AND updated > 0",
+                    ("device-0",),
+                ).fetchall(),
+                max(repetitions // 10, 1),
+            )
+            print(f"{size:>8}{by_ledger:>12.1f}{by_scan:>12.1f}")
+            ledger.close()
+            scan.close()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,71 @@
+"""
+Benchmark: validated vs. trusted creation of passes.
+
+Creates passes from the ``tests/data/jsons`` samples with ``api.new(data)``
+and with ``api.new(data, trusted=True)``, signs them with ``api.sign`` (if
+the key files of the settings exist) and exports them with ``api.pkpass``,
+the path of a delivered pass. Trusted data is not validated, the `Pass`
+model is not built at all.
+
+Usage::
+
+    EDUTAP_WALLET_APPLE_CERT_DIR=$PWD/tests/data/certs/private \\
+        python benchmarks/bench_trusted.py [repetitions]
+"""
+
+from edutap.wallet_apple import api
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+
+import json
+import sys
+import time
+
+JSONS = Path(__file__).parents[1] / "tests" / "data" / "jsons"
+
+SAMPLES = [
+    "semantic-fields-pass.json",
+    "semantic-fields-pass1.json",
+    "boarding_pass.json",
+    "event_ticket.json",
+    "storecard_with_nfc.json",
+]
+
+
+def cycle(data: dict, settings: Settings, sign: bool, trusted: bool) -> None:
+    pkpass = api.new(data, trusted=trusted, settings=settings)
+    if sign:
+        api.sign(pkpass, settings=settings)
+    api.pkpass(pkpass)
+
+
+def measure(
+    data: dict, settings: Settings, sign: bool, trusted: bool, repetitions: int
+) -> float:
+    cycle(data, settings, sign, trusted)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        cycle(data, settings, sign, trusted)
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def main(repetitions: int = 500):
+    settings = Settings(validate_trusted=False)
+    ids = settings.get_available_passtype_ids()
+    sign = bool(ids)
+    print(f"new + {'sign + ' if sign else ''}export")
+    print(f"{'sample':<28}{'validate µs':>14}{'trusted µs':>14}{'speedup':>10}")
+    for sample in SAMPLES:
+        data = json.loads((JSONS / sample).read_text(encoding="utf-8"))
+        if sign:
+            data["passTypeIdentifier"] = ids[0]
+        validated = measure(data, settings, sign, False, repetitions)
+        trusted = measure(data, settings, sign, True, repetitions)
+        print(
+            f"{sample:<28}{validated:>14.1f}{trusted:>14.1f}"
+            f"{validated / trusted:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
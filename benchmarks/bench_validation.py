@@ -0,0 +1,88 @@
+"""
+Benchmark: validation of large boarding passes and event tickets.
+
+The ``boarding_pass.json`` and ``semantic-fields-pass.json`` samples are
+enlarged with many pass fields, half of them with semantic tags, and a
+semantic tag object on the pass, like passes of airlines or ticket shops.
+Every pass is validated with `Pass.model_validate`.
+
+Usage::
+
+    python benchmarks/bench_validation.py [repetitions] [fields]
+"""
+
+from edutap.wallet_apple.models.passes import Pass
+from pathlib import Path
+from typing import Any
+
+import copy
+import json
+import sys
+import time
+
+JSONS = Path(__file__).parents[1] / "tests" / "data" / "jsons"
+
+BOARDING_SEMANTICS = {
+    "airlineCode": "EX",
+    "flightNumber": "123",
+    "departureAirportCode": "SFO",
+    "destinationAirportCode": "JFK",
+    "passengerName": "John Appleseed",
+    "seats": [{"seatNumber": "12", "seatRow": "A"}],
+}
+
+EVENT_SEMANTICS = {
+    "eventName": "Gala Dinner",
+    "venueName": "Hofbräuhaus München",
+    "attendeeName": "Alexander Loechel",
+    "seats": [{"seatSection": "B", "seatRow": "3", "seatNumber": "17"}],
+}
+
+
+def enlarge(data: dict, style: str, semantics: dict, fields: int) -> dict:
+    data = copy.deepcopy(data)
+    data["semantics"] = semantics
+    content = data[style]
+    for section in ("headerFields", "primaryFields", "secondaryFields"):
+        content.setdefault(section, [])
+    for index in range(fields):
+        field: dict[str, Any] = {
+            "key": f"field{index}",
+            "label": f"LABEL {index}",
+            "value": f"value {index}",
+            "changeMessage": "changed to %@",
+        }
+        if index % 2:
+            field["semantics"] = semantics
+        section = "backFields" if index % 3 else "auxiliaryFields"
+        content.setdefault(section, []).append(field)
+    return data
+
+
+def samples(fields: int) -> dict[str, dict]:
+    boarding = json.loads((JSONS / "boarding_pass.json").read_text(encoding="utf-8"))
+    event = json.loads(
+        (JSONS / "semantic-fields-pass.json").read_text(encoding="utf-8")
+    )
+    return {
+        "boarding pass": enlarge(boarding, "boardingPass", BOARDING_SEMANTICS, fields),
+        "event ticket": enlarge(event, "eventTicket", EVENT_SEMANTICS, fields),
+    }
+
+
+def measure(data: dict, repetitions: int) -> float:
+    Pass.model_validate(data)
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        Pass.model_validate(data)
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def main(repetitions: int = 500, fields: int = 40):
+    print(f"{'sample':<16}{'fields':>8}{'validate µs':>14}")
+    for name, data in samples(fields).items():
+        print(f"{name:<16}{fields:>8}{measure(data, repetitions):>14.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,73 @@
+"""
+Benchmark: latency of the first pass of a fresh worker, with and without
+`api.warmup`.
+
+Each measurement runs in a fresh interpreter: a pass is created from
+``tests/data/jsons/event_ticket.json``, signed (if the key files of the
+settings exist) and exported twice. The first cycle of a cold worker pays
+for the lazy imports, the key parsing and the first use of the pydantic
+validators, after the warm-up it takes as long as the second one.
+
+Usage::
+
+    EDUTAP_WALLET_APPLE_CERT_DIR=$PWD/tests/data/certs/private \\
+        python benchmarks/bench_warmup.py [runs]
+"""
+
+from pathlib import Path
+
+import json
+import subprocess
+import sys
+
+TESTS = Path(__file__).parents[1] / "tests"
+JSONS = TESTS / "data" / "jsons"
+
+CYCLE = """
+import json, time
+from edutap.wallet_apple import api
+from edutap.wallet_apple.settings import Settings
+
+settings = Settings()
+if {warmup}:
+    api.warmup(settings)
+data = json.loads(open({path!r}, encoding="utf-8").read())
+ids = settings.get_available_passtype_ids()
+times = []
+for _ in range(2):
+    start = time.perf_counter()
+    pkpass = api.new(data=data)
+    if ids:
+        pkpass.pass_object_safe.passTypeIdentifier = ids[0]
+        api.sign(pkpass, settings=settings)
+    api.pkpass(pkpass)
+    times.append(time.perf_counter() - start)
+print(json.dumps({{"times": times, "signed": bool(ids)}}))
+"""
+
+
+def measure(warmup: bool) -> dict:
+    code = CYCLE.format(warmup=warmup, path=str(JSONS / "event_ticket.json"))
+    # the plugins of the test suite are registered as entry points
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=TESTS,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main(runs: int = 5):
+    print(f"{'worker':<12}{'first ms':>10}{'second ms':>11}{'signed':>8}")
+    for warmup in (False, True):
+        results = [measure(warmup) for _ in range(runs)]
+        first = min(result["times"][0] for result in results) * 1000
+        second = min(result["times"][1] for result in results) * 1000
+        name = "warmed up" if warmup else "cold"
+        print(f"{name:<12}{first:>10.2f}{second:>11.2f}{results[0]['signed']!s:>8}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -1,25 +1,57 @@
+from . import archive
+from . import campaign
+from . import digests
+from . import ledger
+from . import store
+from . import templates
+from . import update_cache
 from .models import passes
+from .models.handlers import PushToken
 from .models.passes import PkPass  # noqa: F401
+from edutap.wallet_apple.plugins import get_logging_handlers
 from edutap.wallet_apple.plugins import get_pass_data_acquisitions
+from edutap.wallet_apple.plugins import get_pass_registrations
 from edutap.wallet_apple.settings import Settings
+from io import BytesIO
+from pathlib import Path
 from typing import Any
 from typing import BinaryIO
+from typing import Callable
+from typing import Iterable
 from typing import Optional
 
-import cryptography.fernet
-import httpx
+import asyncio
+import collections
+import contextlib
 import ssl
+import typing
+
+if typing.TYPE_CHECKING:
+    import cryptography.fernet
 
 
 def new(
     data: Optional[dict[str, Any]] = None,
-    file: Optional[BinaryIO] = None,
+    file: Optional[BinaryIO | str | Path] = None,
+    lazy: bool = False,
+    limits: archive.IngestionLimits | None = None,
+    trusted: bool = False,
+    settings: Settings | None = None,
 ) -> passes.PkPass:
     """
     Create pass model.
 
     :param data: JSON serializable dictionary.
-    :param file: Binary IO data containing an existing PkPass zip file.
+    :param file: Binary IO data or path of an existing PkPass zip file.
+    :param lazy: only for file, read the files of the pass on first access
+                 and validate pass.json when the pass object is used.
+                 Close the pass when done, e.g. use it as context manager.
+    :param limits: only for file, bounds for untrusted uploads,
+                   e.g. ``archive.IngestionLimits.from_settings(Settings())``.
+    :param trusted: only for data, the data is known to be valid (e.g. it
+                    was produced by our own pipeline) and is not validated
+                    unless the pass object is used, see `PkPass.from_trusted`.
+    :param settings: Settings model instance, only used for trusted data.
     :return: PkPass model instance.
 
     Parameters data and file are mutually exclusive.
@@ -31,16 +63,41 @@ def new(
         )
 
     if data is not None:
-        pass_object = passes.Pass.model_validate(data)
-        pkpass = passes.PkPass.from_pass(pass_object)
+        validate = True
+        if trusted:
+            if settings is None:
+                settings = Settings()
+            validate = settings.validate_trusted
+        if validate:
+            pkpass = passes.PkPass.from_pass(passes.Pass.model_validate(data))
+        else:
+            pkpass = passes.PkPass.from_trusted(data)
     elif file is not None:
-        pkpass = passes.PkPass.from_zip(file)
+        pkpass = passes.PkPass.from_zip(file, lazy=lazy, limits=limits)
     else:
         pkpass = passes.PkPass()
 
     return pkpass
 
 
+def new_template(
+    data: dict[str, Any],
+    placeholders: dict[str, str],
+    files: Optional[dict[str, bytes]] = None,
+) -> templates.PassTemplate:
+    """
+    Create a compiled pass template for fast generation of many passes.
+
+    :param data: JSON serializable dictionary, validated once.
+    :param placeholders: mapping of placeholder name to the dotted path of
+                         the per-holder value, e.g. ``{"serial": "serialNumber"}``.
+    :param files: static files (images) to include in every pass.
+    :return: PassTemplate instance, render passes with its `pkpass` method.
+    """
+    pass_object = passes.Pass.model_validate(data)
+    return templates.PassTemplate.compile(pass_object, placeholders, files=files)
+
+
 def verify(
     pkpass: passes.PkPass,
     recompute_manifest=True,
@@ -70,19 +127,19 @@ def sign(
     if settings is None:
         settings = Settings()
 
-    pass_type_identifier = pkpass.pass_object_safe.passTypeIdentifier
+    pass_type_identifier = pkpass.pass_type_identifier
+    pkpass._sign(*_signing_identity(pass_type_identifier, settings))
 
-    with open(settings.private_key, "rb") as fh:
-        private_key_data = fh.read()
-    with open(settings.get_certificate_path(pass_type_identifier), "rb") as fh:
-        certificate_data = fh.read()
-    with open(settings.wwdr_certificate, "rb") as fh:
-        wwdr_certificate_data = fh.read()
 
-    pkpass.sign_direct(
-        private_key_data,
-        certificate_data,
-        wwdr_certificate_data,
+def _signing_identity(pass_type_identifier: str, settings: Settings) -> tuple:
+    """private key, certificate and WWDR certificate, parsed once per worker"""
+    # cryptography is imported on first use, it is slow to import
+    from . import crypto
+
+    return crypto.load_signing_identity(
+        settings.private_key,
+        settings.get_certificate_path(pass_type_identifier),
+        settings.wwdr_certificate,
     )
 
 
@@ -112,15 +169,45 @@ def sign_direct(
     )
 
 
-def pkpass(pkpass: passes.PkPass) -> BinaryIO:
+def pkpass(
+    pkpass: passes.PkPass,
+    compression: archive.CompressionPolicy | None = None,
+) -> BinaryIO:
     """
     Save the pass to a file.
 
     :param pkpass: PkPass model instance.
-    :param file: Binary IO file object.
+    :param compression: per file compression policy, defaults to deflating
+                        text files and storing images.
+    """
+    pkpass._create_manifest()
+    return pkpass.as_zip_bytesio(compression=compression)
+
+
+def pkpass_stream(
+    pkpass: passes.PkPass,
+    compression: archive.CompressionPolicy | None = None,
+) -> archive.PkPassStream:
+    """
+    Stream the pass as zip file.
+
+    Same as `pkpass`, but the zip file is not built in memory. The returned
+    stream knows its size in advance and can be iterated synchronously or
+    asynchronously, e.g. as body of a streaming HTTP response.
+
+    :param pkpass: PkPass model instance.
+    :param compression: per file compression policy, defaults to deflating
+                        text files and storing images.
     """
     pkpass._create_manifest()
-    return pkpass.as_zip_bytesio()
+    return pkpass.as_zip_stream(compression=compression)
+
+
+def _fernet(fernet_key: bytes) -> "cryptography.fernet.Fernet":
+    # cryptography is imported on first use, it is slow to import
+    import cryptography.fernet
+
+    return cryptography.fernet.Fernet(fernet_key)
 
 
 def create_auth_token(
@@ -140,7 +227,7 @@ def create_auth_token(
 
     if not isinstance(fernet_key, bytes):
         fernet_key = fernet_key.encode("utf-8")
-    fernet = cryptography.fernet.Fernet(fernet_key)
+    fernet = _fernet(fernet_key)
     token = fernet.encrypt(f"{pass_type_identifier}:{serial_number}".encode())
     return token
 
@@ -158,7 +245,7 @@ def extract_auth_token(
 
     if not isinstance(token, bytes):
         token = token.encode()
-    fernet = cryptography.fernet.Fernet(fernet_key)
+    fernet = _fernet(fernet_key)
     decrypted = fernet.decrypt(token)
     pass_type_id, serial_number = decrypted.decode().split(":")
     return pass_type_id, serial_number
@@ -191,11 +278,29 @@ def save_link(
     return f"{schema}://{settings.domain}:{settings.https_port}{url_prefix}/v1/download-pass/{token}"
 
 
+async def pass_digest(pass_type_identifier: str, serial_number: str) -> str:
+    """
+    `PkPass.content_digest` of the pass as the plugin delivers it to devices.
+    """
+    for handler in get_pass_data_acquisitions():
+        pass_data = await handler.get_pass_data(
+            pass_type_id=pass_type_identifier,
+            serial_number=serial_number,
+            update=True,
+        )
+        with new(file=pass_data, lazy=True) as pkpass:
+            return pkpass.content_digest()
+    raise LookupError("Pass not found")
+
+
 async def trigger_update(
     passTypeIdentifier,
     serialNumber,
     settings: Settings | None = None,
     ssl_context: ssl.SSLContext | None = None,
+    pacing: campaign.PushPacing | None = None,
+    on_progress: Callable[[campaign.CampaignProgress], Any] | None = None,
+    only_if_changed: bool | None = None,
 ):
     """
     Triggers an update of a registered pass.
@@ -210,46 +315,245 @@ async def trigger_update(
     :param ssl_context: Optional SSL context for the APN call. If not provided,
         one will be created based on the certificate for the passTypeIdentifier
         from settings.
+    :param pacing: Optional pace of the pushes, see `trigger_updates`.
+    :param on_progress: Optional callback with the progress after every push.
+    :param only_if_changed: Optional, push only if the pass changed, see
+        `trigger_updates`.
     """
-    if settings is None:
-        settings = Settings()
+    return await trigger_updates(
+        [(passTypeIdentifier, serialNumber)],
+        settings=settings,
+        ssl_context=ssl_context,
+        pacing=pacing,
+        on_progress=on_progress,
+        only_if_changed=only_if_changed,
+    )
 
-    logger = settings.get_logger()
 
-    # fetch the push tokens
-    for handler in get_pass_data_acquisitions():
-        push_tokens = await handler.get_push_tokens(
-            None, passTypeIdentifier, serialNumber
-        )
+async def trigger_updates(
+    passes: Iterable[tuple[str, str]],
+    settings: Settings | None = None,
+    ssl_context: ssl.SSLContext | None = None,
+    pacing: campaign.PushPacing | None = None,
+    on_progress: Callable[[campaign.CampaignProgress], Any] | None = None,
+    only_if_changed: bool | None = None,
+) -> list[PushToken]:
+    """
+    Triggers an update of many registered passes as one campaign.
 
-    # create the ssl context if not given
-    if ssl_context is None:
-        ssl_context = ssl.create_default_context()
-        ssl_context.load_cert_chain(
-            certfile=settings.get_certificate_path(passTypeIdentifier),
-            keyfile=settings.private_key,
-        )
+    The pushes to all devices of all passes are spread over time, so the
+    devices calling back do not overload the workers signing the passes.
 
-    updated = []
+    :param passes: Pairs of pass type identifier and serial number.
+    :param settings: Settings model instance. If not provided, will be loaded
+        from environment.
+    :param ssl_context: Optional SSL context for all APN calls. If not
+        provided, one per pass type identifier will be created.
+    :param pacing: Pace of the pushes. If not provided, it is taken from
+        settings, unpaced by default.
+    :param on_progress: Optional callback with the progress after every push.
+    :param only_if_changed: Render each pass and push only if its
+        `PkPass.content_digest` differs from the one of the last push, which
+        is kept in the `digests.DigestStore`. The digest is recorded only if
+        all pushes of the pass succeeded. If not provided, it is taken from
+        settings.
+    :return: The push tokens of the devices notified.
+    """
+    # the APNs client is imported on first use, it is slow to import
+    import httpx
 
-    # now call APN for each push-token
-    for push_token in push_tokens:
-        url = f"https://api.push.apple.com/3/device/{push_token.pushToken}"
-        headers = {"apns-topic": passTypeIdentifier}
+    if settings is None:
+        settings = Settings()
+    if pacing is None:
+        pacing = campaign.PushPacing.from_settings(settings)
+    if only_if_changed is None:
+        only_if_changed = settings.push_only_if_changed
+    digest_store = None
+    if only_if_changed:
+        digest_store = digests.get_digest_store(settings)
+        if digest_store is None:
+            raise ValueError(
+                "only_if_changed needs a digest store, "
+                "set EDUTAP_WALLET_APPLE_PASS_DIGEST_STORE_PATH"
+            )
 
-        logger.info(
-            "update_pass", action="call APN", realm="fastapi", url=url, headers=headers
+    logger = settings.get_logger()
+    pass_store = store.get_pass_store(settings)
+    updatable_passes_cache = update_cache.get_updatable_passes_cache(settings)
+    update_ledger = ledger.get_update_ledger(settings)
+
+    pushes: list[tuple[str, str, PushToken]] = []
+    # digests of the changed passes, recorded once all their pushes succeeded
+    changed: dict[tuple[str, str], str] = {}
+    outstanding: collections.Counter[tuple[str, str]] = collections.Counter()
+    for pass_type_id, serial_number in passes:
+        if digest_store is not None:
+            digest = await pass_digest(pass_type_id, serial_number)
+            if digest == digest_store.get(pass_type_id, serial_number):
+                logger.info(
+                    "update_pass",
+                    action="skip unchanged",
+                    realm="fastapi",
+                    pass_type_id=pass_type_id,
+                    serial_number=serial_number,
+                )
+                continue
+            changed[pass_type_id, serial_number] = digest
+
+        # the pass changed, a stored rendering is outdated
+        if pass_store is not None:
+            pass_store.invalidate(pass_type_id, serial_number)
+        # and the devices have to be told
+        if update_ledger is not None:
+            await asyncio.to_thread(
+                update_ledger.record_update, pass_type_id, serial_number
+            )
+        if updatable_passes_cache is not None:
+            updatable_passes_cache.invalidate(pass_type_id)
+
+        # fetch the push tokens
+        push_tokens = []
+        for handler in get_pass_data_acquisitions():
+            push_tokens = await handler.get_push_tokens(
+                None, pass_type_id, serial_number
+            )
+        pushes.extend(
+            (pass_type_id, serial_number, push_token) for push_token in push_tokens
         )
+        outstanding[pass_type_id, serial_number] += len(push_tokens)
 
-        async with httpx.AsyncClient(http2=True, verify=ssl_context) as client:
-            response = await client.post(
-                url,
+    updated = []
+    async with contextlib.AsyncExitStack() as stack:
+        clients: dict[str, httpx.AsyncClient] = {}
+
+        async def send(push: tuple[str, str, PushToken]) -> bool:
+            pass_type_id, serial_number, push_token = push
+            if pass_type_id not in clients:
+                # one connection per certificate, used for all its pushes
+                context = ssl_context
+                if context is None:
+                    context = ssl.create_default_context()
+                    context.load_cert_chain(
+                        certfile=settings.get_certificate_path(pass_type_id),
+                        keyfile=settings.private_key,
+                    )
+                clients[pass_type_id] = await stack.enter_async_context(
+                    httpx.AsyncClient(http2=True, verify=context)
+                )
+            client = clients[pass_type_id]
+
+            url = f"https://api.push.apple.com/3/device/{push_token.pushToken}"
+            headers = {"apns-topic": pass_type_id}
+            logger.info(
+                "update_pass",
+                action="call APN",
+                realm="fastapi",
+                url=url,
                 headers=headers,
-                json={},
             )
-
+            response = await client.post(url, headers=headers, json={})
             if response.status_code == 200:
                 updated.append(push_token)
+                outstanding[pass_type_id, serial_number] -= 1
+                return True
+            return False
+
+        interval = pacing.interval(len(pushes))
+        logger.info(
+            "update_pass",
+            action="start campaign",
+            realm="fastapi",
+            pushes=len(pushes),
+            interval=interval,
+            duration=interval * max(len(pushes) - 1, 0),
+        )
+        try:
+            await campaign.run_campaign(pushes, send, pacing, on_progress)
+        finally:
+            # a pass with a failed or unsent push is pushed again next time,
+            # even if its content does not change
+            if digest_store is not None:
+                for (pass_type_id, serial_number), digest in changed.items():
+                    if outstanding[pass_type_id, serial_number] <= 0:
+                        digest_store.put(pass_type_id, serial_number, digest)
 
     logger.info("update_pass", realm="fastapi", updated=updated)
     return updated
+
+
+def warmup(settings: Settings | None = None) -> list[str]:
+    """
+    Prepares a fresh worker process before it takes traffic.
+
+    The first pass delivered by a worker otherwise pays for importing and
+    resolving the plugins, parsing the signing keys and the first use of
+    the pydantic validators and serialisers. This loads the signing
+    identity of every pass type identifier from
+    `Settings.get_available_passtype_ids` and runs one create, sign,
+    export and load cycle for each pass style.
+
+    :param settings: Settings model instance.
+                     If not given it will be loaded from the environment.
+    :return: the pass type identifiers whose signing identity was loaded.
+    :raises ValueError: if a plugin does not implement its protocol, at
+                        startup instead of on the first request.
+    """
+    # imported on first use otherwise, see trigger_update
+    import httpx  # noqa: F401
+
+    if settings is None:
+        settings = Settings()
+    logger = settings.get_logger()
+
+    get_pass_data_acquisitions()
+    get_pass_registrations()
+    get_logging_handlers()
+
+    identities = {}
+    for pass_type_identifier in settings.get_available_passtype_ids():
+        try:
+            identities[pass_type_identifier] = _signing_identity(
+                pass_type_identifier, settings
+            )
+        except (OSError, ValueError) as ex:
+            logger.warning(
+                "warmup", pass_type_identifier=pass_type_identifier, error=str(ex)
+            )
+
+    pass_type_identifier = next(iter(identities), "pass.warmup")
+    compression = archive.CompressionPolicy.from_settings(settings)
+    for style in passes.pass_model_registry:
+        pkpass = new(data=_warmup_pass_data(style, pass_type_identifier, settings))
+        pkpass.deterministic = settings.deterministic_builds
+        if identities:
+            pkpass._sign(*identities[pass_type_identifier])
+        new(file=BytesIO(pkpass_stream(pkpass, compression=compression).getvalue()))
+
+    if settings.fernet_key:
+        fernet_key = settings.fernet_key.encode("utf-8")
+        extract_auth_token(
+            create_auth_token(pass_type_identifier, "warmup", fernet_key), fernet_key
+        )
+
+    logger.info("warmup", pass_type_identifiers=list(identities))
+    return list(identities)
+
+
+def _warmup_pass_data(
+    style: str, pass_type_identifier: str, settings: Settings
+) -> dict[str, Any]:
+    field = {"key": "warmup", "label": "Warmup", "value": "warmup"}
+    return {
+        "description": "warmup",
+        "formatVersion": 1,
+        "organizationName": "warmup",
+        "passTypeIdentifier": pass_type_identifier,
+        "serialNumber": "warmup",
+        "teamIdentifier": settings.team_identifier or "warmup",
+        "barcodes": [{"format": "PKBarcodeFormatQR", "message": "warmup"}],
+        "semantics": {"totalPrice": {"amount": "0", "currencyCode": "EUR"}},
+        style: {
+            "primaryFields": [field],
+            "backFields": [{**field, "semantics": {"eventName": "warmup"}}],
+        },
+    }
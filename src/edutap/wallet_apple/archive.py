@@ -0,0 +1,508 @@
+"""
+Reading and writing of pkpass (zip) archives.
+
+`PkPassStream` lays out the whole archive up front from the in-memory file
+contents, so the exact size is known before the first byte is sent. The
+archive is then emitted entry by entry as a (async) byte iterator without
+ever assembling it in a single buffer.
+
+`CompressionPolicy` decides per archive member whether it is deflated or
+stored, it is used by the streaming writer and by `PkPass._build_zip`.
+
+`LazyMembers` is a read view on an existing archive that only decompresses
+the members that are actually used, `read_bounded` reads untrusted archives
+within the `IngestionLimits`.
+"""
+
+from pathlib import Path
+from pydantic import BaseModel
+from pydantic import Field
+from typing import AsyncIterator
+from typing import BinaryIO
+from typing import Iterator
+from typing import Literal
+from typing import MutableMapping
+
+import hashlib
+import json
+import mmap
+import struct
+import time
+import zipfile
+import zlib
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+"""Timestamp of all zip entries in reproducible builds, the earliest one zip supports"""
+
+# values as written by `zipfile.ZipFile.writestr`
+_CREATE_VERSION = 20
+_CREATE_SYSTEM = 3  # unix
+_EXTRACT_VERSION = 20
+_EXTERNAL_ATTR = 0o600 << 16
+_UTF8_FLAG = 0x800
+_ZIP_MAX = 0xFFFFFFFF
+
+# zip records, laid out as in the zip file format specification (APPNOTE)
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_LOCAL_HEADER_NAME_LENGTH = 10
+_LOCAL_HEADER_EXTRA_LENGTH = 11
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+_END_RECORD = struct.Struct("<4s4H2LH")
+_END_RECORD_SIGNATURE = b"PK\x05\x06"
+
+
+class CompressionPolicy(BaseModel):
+    """
+    Per entry compression of pkpass archive members.
+
+    Text members (pass.json, manifest.json, ``.strings`` files) and the
+    signature are deflated, images are already compressed and get stored.
+    """
+
+    method: Literal["auto", "stored", "deflated"] = "auto"
+    """`auto` decides per member, `stored` and `deflated` override it for all members."""
+
+    level: int = Field(default=6, ge=0, le=9)
+    """zlib compression level for deflated members"""
+
+    stored_suffixes: tuple[str, ...] = (".png", ".jpg", ".jpeg", ".gif")
+    """Members with these suffixes are stored uncompressed in `auto` mode"""
+
+    @classmethod
+    def from_settings(cls, settings) -> "CompressionPolicy":
+        """Creates the policy configured in the `Settings`."""
+        return cls(
+            method=settings.zip_compression,
+            level=settings.zip_compression_level,
+        )
+
+    def compress_type(self, name: str) -> int:
+        """Returns the zipfile compression constant for the member name."""
+        if self.method == "stored":
+            return zipfile.ZIP_STORED
+        if self.method == "deflated":
+            return zipfile.ZIP_DEFLATED
+        if name.lower().endswith(self.stored_suffixes):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def compress(self, name: str, data: bytes) -> tuple[int, bytes]:
+        """Returns the compression constant and the (raw deflate) compressed data."""
+        compress_type = self.compress_type(name)
+        if compress_type == zipfile.ZIP_STORED:
+            return compress_type, data
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compress_type, compressor.compress(data) + compressor.flush()
+
+
+DEFAULT_COMPRESSION = CompressionPolicy()
+
+
+def dos_date_time(date_time: tuple[int, ...]) -> tuple[int, int]:
+    """Converts a ``(year, month, day, hour, minute, second)`` tuple to the zip format."""
+    year, month, day, hour, minute, second = date_time[:6]
+    dosdate = (year - 1980) << 9 | month << 5 | day
+    dostime = hour << 11 | minute << 5 | (second // 2)
+    return dosdate, dostime
+
+
+def deterministic_zipinfo(name: str) -> zipfile.ZipInfo:
+    """
+    A `zipfile.ZipInfo` with fixed timestamp and attributes, independent of
+    the current time and platform. Written with `ZipFile.writestr` it results
+    in the same bytes as the entries of `PkPassStream`.
+    """
+    zinfo = zipfile.ZipInfo(name, date_time=DETERMINISTIC_DATE_TIME)
+    zinfo.create_system = _CREATE_SYSTEM
+    zinfo.create_version = _CREATE_VERSION
+    zinfo.external_attr = _EXTERNAL_ATTR
+    return zinfo
+
+
+class _Entry:
+    """One archive member with its precomputed headers."""
+
+    def __init__(
+        self,
+        name: str,
+        data: bytes,
+        offset: int,
+        date_time: tuple[int, ...],
+        compression: CompressionPolicy,
+    ):
+        compress_type, self.data = compression.compress(name, data)
+        encoded_name = name.encode("utf-8")
+        flags = 0 if name.isascii() else _UTF8_FLAG
+        crc = zlib.crc32(data)
+        size = len(data)
+        compress_size = len(self.data)
+        if size > _ZIP_MAX or offset > _ZIP_MAX:
+            raise ValueError(f"{name} too large, zip64 is not supported")
+        dosdate, dostime = dos_date_time(date_time)
+        self.local_header = (
+            _LOCAL_HEADER.pack(
+                _LOCAL_HEADER_SIGNATURE,
+                _EXTRACT_VERSION,
+                0,
+                flags,
+                compress_type,
+                dostime,
+                dosdate,
+                crc,
+                compress_size,
+                size,
+                len(encoded_name),
+                0,
+            )
+            + encoded_name
+        )
+        self.central_header = (
+            _CENTRAL_HEADER.pack(
+                _CENTRAL_HEADER_SIGNATURE,
+                _CREATE_VERSION,
+                _CREATE_SYSTEM,
+                _EXTRACT_VERSION,
+                0,
+                flags,
+                compress_type,
+                dostime,
+                dosdate,
+                crc,
+                compress_size,
+                size,
+                len(encoded_name),
+                0,
+                0,
+                0,
+                0,
+                _EXTERNAL_ATTR,
+                offset,
+            )
+            + encoded_name
+        )
+
+    def __len__(self) -> int:
+        return len(self.local_header) + len(self.data)
+
+
+class PkPassStream:
+    """
+    A pkpass archive that is written on the fly.
+
+    ``len()`` gives the size of the complete archive, iterating (sync or
+    async) yields the archive in chunks of at most `chunk_size` bytes.
+    Stored members are not copied, chunks are memoryviews on the file
+    contents. Deflated members are compressed up front to know their size.
+    """
+
+    def __init__(
+        self,
+        files: dict[str, bytes],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        date_time: tuple[int, ...] | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        if date_time is None:
+            date_time = time.localtime(time.time())[:6]
+        if compression is None:
+            compression = DEFAULT_COMPRESSION
+        self.chunk_size = chunk_size
+        self._entries: list[_Entry] = []
+        offset = 0
+        for name, data in files.items():
+            entry = _Entry(name, data, offset, date_time, compression)
+            self._entries.append(entry)
+            offset += len(entry)
+
+        central_directory = b"".join(entry.central_header for entry in self._entries)
+        if len(self._entries) > 0xFFFF:
+            raise ValueError("too many files, zip64 is not supported")
+        end_record = _END_RECORD.pack(
+            _END_RECORD_SIGNATURE,
+            0,
+            0,
+            len(self._entries),
+            len(self._entries),
+            len(central_directory),
+            offset,
+            0,
+        )
+        self._trailer = central_directory + end_record
+        self._size = offset + len(self._trailer)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def content_length(self) -> int:
+        """Size of the complete archive in bytes."""
+        return self._size
+
+    def __iter__(self) -> Iterator[bytes | memoryview]:
+        for entry in self._entries:
+            yield entry.local_header
+            view = memoryview(entry.data)
+            for start in range(0, len(view), self.chunk_size):
+                yield view[start : start + self.chunk_size]
+        yield self._trailer
+
+    async def __aiter__(self) -> AsyncIterator[bytes | memoryview]:
+        for chunk in self:
+            yield chunk
+
+    def getvalue(self) -> bytes:
+        """Returns the complete archive as bytes, mostly useful for testing."""
+        return b"".join(self)
+
+
+class LazyMembers(MutableMapping[str, bytes | memoryview]):
+    """
+    The files of an existing pkpass archive, read on first access.
+
+    Members are decompressed when they are accessed for the first time and
+    kept afterwards. If the archive is given as path, it is memory mapped
+    and stored (uncompressed) members are returned as memoryviews on the
+    mapping without copying them; their CRC is not checked, the manifest
+    hashes cover the content anyway.
+
+    Assigned and deleted files shadow the archive members, so the view can
+    be used as the ``files`` dict of a `PkPass`.
+
+    `close` releases the archive and the mapping, the view is a context
+    manager doing so as well.
+    """
+
+    def __init__(self, source: BinaryIO | str | Path):
+        self._mmap: mmap.mmap | None = None
+        self._closed = False
+        if isinstance(source, (str, Path)):
+            with open(source, "rb") as fh:
+                self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._zipfile = zipfile.ZipFile(source)
+        except BaseException:
+            if self._mmap is not None:
+                self._mmap.close()
+            raise
+        self._infos = {info.filename: info for info in self._zipfile.infolist()}
+        # None marks members that are not read yet
+        self._data: dict[str, bytes | memoryview | None] = dict.fromkeys(self._infos)
+
+    def is_loaded(self, name: str) -> bool:
+        """True if the member was read (or assigned) already."""
+        return self._data[name] is not None
+
+    def _read(self, name: str) -> bytes | memoryview:
+        info = self._infos[name]
+        if self._mmap is None or info.compress_type != zipfile.ZIP_STORED:
+            return self._zipfile.read(info)
+        header = _LOCAL_HEADER.unpack(
+            self._mmap[info.header_offset : info.header_offset + _LOCAL_HEADER.size]
+        )
+        if header[0] != _LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad magic number for file header of {name}")
+        start = (
+            info.header_offset
+            + _LOCAL_HEADER.size
+            + header[_LOCAL_HEADER_NAME_LENGTH]
+            + header[_LOCAL_HEADER_EXTRA_LENGTH]
+        )
+        return memoryview(self._mmap)[start : start + info.file_size]
+
+    def __getitem__(self, name: str) -> bytes | memoryview:
+        data = self._data[name]
+        if data is None:
+            if self._closed:
+                raise ValueError(f"{name} was not read before the archive was closed")
+            data = self._data[name] = self._read(name)
+        return data
+
+    def __setitem__(self, name: str, data: bytes | memoryview) -> None:
+        self._data[name] = data
+
+    def __delitem__(self, name: str) -> None:
+        del self._data[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def close(self) -> None:
+        """
+        Closes the archive and unmaps the file. Members read so far stay
+        available, memoryviews on the mapping are replaced by copies and
+        released. Members not read yet can not be read anymore.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._mmap is not None:
+            for name, data in self._data.items():
+                if isinstance(data, memoryview) and data.obj is self._mmap:
+                    self._data[name] = bytes(data)
+                    data.release()
+            self._mmap.close()
+        self._zipfile.close()
+
+    def __enter__(self) -> "LazyMembers":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class UntrustedArchiveError(ValueError):
+    """An untrusted archive was rejected, e.g. because it exceeds the limits."""
+
+
+class IngestionLimits(BaseModel):
+    """
+    Bounds for reading untrusted pkpass archives, e.g. uploads of partners.
+
+    Real passes are a few hundred kilobytes, the defaults leave plenty of
+    room and still stop zip bombs before they exhaust the memory.
+    """
+
+    max_members: int = Field(default=100, ge=1)
+    """maximum number of files in the archive"""
+
+    max_member_size: int = Field(default=10 * 1024 * 1024, ge=0)
+    """maximum uncompressed size of a single file in bytes"""
+
+    max_total_size: int = Field(default=20 * 1024 * 1024, ge=0)
+    """maximum uncompressed size of all files in bytes"""
+
+    max_ratio: float = Field(default=100.0, gt=0)
+    """maximum ratio of uncompressed to compressed size of a file"""
+
+    check_manifest: bool = True
+    """if the archive has a manifest, the SHA-1 hashes of all files must match it"""
+
+    @classmethod
+    def from_settings(cls, settings) -> "IngestionLimits":
+        """Creates the limits configured in the `Settings`."""
+        return cls(
+            max_members=settings.ingest_max_members,
+            max_member_size=settings.ingest_max_member_size,
+            max_total_size=settings.ingest_max_total_size,
+            max_ratio=settings.ingest_max_ratio,
+        )
+
+    def check_declared(self, infos: list[zipfile.ZipInfo]) -> None:
+        """
+        Checks the sizes declared in the central directory, before anything
+        is decompressed.
+        """
+        if len(infos) > self.max_members:
+            raise UntrustedArchiveError(
+                f"archive has {len(infos)} files, at most {self.max_members} are allowed"
+            )
+        names = set()
+        total = 0
+        for info in infos:
+            if info.filename in names:
+                raise UntrustedArchiveError(f"duplicate file {info.filename}")
+            names.add(info.filename)
+            if info.flag_bits & 0x1:
+                raise UntrustedArchiveError(f"{info.filename} is encrypted")
+            self.check_member(info, info.file_size)
+            total += info.file_size
+        if total > self.max_total_size:
+            raise UntrustedArchiveError(
+                f"archive has {total} bytes uncompressed, "
+                f"at most {self.max_total_size} are allowed"
+            )
+
+    def check_member(self, info: zipfile.ZipInfo, size: int) -> None:
+        """Checks the (so far) uncompressed size of a member."""
+        if size > self.max_member_size:
+            raise UntrustedArchiveError(
+                f"{info.filename} exceeds {self.max_member_size} bytes"
+            )
+        if size > self.max_ratio * max(info.compress_size, 1):
+            raise UntrustedArchiveError(
+                f"{info.filename} exceeds the compression ratio of {self.max_ratio}"
+            )
+
+
+def read_bounded(
+    zip_file: BinaryIO | str | Path,
+    limits: IngestionLimits | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> tuple[dict[str, bytes], dict[str, str]]:
+    """
+    Reads all files of an untrusted archive within the limits.
+
+    The declared sizes are checked up front, the actual sizes while the
+    files are decompressed chunk by chunk, so a violation is detected
+    before more than the allowed number of bytes is held in memory. The
+    SHA-1 hashes are computed on the fly.
+
+    :return: the files and their SHA-1 hex digests
+    :raises UntrustedArchiveError: if the archive violates the limits, is
+        no zip archive or a file cannot be decompressed
+    """
+    if limits is None:
+        limits = IngestionLimits()
+    files: dict[str, bytes] = {}
+    hashes: dict[str, str] = {}
+    total = 0
+    try:
+        zf = zipfile.ZipFile(zip_file)
+    except zipfile.BadZipFile as ex:
+        raise UntrustedArchiveError(f"not a zip archive: {ex}") from ex
+    with zf:
+        infos = zf.infolist()
+        limits.check_declared(infos)
+        for info in infos:
+            sha1 = hashlib.sha1()
+            chunks = []
+            size = 0
+            try:
+                with zf.open(info) as member:
+                    while chunk := member.read(chunk_size):
+                        size += len(chunk)
+                        total += len(chunk)
+                        limits.check_member(info, size)
+                        if total > limits.max_total_size:
+                            raise UntrustedArchiveError(
+                                f"archive exceeds {limits.max_total_size} bytes"
+                            )
+                        sha1.update(chunk)
+                        chunks.append(chunk)
+            except (
+                zipfile.BadZipFile,
+                zlib.error,
+                EOFError,
+                NotImplementedError,
+            ) as ex:
+                # corrupt (e.g. a CRC mismatch) or truncated data, or an
+                # unsupported compression
+                raise UntrustedArchiveError(
+                    f"{info.filename} cannot be decompressed: {ex}"
+                ) from ex
+            files[info.filename] = b"".join(chunks)
+            hashes[info.filename] = sha1.hexdigest()
+
+    if limits.check_manifest and "manifest.json" in files:
+        try:
+            manifest = json.loads(files["manifest.json"])
+        except ValueError as ex:
+            raise UntrustedArchiveError(f"invalid manifest.json: {ex}") from ex
+        expected = {
+            name: digest
+            for name, digest in hashes.items()
+            if name not in ("manifest.json", "signature")
+        }
+        if manifest != expected:
+            raise UntrustedArchiveError("files do not match manifest.json")
+    return files, hashes
@@ -0,0 +1,130 @@
+"""
+Staggered sending of push notifications.
+
+Every device notified by a push calls back right away, to list its
+updatable passes and to fetch the updated pass. Pushing to thousands of
+devices at once therefore results in a storm of requests that have to be
+signed. A campaign spreads the pushes evenly over time instead::
+
+    pacing = PushPacing(window=600, target_fetch_qps=50)
+    progress = await run_campaign(push_tokens, send, pacing, on_progress=print)
+
+The pushes are sent one after the other at fixed times, a push that is
+sent late (e.g. because the APNs are slow) does not shift the following
+ones.
+"""
+
+from edutap.wallet_apple.settings import Settings
+from pydantic import BaseModel
+from pydantic import Field
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Sequence
+from typing import TypeVar
+
+import asyncio
+import datetime
+import time
+
+T = TypeVar("T")
+
+
+class PushPacing(BaseModel):
+    """Pace of the pushes of a campaign, unpaced by default."""
+
+    window: float | None = Field(default=None, gt=0)
+    """minimum duration of a campaign in seconds"""
+
+    target_fetch_qps: float | None = Field(default=None, gt=0)
+    """requests per second the devices may send back, caused by the pushes"""
+
+    fetches_per_push: float = Field(default=2.0, gt=0)
+    """requests a device sends after a push, list and fetch of the pass"""
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "PushPacing":
+        return cls(
+            window=settings.push_campaign_window,
+            target_fetch_qps=settings.push_target_fetch_qps,
+            fetches_per_push=settings.push_fetches_per_device,
+        )
+
+    def interval(self, total: int) -> float:
+        """
+        Seconds between two pushes of a campaign of ``total`` pushes.
+
+        The target QPS sets the highest rate, the window stretches smaller
+        campaigns over its duration.
+        """
+        interval = 0.0
+        if self.target_fetch_qps is not None:
+            interval = self.fetches_per_push / self.target_fetch_qps
+        if self.window is not None and total > 0:
+            interval = max(interval, self.window / total)
+        return interval
+
+
+class CampaignProgress(BaseModel):
+    """State of a running or finished campaign."""
+
+    total: int
+    """number of pushes of the campaign"""
+
+    sent: int = 0
+    """pushes sent so far"""
+
+    updated: int = 0
+    """pushes accepted by the APNs so far"""
+
+    interval: float
+    """planned seconds between two pushes"""
+
+    started: datetime.datetime
+    estimated_completion: datetime.datetime
+
+    @property
+    def done(self) -> bool:
+        return self.sent >= self.total
+
+
+async def run_campaign(
+    pushes: Sequence[T],
+    send: Callable[[T], Awaitable[bool]],
+    pacing: PushPacing | None = None,
+    on_progress: Callable[[CampaignProgress], Any] | None = None,
+) -> CampaignProgress:
+    """
+    Sends the pushes at the pace, reports the progress after every push.
+
+    :param send: sends one push, returns True if it was accepted.
+    :param on_progress: called with the progress after every push,
+        called often for big campaigns, throttle expensive reporting.
+    """
+    interval = (pacing or PushPacing()).interval(len(pushes))
+    started = time.monotonic()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    progress = CampaignProgress(
+        total=len(pushes),
+        interval=interval,
+        started=now,
+        estimated_completion=now
+        + datetime.timedelta(seconds=interval * max(len(pushes) - 1, 0)),
+    )
+    for index, push in enumerate(pushes):
+        delay = started + index * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if await send(push):
+            progress.updated += 1
+        progress.sent += 1
+
+        # behind the plan, if sending takes longer than the interval
+        elapsed = time.monotonic() - started
+        pace = max(interval, elapsed / progress.sent)
+        progress.estimated_completion = datetime.datetime.now(
+            datetime.timezone.utc
+        ) + datetime.timedelta(seconds=pace * (progress.total - progress.sent))
+        if on_progress is not None:
+            on_progress(progress)
+    return progress
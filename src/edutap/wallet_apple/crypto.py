@@ -13,6 +13,7 @@ from typing import Optional
 from typing import Union
 
 import cryptography
+import functools
 import os
 
 
@@ -98,6 +99,33 @@ def load_key_files(
     )
 
 
+def load_signing_identity(
+    private_key_path: Union[str, Path],
+    certificate_path: Union[str, Path],
+    wwdr_certificate_path: Union[str, Path],
+) -> tuple[PrivateKeyTypes, Certificate, Certificate]:
+    """Same as `load_key_files`, but cached.
+
+    The parsed key and certificates are reused until one of the files
+    changes, so they are not parsed again for every signed pass.
+    """
+    paths = (
+        Path(private_key_path),
+        Path(certificate_path),
+        Path(wwdr_certificate_path),
+    )
+    return _load_signing_identity(
+        paths, tuple(path.stat().st_mtime_ns for path in paths)
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _load_signing_identity(
+    paths: tuple[Path, Path, Path], mtimes: tuple[int, int, int]
+) -> tuple[PrivateKeyTypes, Certificate, Certificate]:
+    return load_key_files(*paths)
+
+
 def create_signature(
     manifest: str,
     private_key_path: Union[str, Path],
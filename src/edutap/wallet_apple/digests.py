@@ -0,0 +1,113 @@
+"""
+Content digests of the passes last pushed to the devices.
+
+`api.trigger_update` can render a pass before pushing it and compare
+`PkPass.content_digest` with the digest of the last pushed version. If the
+pass is unchanged, no device is notified, and no device downloads the
+same pass again. The digests are kept in a `DigestStore`:
+`MemoryDigestStore` for one process, `SQLiteDigestStore` to share them
+between workers, or an own implementation installed with
+`use_digest_store`.
+"""
+
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+from typing import Protocol
+from typing import runtime_checkable
+
+import functools
+import sqlite3
+import threading
+
+
+@runtime_checkable
+class DigestStore(Protocol):
+    """Protocol definition of a store of pass digests"""
+
+    def get(self, pass_type_id: str, serial_number: str) -> str | None:
+        """The digest of the pass, None if it is unknown"""
+
+    def put(self, pass_type_id: str, serial_number: str, digest: str) -> None:
+        """Records the digest of the pass"""
+
+
+class MemoryDigestStore:
+    """Digests in the memory of the process."""
+
+    def __init__(self) -> None:
+        self._digests: dict[tuple[str, str], str] = {}
+
+    def get(self, pass_type_id: str, serial_number: str) -> str | None:
+        return self._digests.get((pass_type_id, serial_number))
+
+    def put(self, pass_type_id: str, serial_number: str, digest: str) -> None:
+        self._digests[(pass_type_id, serial_number)] = digest
+
+
+class SQLiteDigestStore:
+    """
+    Digests in a SQLite database, shared by the processes using the file.
+
+    :param path: database file, created if missing.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                " pass_type_id TEXT NOT NULL,"
+                " serial_number TEXT NOT NULL,"
+                " digest TEXT NOT NULL,"
+                " PRIMARY KEY (pass_type_id, serial_number)"
+                ") WITHOUT ROWID"
+            )
+
+    def get(self, pass_type_id: str, serial_number: str) -> str | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM digests"
+                " WHERE pass_type_id = ? AND serial_number = ?",
+                (pass_type_id, serial_number),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, pass_type_id: str, serial_number: str, digest: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?)",
+                (pass_type_id, serial_number, digest),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_installed: list[DigestStore] = []
+
+
+def use_digest_store(digest_store: DigestStore | None) -> None:
+    """Uses the store instead of the one of the settings."""
+    _installed[:] = [digest_store] if digest_store is not None else []
+
+
+@functools.cache
+def _sqlite_digest_store(path: Path) -> SQLiteDigestStore:
+    return SQLiteDigestStore(path)
+
+
+def get_digest_store(settings: Settings | None = None) -> DigestStore | None:
+    """The store in use, None if it is not enabled."""
+    if _installed:
+        return _installed[0]
+    if settings is None:
+        settings = Settings()
+    if settings.pass_digest_store_path is None:
+        return None
+    return _sqlite_digest_store(settings.pass_digest_store_path)
@@ -1,21 +1,42 @@
 from ..settings import Settings
 from edutap.wallet_apple import api
+from edutap.wallet_apple import archive
+from edutap.wallet_apple.ledger import get_update_ledger
 from edutap.wallet_apple.models.handlers import LogEntries
 from edutap.wallet_apple.models.handlers import PushToken
 from edutap.wallet_apple.models.handlers import SerialNumbers
+from edutap.wallet_apple.models.passes import PkPass
 from edutap.wallet_apple.plugins import get_logging_handlers
 from edutap.wallet_apple.plugins import get_pass_data_acquisitions
 from edutap.wallet_apple.plugins import get_pass_registrations
+from edutap.wallet_apple.registration_filter import get_registration_filter
+from edutap.wallet_apple.registrations import get_registration_batcher
+from edutap.wallet_apple.registrations import is_registered
+from edutap.wallet_apple.singleflight import SingleFlight
+from edutap.wallet_apple.store import get_pass_store
+from edutap.wallet_apple.store import READ_CHUNK_SIZE
+from edutap.wallet_apple.throttling import AuthGuard
+from edutap.wallet_apple.throttling import get_auth_guard
+from edutap.wallet_apple.update_cache import get_updatable_passes_cache
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import FastAPI
 from fastapi import Header
 from fastapi import HTTPException
 from fastapi import Request
+from fastapi.responses import Response
 from fastapi.responses import StreamingResponse
+from pathlib import Path
+from starlette.background import BackgroundTask
 from typing import Annotated
+from typing import AsyncIterator
 from typing import BinaryIO
 
+import asyncio
+import contextlib
 import datetime
+import functools
+import os
 
 
 def get_settings() -> Settings:
@@ -47,11 +68,89 @@ router_download_pass = APIRouter(
     tags=["edutap.wallet_apple"],
 )
 
+# renderings of passes in flight, shared by concurrent requests of a pass,
+# e.g. of all devices notified by a push; `render_flights.stats()` gives
+# the waiting requests per pass for metrics
+render_flights: SingleFlight[Path | archive.PkPassStream | bytes] = SingleFlight()
+
+# renderings of a pass changing meanwhile, the last one is served without
+# being stored as current
+STORE_RENDER_ATTEMPTS = 3
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Lifespan of an app with the routers of this module, the worker is
+    warmed up before it takes traffic, see `api.warmup`, the registration
+    filter is filled from the plugins and rebuilt periodically, the
+    registrations left in the journal are queued, and the pending
+    registrations are written when it stops::
+
+        app = FastAPI(lifespan=lifespan)
+    """
+    api.warmup(get_settings())
+    registration_filter = get_registration_filter(get_settings())
+    rebuilds = None
+    if registration_filter is not None:
+        await registration_filter.rebuild()
+        if registration_filter.rebuild_interval > 0:
+            # learns the registrations of the other workers
+            rebuilds = asyncio.create_task(registration_filter.rebuild_periodically())
+    batcher = get_registration_batcher(get_settings())
+    if batcher is not None:
+        # registrations a killed worker left in the journal
+        await batcher.recover()
+    yield
+    if rebuilds is not None:
+        rebuilds.cancel()
+    # pending registrations are written before the worker exits
+    batcher = get_registration_batcher(get_settings())
+    if batcher is not None:
+        await batcher.flush()
+
+
+def invalidate_updatable_passes(
+    device_library_id: str, pass_type_id: str, settings: Settings
+) -> None:
+    """The registrations of the device changed, drop its cached answers."""
+    cache = get_updatable_passes_cache(settings)
+    if cache is not None:
+        cache.invalidate(pass_type_id, device_library_id)
+
+
+def _client_keys(
+    request: Request | None, device_library_id: str | None = None
+) -> list[str]:
+    """The keys of the client address and device, see `throttling.AuthGuard`."""
+    clients = []
+    if request is not None and request.client is not None:
+        clients.append(f"ip:{request.client.host}")
+    if device_library_id is not None:
+        clients.append(f"device:{device_library_id}")
+    return clients
+
+
+def _reject_guarded(
+    guard: AuthGuard, clients: list[str], token: tuple[str | None, ...]
+) -> None:
+    """Rejects clients failing too often and tokens failed before."""
+    reason = guard.check(clients, token)
+    if reason == "throttled":
+        raise HTTPException(
+            status_code=429, detail="Too Many Requests - too many failures"
+        )
+    if reason is not None:
+        raise HTTPException(status_code=401, detail="Unauthorized - failed token")
+
 
 async def check_authorization(
     authorization: str | None,
     pass_type_identifier: str | None = None,
     serial_number: str | None = None,
+    *,
+    request: Request | None = None,
+    device_library_id: str | None = None,
 ) -> None:
     """
     check the authorization token as it comes in the request header for
@@ -60,34 +159,62 @@ async def check_authorization(
     where the authotizationToken is the authentication token that is stored in the
     apple pass
 
-    raises a 401 exception if the token is not correct
+    raises a 401 exception if the token is not correct, and a 429 exception
+    if the client address or device failed too often (see
+    `throttling.AuthGuard`), before the plugins are asked
     """
+    guard = get_auth_guard(get_settings())
+    clients = _client_keys(request, device_library_id)
+    checked = (authorization, pass_type_identifier, serial_number)
+    if guard is not None:
+        _reject_guarded(guard, clients, checked)
 
-    for pass_registration_handler in get_pass_data_acquisitions():
-        if authorization is None:
-            get_settings().get_logger().warn(
-                "check_authorization_failure",
-                authorization=authorization,
-                pass_type_identifier=pass_type_identifier,
-                serial_number=serial_number,
-                reason="no token given",
-                realm="fastapi",
-            )
-            raise HTTPException(status_code=401, detail="Unauthorized - no token give")
-        token = authorization.split(" ")[1]
-        check = await pass_registration_handler.check_authentication_token(
-            pass_type_identifier, serial_number, token
-        )
-        if not check:
-            get_settings().get_logger().warn(
-                "check_authorization_failure",
-                authorization=authorization,
-                pass_type_identifier=pass_type_identifier,
-                serial_number=serial_number,
-                reason="wrong token",
-                realm="fastapi",
+    try:
+        for pass_registration_handler in get_pass_data_acquisitions():
+            if authorization is None:
+                get_settings().get_logger().warn(
+                    "check_authorization_failure",
+                    authorization=authorization,
+                    pass_type_identifier=pass_type_identifier,
+                    serial_number=serial_number,
+                    reason="no token given",
+                    realm="fastapi",
+                )
+                raise HTTPException(
+                    status_code=401, detail="Unauthorized - no token give"
+                )
+            _, _, token = authorization.partition(" ")
+            if not token:
+                get_settings().get_logger().warn(
+                    "check_authorization_failure",
+                    authorization=authorization,
+                    pass_type_identifier=pass_type_identifier,
+                    serial_number=serial_number,
+                    reason="malformed token",
+                    realm="fastapi",
+                )
+                raise HTTPException(
+                    status_code=401, detail="Unauthorized - malformed token"
+                )
+            check = await pass_registration_handler.check_authentication_token(
+                pass_type_identifier, serial_number, token
             )
-            raise HTTPException(status_code=401, detail="Unauthorized - wrong token")
+            if not check:
+                get_settings().get_logger().warn(
+                    "check_authorization_failure",
+                    authorization=authorization,
+                    pass_type_identifier=pass_type_identifier,
+                    serial_number=serial_number,
+                    reason="wrong token",
+                    realm="fastapi",
+                )
+                raise HTTPException(
+                    status_code=401, detail="Unauthorized - wrong token"
+                )
+    except HTTPException:
+        if guard is not None:
+            guard.failed(clients, checked)
+        raise
 
 
 @router_apple_wallet.post(
@@ -129,6 +256,12 @@ async def register_pass(
     :pushToken               - the value needed for Apple Push Notification service
 
     server action: if the authentication token is correct, associate the given push token and device identifier with this pass
+    If registrations are batched (see `registrations.RegistrationBatcher`),
+    the association is written shortly after the response. Known
+    registrations are told from new ones by the plugins implementing
+    `protocols.RegistrationLookup`, behind the registration filter (see
+    `registration_filter.RegistrationFilter`). Without such a plugin the
+    registration is written before the response.
     server response:
     --> if registration succeeded: 201
     --> if this serial number was already registered for this device: 304
@@ -155,13 +288,49 @@ async def register_pass(
         url=request.url,
         push_token=data,
     )
-    await check_authorization(authorization, passTypeIdentifier, serialNumber)
+    await check_authorization(
+        authorization,
+        passTypeIdentifier,
+        serialNumber,
+        request=request,
+        device_library_id=deviceLibraryIdentifier,
+    )
 
+    batcher = get_registration_batcher(settings)
+    registration_filter = get_registration_filter(settings)
+    new = None
     try:
-        for pass_registration_handler in get_pass_registrations():
-            await pass_registration_handler.register_pass(
+        if batcher is not None and batcher.is_pending(
+            deviceLibraryIdentifier, passTypeIdentifier, serialNumber
+        ):
+            # registered shortly before, not written to the plugins yet
+            new = False
+        elif registration_filter is not None:
+            new = await registration_filter.is_new(
+                deviceLibraryIdentifier, passTypeIdentifier, serialNumber
+            )
+        elif batcher is not None:
+            registered = await is_registered(
+                deviceLibraryIdentifier, passTypeIdentifier, serialNumber
+            )
+            new = None if registered is None else not registered
+        if batcher is not None and new is not None:
+            await batcher.register(
                 deviceLibraryIdentifier, passTypeIdentifier, serialNumber, data
             )
+        else:
+            # without a lookup the registration is written before the answer
+            for pass_registration_handler in get_pass_registrations():
+                await pass_registration_handler.register_pass(
+                    deviceLibraryIdentifier, passTypeIdentifier, serialNumber, data
+                )
+        if registration_filter is not None and new:
+            registration_filter.add(
+                (deviceLibraryIdentifier, passTypeIdentifier, serialNumber)
+            )
+        invalidate_updatable_passes(
+            deviceLibraryIdentifier, passTypeIdentifier, settings
+        )
     except Exception as e:
         logger.error(
             "register_pass",
@@ -187,6 +356,8 @@ async def register_pass(
         url=request.url,
         push_token=data,
     )
+    if new is not None:
+        return Response(status_code=201 if new else 200)
 
 
 @router_apple_wallet.delete(
@@ -215,7 +386,13 @@ async def unregister_pass(
     --> if not authorized: 401
 
     """
-    await check_authorization(authorization, passTypeIdentifier, serialNumber)
+    await check_authorization(
+        authorization,
+        passTypeIdentifier,
+        serialNumber,
+        request=request,
+        device_library_id=deviceLibraryIdentifier,
+    )
 
     logger = settings.get_logger()
     logger.info(
@@ -226,11 +403,24 @@ async def unregister_pass(
         realm="fastapi",
         url=request.url,
     )
+    batcher = get_registration_batcher(settings)
     try:
+        if batcher is not None:
+            await batcher.forget(
+                deviceLibraryIdentifier, passTypeIdentifier, serialNumber
+            )
         for pass_registration_handler in get_pass_registrations():
             await pass_registration_handler.unregister_pass(
                 deviceLibraryIdentifier, passTypeIdentifier, serialNumber
             )
+        registration_filter = get_registration_filter(settings)
+        if registration_filter is not None:
+            registration_filter.discard(
+                (deviceLibraryIdentifier, passTypeIdentifier, serialNumber)
+            )
+        invalidate_updatable_passes(
+            deviceLibraryIdentifier, passTypeIdentifier, settings
+        )
     except Exception as e:
         logger.error(
             "unregister_pass",
@@ -286,7 +476,9 @@ async def get_updated_pass(
     --> if auth token is incorrect: 401
     """
 
-    await check_authorization(authorization, passTypeIdentifier, serialNumber)
+    await check_authorization(
+        authorization, passTypeIdentifier, serialNumber, request=request
+    )
 
     logger = settings.get_logger()
     logger.info(
@@ -298,19 +490,12 @@ async def get_updated_pass(
     )
 
     try:
-        pass_data = await get_pass_data(passTypeIdentifier, serialNumber, update=True)
-        settings = Settings()
-        if not settings.pass_data_passthrough:
-            pass_data = await prepare_pass(pass_data)
-        headers = {
-            "Content-Disposition": 'attachment; filename="blurb.pkpass"',
-            "Content-Type": "application/octet-stream",
-            "Last-Modified": f"{datetime.datetime.now()}",
-        }
-        return StreamingResponse(
-            pass_data,
-            headers=headers,
-            media_type="application/vnd.apple.pkpass",
+        return await deliver_pass(
+            passTypeIdentifier,
+            serialNumber,
+            update=True,
+            filename="blurb.pkpass",
+            settings=settings,
         )
     except Exception as e:
         logger.error(
@@ -325,6 +510,119 @@ async def get_updated_pass(
         raise
 
 
+async def deliver_pass(
+    pass_type_identifier: str,
+    serial_number: str,
+    update: bool,
+    filename: str,
+    settings: Settings | None = None,
+) -> Response:
+    """Response with the pass ready for delivery.
+
+    The signed pass is streamed while it is written. If a pass store is
+    configured, a stored rendering is served as file without asking the
+    plugin, and new renderings are stored for all workers to share.
+    Concurrent requests of the same pass share one rendering, see
+    `render_flights`.
+    """
+    if settings is None:
+        settings = get_settings()
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Type": "application/octet-stream",
+        "Last-Modified": f"{datetime.datetime.now()}",
+    }
+    pass_store = get_pass_store(settings)
+    if pass_store is not None:
+        path = pass_store.get_path(pass_type_identifier, serial_number, update)
+        if path is not None:
+            response = _stored_response(path, headers)
+            if response is not None:
+                return response
+
+    async def prepare() -> BinaryIO | archive.PkPassStream:
+        pass_data = await get_pass_data(
+            pass_type_identifier, serial_number, update=update
+        )
+        if settings.pass_data_passthrough:
+            return pass_data
+        # the stream is written anew for every response iterating it
+        return await prepare_pass_stream(pass_data, settings)
+
+    async def render_unstored() -> archive.PkPassStream | bytes:
+        content = await prepare()
+        if isinstance(content, archive.PkPassStream):
+            return content
+        # read once, a file object cannot be shared between responses
+        return content.read()
+
+    async def render() -> Path | archive.PkPassStream | bytes:
+        if pass_store is not None:
+            for _ in range(STORE_RENDER_ATTEMPTS):
+                version = pass_store.version(pass_type_identifier, serial_number)
+                path = pass_store.add(await prepare())
+                # the pass changed while rendering, render the new data
+                if pass_store.set_current(
+                    pass_type_identifier, serial_number, path, version, update
+                ):
+                    break
+            return path
+        return await render_unstored()
+
+    # a request coming in after an update of the pass must not share the
+    # rendering of the old data, the key holds the state of the pass
+    version = None
+    if pass_store is not None:
+        version = pass_store.version(pass_type_identifier, serial_number)
+    update_ledger = get_update_ledger(settings)
+    sequence = None
+    if update_ledger is not None:
+        # the ledger may wait for the write lock of another worker
+        sequence = await asyncio.to_thread(
+            update_ledger.latest_update, pass_type_identifier, serial_number
+        )
+    rendering = await render_flights.do(
+        (pass_type_identifier, serial_number, update, version, sequence), render
+    )
+    if isinstance(rendering, Path):
+        response = _stored_response(rendering, headers)
+        if response is not None:
+            return response
+        # evicted by another worker before it was opened
+        rendering = await render_unstored()
+    if isinstance(rendering, bytes):
+        return Response(
+            rendering, headers=headers, media_type="application/vnd.apple.pkpass"
+        )
+    headers["Content-Length"] = str(len(rendering))
+    return StreamingResponse(
+        rendering,
+        headers=headers,
+        media_type="application/vnd.apple.pkpass",
+    )
+
+
+def _stored_response(path: Path, headers: dict[str, str]) -> Response | None:
+    """
+    Response with the stored archive, None if it was evicted meanwhile.
+
+    The file is opened right away, evicting it while the response is sent
+    does not affect the open file.
+    """
+    try:
+        fh = path.open("rb")
+    except FileNotFoundError:
+        return None
+    headers["Content-Length"] = str(os.fstat(fh.fileno()).st_size)
+    return StreamingResponse(
+        # a sync iterator is read in the thread pool
+        iter(functools.partial(fh.read, READ_CHUNK_SIZE), b""),
+        headers=headers,
+        media_type="application/vnd.apple.pkpass",
+        background=BackgroundTask(fh.close),
+    )
+
+
 async def get_pass_data(
     pass_type_identifier: str,
     serial_number: str,
@@ -340,14 +638,39 @@ async def get_pass_data(
     raise LookupError("Pass not found")
 
 
-async def prepare_pass(pass_data: BinaryIO) -> BinaryIO:
+async def prepare_pass(
+    pass_data: BinaryIO, settings: Settings | None = None
+) -> BinaryIO:
     """Prepare pass for delivery.
 
     An unsigned pass is expected. The team identifier and the web
     service URL are set from global settings and the pass gets signed.
     """
-    settings = Settings()
-    pkpass = api.new(file=pass_data)
+    if settings is None:
+        settings = get_settings()
+    compression = archive.CompressionPolicy.from_settings(settings)
+    return api.pkpass(_prepare_pkpass(pass_data, settings), compression=compression)
+
+
+async def prepare_pass_stream(
+    pass_data: BinaryIO, settings: Settings | None = None
+) -> archive.PkPassStream:
+    """Prepare pass for delivery as stream.
+
+    Same as `prepare_pass`, but the zip file is written on the fly while
+    the response is sent, its size is known in advance.
+    """
+    if settings is None:
+        settings = get_settings()
+    compression = archive.CompressionPolicy.from_settings(settings)
+    return api.pkpass_stream(
+        _prepare_pkpass(pass_data, settings), compression=compression
+    )
+
+
+def _prepare_pkpass(pass_data: BinaryIO, settings: Settings) -> PkPass:
+    pkpass = api.new(file=pass_data, settings=settings)
+    pkpass.deterministic = settings.deterministic_builds
     pkpass.pass_object_safe.teamIdentifier = settings.team_identifier
     # chop off the last part of the path because it contains the
     # apple api version and this is automatically added by the the
@@ -355,8 +678,8 @@ async def prepare_pass(pass_data: BinaryIO) -> BinaryIO:
     apipath = "/".join(router_apple_wallet.prefix.split("/")[:-1])
     weburl = f"https://{settings.domain}:{settings.https_port}{apipath}"
     pkpass.pass_object_safe.webServiceURL = weburl
-    api.sign(pkpass)
-    return api.pkpass(pkpass)
+    api.sign(pkpass, settings)
+    return pkpass
 
 
 @router_apple_wallet.get(
@@ -370,10 +693,17 @@ async def list_updatable_passes(
     passesUpdatedSince: str | None = None,
     *,
     settings: Settings = Depends(get_settings),
-) -> SerialNumbers:
+) -> SerialNumbers | Response:
     """
     see https://developer.apple.com/documentation/walletpasses/get-the-list-of-updatable-passes
 
+    server response:
+    --> if passes were updated: 200, with the serial numbers
+    --> if no pass was updated: 204
+
+    If enabled in the settings, the answers of the plugin are cached for a
+    short time, see `update_cache.UpdatablePassesCache`.
+
     Attention: check for correct authentication token.
     Do not allow it to be called anonymously
     """
@@ -387,24 +717,38 @@ async def list_updatable_passes(
         url=request.url,
     )
 
-    try:
-        for pass_registration_handler in get_pass_data_acquisitions():
-            serial_numbers = await pass_registration_handler.get_update_serial_numbers(
-                deviceLibraryIdentifier, passTypeIdentifier, passesUpdatedSince
-            )
-
-            logger.info(
-                "list_updatable_passes", realm="fastapi", serial_numbers=serial_numbers
+    cache = get_updatable_passes_cache(settings)
+    serial_numbers = None
+    sequence = None
+    if cache is not None:
+        # updates recorded by other workers outdate the cached answers
+        update_ledger = get_update_ledger(settings)
+        if update_ledger is not None:
+            sequence = await asyncio.to_thread(
+                update_ledger.latest_update, passTypeIdentifier
             )
-            return serial_numbers
-
-        logger.info(
-            "list_updatable_passes",
-            realm="fastapi",
-            serial_numbers=serial_numbers,
-            empty=True,
+        serial_numbers = cache.get(
+            deviceLibraryIdentifier, passTypeIdentifier, passesUpdatedSince, sequence
         )
-        return SerialNumbers(serialNumbers=[], lastUpdated="")
+    try:
+        if serial_numbers is None:
+            for pass_registration_handler in get_pass_data_acquisitions():
+                serial_numbers = (
+                    await pass_registration_handler.get_update_serial_numbers(
+                        deviceLibraryIdentifier, passTypeIdentifier, passesUpdatedSince
+                    )
+                )
+                break
+            else:
+                serial_numbers = SerialNumbers(serialNumbers=[], lastUpdated="")
+            if cache is not None:
+                cache.put(
+                    deviceLibraryIdentifier,
+                    passTypeIdentifier,
+                    passesUpdatedSince,
+                    serial_numbers,
+                    sequence,
+                )
     except Exception as e:
         logger.error(
             "list_updatable_passes",
@@ -418,6 +762,17 @@ async def list_updatable_passes(
 
         raise
 
+    if not serial_numbers.serialNumbers:
+        logger.info(
+            "list_updatable_passes",
+            realm="fastapi",
+            serial_numbers=serial_numbers,
+            empty=True,
+        )
+        return Response(status_code=204)
+    logger.info("list_updatable_passes", realm="fastapi", serial_numbers=serial_numbers)
+    return serial_numbers
+
 
 @router_download_pass.get("/download-pass/{token}")
 async def download_pass(
@@ -435,6 +790,7 @@ async def download_pass(
     server response:
     --> if token is correct: 200, with pass data payload as pkpass-file
     --> if token is incorrect: 401
+    --> if the client sent too many incorrect tokens: 429
     """
     logger = settings.get_logger()
     logger.info(
@@ -443,23 +799,33 @@ async def download_pass(
         url=request.url,
     )
 
+    # cryptography is imported on first use, it is slow to import
+    from cryptography.fernet import InvalidToken
+
+    guard = get_auth_guard(settings)
+    clients = _client_keys(request)
+    if guard is not None:
+        _reject_guarded(guard, clients, (token,))
     try:
         pass_type_identifier, serial_number = api.extract_auth_token(token)
-        pass_data = await get_pass_data(
-            pass_type_identifier, serial_number, update=False
+    except (InvalidToken, ValueError):
+        if guard is not None:
+            guard.failed(clients, (token,))
+        logger.warn(
+            "download_pass",
+            realm="fastapi",
+            url=request.url,
+            reason="invalid token",
         )
-        settings = Settings()
-        if not settings.pass_data_passthrough:
-            pass_data = await prepare_pass(pass_data)
-        headers = {
-            "Content-Disposition": f'attachment; filename="{serial_number}.pkpass"',
-            "Content-Type": "application/octet-stream",
-            "Last-Modified": f"{datetime.datetime.now()}",
-        }
-        return StreamingResponse(
-            pass_data,
-            headers=headers,
-            media_type="application/vnd.apple.pkpass",
+        raise HTTPException(status_code=401, detail="Unauthorized - invalid token")
+
+    try:
+        return await deliver_pass(
+            pass_type_identifier,
+            serial_number,
+            update=False,
+            filename=f"{serial_number}.pkpass",
+            settings=settings,
         )
     except Exception as e:
         logger.error(
@@ -0,0 +1,518 @@
+"""
+Ledger of pass updates and device registrations.
+
+Apple Wallet asks for the passes of a device that changed since a tag the
+server handed out before (``passesUpdatedSince``). The ledger numbers
+every update of a pass with a monotonic sequence number and uses the
+number as the tag, so the question is answered by a range scan over the
+updates since the tag instead of a scan over all passes.
+
+Two implementations are provided: `MemoryLedger` for tests and single
+process setups, `SQLiteLedger` to share the ledger between workers. The
+ledger is used by the plugin adapters `LedgerPassRegistration` and
+`LedgerUpdates`, and `api.trigger_update` records the updates::
+
+    # pyproject.toml of the plugin
+    [project.entry-points.'edutap.wallet_apple.plugins']
+    PassRegistrationLedger = "edutap.wallet_apple.ledger:LedgerPassRegistration"
+
+    # the data acquisition plugin takes updatable passes and push tokens
+    # from the ledger
+    class PassDataAcquisition(LedgerUpdates):
+        ...
+
+The plugin adapters and the handlers call the ledger in a worker thread,
+waiting for the write lock of `SQLiteLedger` does not block the event loop.
+"""
+
+from collections import OrderedDict
+from edutap.wallet_apple.models.handlers import PushToken
+from edutap.wallet_apple.models.handlers import SerialNumbers
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+from typing import AsyncIterator
+from typing import Protocol
+from typing import runtime_checkable
+
+import asyncio
+import functools
+import sqlite3
+import threading
+
+
+@runtime_checkable
+class UpdateLedger(Protocol):
+    """
+    Protocol definition of the ledgers
+
+    Tags are the sequence numbers as strings. Unknown tags, e.g. of another
+    ledger, are treated as no tag: all passes of the device are updatable.
+    """
+
+    def record_update(self, pass_type_id: str, serial_number: str) -> int:
+        """Records that the pass changed, returns its new sequence number."""
+
+    def register(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+        push_token: str | None = None,
+    ) -> bool:
+        """Registers the pass on the device, True if it was not registered."""
+
+    def unregister(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        """Unregisters the pass from the device, True if it was registered."""
+
+    def is_registered(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        """True if the pass is registered on the device."""
+
+    def registrations(self) -> list[tuple[str, str, str]]:
+        """All registrations as (device, pass type, serial number)."""
+
+    def updated_since(
+        self, device_library_id: str, pass_type_id: str, tag: str | None = None
+    ) -> SerialNumbers:
+        """Registered passes of the device updated after the tag, with a new tag."""
+
+    def push_tokens(self, pass_type_id: str, serial_number: str) -> list[PushToken]:
+        """Push tokens of the devices the pass is registered on."""
+
+    def latest_update(self, pass_type_id: str, serial_number: str | None = None) -> int:
+        """
+        Sequence number of the last update of the pass type, or of the pass
+        if a serial number is given, 0 if there is none.
+        """
+
+
+def _parse_tag(tag: str | None) -> int | None:
+    if tag is None or not tag.isdigit():
+        return None
+    return int(tag)
+
+
+class MemoryLedger:
+    """Ledger in the memory of the process."""
+
+    def __init__(self) -> None:
+        self._seq = 0
+        # per pass type the passes in order of their last update
+        self._updates: dict[str, OrderedDict[str, int]] = {}
+        # push tokens per registration, by device and pass type
+        self._devices: dict[tuple[str, str], dict[str, str | None]] = {}
+        self._passes: dict[tuple[str, str], set[str]] = {}
+        self._lock = threading.Lock()
+
+    def record_update(self, pass_type_id: str, serial_number: str) -> int:
+        with self._lock:
+            self._seq += 1
+            updates = self._updates.setdefault(pass_type_id, OrderedDict())
+            updates[serial_number] = self._seq
+            updates.move_to_end(serial_number)
+            return self._seq
+
+    def register(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+        push_token: str | None = None,
+    ) -> bool:
+        with self._lock:
+            serials = self._devices.setdefault((device_library_id, pass_type_id), {})
+            new = serial_number not in serials
+            serials[serial_number] = push_token
+            self._passes.setdefault((pass_type_id, serial_number), set()).add(
+                device_library_id
+            )
+            return new
+
+    def unregister(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        with self._lock:
+            serials = self._devices.get((device_library_id, pass_type_id), {})
+            if serial_number not in serials:
+                return False
+            del serials[serial_number]
+            self._passes[(pass_type_id, serial_number)].discard(device_library_id)
+            return True
+
+    def is_registered(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        with self._lock:
+            return serial_number in self._devices.get(
+                (device_library_id, pass_type_id), {}
+            )
+
+    def registrations(self) -> list[tuple[str, str, str]]:
+        with self._lock:
+            return [
+                (device, pass_type_id, serial_number)
+                for (device, pass_type_id), serials in self._devices.items()
+                for serial_number in serials
+            ]
+
+    def updated_since(
+        self, device_library_id: str, pass_type_id: str, tag: str | None = None
+    ) -> SerialNumbers:
+        since = _parse_tag(tag)
+        with self._lock:
+            registered = self._devices.get((device_library_id, pass_type_id), {})
+            if since is None:
+                serial_numbers = list(registered)
+            else:
+                serial_numbers = []
+                updates = self._updates.get(pass_type_id, OrderedDict())
+                # newest first, up to the tag
+                for serial_number in reversed(updates):
+                    if updates[serial_number] <= since:
+                        break
+                    if serial_number in registered:
+                        serial_numbers.append(serial_number)
+                serial_numbers.reverse()
+            return SerialNumbers(
+                serialNumbers=serial_numbers, lastUpdated=str(self._seq)
+            )
+
+    def push_tokens(self, pass_type_id: str, serial_number: str) -> list[PushToken]:
+        with self._lock:
+            tokens = []
+            for device in self._passes.get((pass_type_id, serial_number), ()):
+                push_token = self._devices[(device, pass_type_id)][serial_number]
+                if push_token is not None:
+                    tokens.append(
+                        PushToken(
+                            pushToken=push_token,
+                            deviceLibraryIdentifier=device,
+                            passTypeIdentifier=pass_type_id,
+                        )
+                    )
+            return tokens
+
+    def latest_update(self, pass_type_id: str, serial_number: str | None = None) -> int:
+        with self._lock:
+            updates = self._updates.get(pass_type_id)
+            if not updates:
+                return 0
+            if serial_number is not None:
+                return updates.get(serial_number, 0)
+            return updates[next(reversed(updates))]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS head (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO head (id, seq) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS updates (
+    pass_type_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (pass_type_id, serial_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS updates_seq ON updates (pass_type_id, seq);
+CREATE TABLE IF NOT EXISTS registrations (
+    device_library_id TEXT NOT NULL,
+    pass_type_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    push_token TEXT,
+    PRIMARY KEY (device_library_id, pass_type_id, serial_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS registrations_pass
+    ON registrations (pass_type_id, serial_number);
+"""
+
+
+class SQLiteLedger:
+    """
+    Ledger in a SQLite database, shared by the processes using the file.
+
+    :param path: database file, created if missing.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def _transaction(
+        self, *statements: tuple[str, tuple], write: bool = True
+    ) -> list[list[tuple]]:
+        """
+        Runs the statements in one transaction. Writing transactions take
+        the write lock up front, reading ones read a snapshot of the
+        database without blocking the writers (WAL mode).
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE" if write else "BEGIN DEFERRED")
+            try:
+                results = [
+                    self._db.execute(sql, params).fetchall()
+                    for sql, params in statements
+                ]
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return results
+
+    def record_update(self, pass_type_id: str, serial_number: str) -> int:
+        results = self._transaction(
+            ("UPDATE head SET seq = seq + 1 WHERE id = 0", ()),
+            (
+                "INSERT OR REPLACE INTO updates (pass_type_id, serial_number, seq)"
+                " SELECT ?, ?, seq FROM head WHERE id = 0",
+                (pass_type_id, serial_number),
+            ),
+            ("SELECT seq FROM head WHERE id = 0", ()),
+        )
+        return results[2][0][0]
+
+    def register(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+        push_token: str | None = None,
+    ) -> bool:
+        key = (device_library_id, pass_type_id, serial_number)
+        results = self._transaction(
+            (
+                "SELECT 1 FROM registrations WHERE device_library_id = ?"
+                " AND pass_type_id = ? AND serial_number = ?",
+                key,
+            ),
+            (
+                "INSERT OR REPLACE INTO registrations (device_library_id,"
+                " pass_type_id, serial_number, push_token) VALUES (?, ?, ?, ?)",
+                (*key, push_token),
+            ),
+        )
+        return not results[0]
+
+    def unregister(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM registrations WHERE device_library_id = ?"
+                " AND pass_type_id = ? AND serial_number = ?",
+                (device_library_id, pass_type_id, serial_number),
+            )
+            return cursor.rowcount > 0
+
+    def is_registered(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM registrations WHERE device_library_id = ?"
+                " AND pass_type_id = ? AND serial_number = ?",
+                (device_library_id, pass_type_id, serial_number),
+            ).fetchone()
+        return row is not None
+
+    def registrations(self) -> list[tuple[str, str, str]]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT device_library_id, pass_type_id, serial_number"
+                " FROM registrations"
+            ).fetchall()
+
+    def updated_since(
+        self, device_library_id: str, pass_type_id: str, tag: str | None = None
+    ) -> SerialNumbers:
+        since = _parse_tag(tag)
+        query: tuple[str, tuple]
+        if since is None:
+            query = (
+                "SELECT serial_number FROM registrations"
+                " WHERE device_library_id = ? AND pass_type_id = ?"
+                " ORDER BY serial_number",
+                (device_library_id, pass_type_id),
+            )
+        else:
+            # range scan of the updates since the tag, index lookup of the
+            # registration of each
+            query = (
+                "SELECT u.serial_number FROM updates u JOIN registrations r"
+                " ON r.device_library_id = ? AND r.pass_type_id = u.pass_type_id"
+                " AND r.serial_number = u.serial_number"
+                " WHERE u.pass_type_id = ? AND u.seq > ? ORDER BY u.seq",
+                (device_library_id, pass_type_id, since),
+            )
+        # head and updates of the same snapshot
+        head, rows = self._transaction(
+            ("SELECT seq FROM head WHERE id = 0", ()), query, write=False
+        )
+        return SerialNumbers(
+            serialNumbers=[row[0] for row in rows], lastUpdated=str(head[0][0])
+        )
+
+    def push_tokens(self, pass_type_id: str, serial_number: str) -> list[PushToken]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT device_library_id, push_token FROM registrations"
+                " WHERE pass_type_id = ? AND serial_number = ?"
+                " AND push_token IS NOT NULL",
+                (pass_type_id, serial_number),
+            ).fetchall()
+        return [
+            PushToken(
+                pushToken=push_token,
+                deviceLibraryIdentifier=device,
+                passTypeIdentifier=pass_type_id,
+            )
+            for device, push_token in rows
+        ]
+
+    def latest_update(self, pass_type_id: str, serial_number: str | None = None) -> int:
+        with self._lock:
+            if serial_number is not None:
+                row = self._db.execute(
+                    "SELECT seq FROM updates"
+                    " WHERE pass_type_id = ? AND serial_number = ?",
+                    (pass_type_id, serial_number),
+                ).fetchone()
+            else:
+                # last entry of the index on (pass_type_id, seq)
+                row = self._db.execute(
+                    "SELECT MAX(seq) FROM updates WHERE pass_type_id = ?",
+                    (pass_type_id,),
+                ).fetchone()
+        if row is None:
+            return 0
+        return row[0] or 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_installed: list[UpdateLedger] = []
+
+
+def use_update_ledger(ledger: UpdateLedger | None) -> None:
+    """Uses the ledger instead of the one of the settings, e.g. a `MemoryLedger`."""
+    _installed[:] = [ledger] if ledger is not None else []
+
+
+@functools.cache
+def _sqlite_ledger(path: Path) -> SQLiteLedger:
+    return SQLiteLedger(path)
+
+
+def get_update_ledger(settings: Settings | None = None) -> UpdateLedger | None:
+    """The ledger in use, None if it is not enabled."""
+    if _installed:
+        return _installed[0]
+    if settings is None:
+        settings = Settings()
+    if settings.update_ledger_path is None:
+        return None
+    return _sqlite_ledger(settings.update_ledger_path)
+
+
+def _require_ledger() -> UpdateLedger:
+    ledger = get_update_ledger()
+    if ledger is None:
+        raise LookupError(
+            "no update ledger configured, set EDUTAP_WALLET_APPLE_UPDATE_LEDGER_PATH"
+        )
+    return ledger
+
+
+class LedgerPassRegistration:
+    """
+    `PassRegistration` plugin keeping the registrations in the ledger, it
+    implements `protocols.RegistrationLookup` as well.
+    """
+
+    async def register_pass(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+        push_token: PushToken | None,
+    ) -> None:
+        await asyncio.to_thread(
+            _require_ledger().register,
+            device_library_id,
+            pass_type_id,
+            serial_number,
+            push_token.pushToken if push_token is not None else None,
+        )
+
+    async def unregister_pass(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+    ) -> None:
+        await asyncio.to_thread(
+            _require_ledger().unregister,
+            device_library_id,
+            pass_type_id,
+            serial_number,
+        )
+
+    async def is_registered(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+    ) -> bool:
+        return await asyncio.to_thread(
+            _require_ledger().is_registered,
+            device_library_id,
+            pass_type_id,
+            serial_number,
+        )
+
+    async def registrations(self) -> AsyncIterator[tuple[str, str, str]]:
+        for registration in await asyncio.to_thread(_require_ledger().registrations):
+            yield registration
+
+
+class LedgerUpdates:
+    """
+    Base class of `PassDataAcquisition` plugins, answers the update related
+    calls from the ledger. The plugin implements `get_pass_data` and
+    `check_authentication_token`.
+    """
+
+    async def get_push_tokens(
+        self,
+        device_library_id: str | None,
+        pass_type_id: str,
+        serial_number: str,
+    ) -> list[PushToken]:
+        return await asyncio.to_thread(
+            _require_ledger().push_tokens, pass_type_id, serial_number
+        )
+
+    async def get_update_serial_numbers(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        last_updated: str | None = None,
+    ) -> SerialNumbers:
+        return await asyncio.to_thread(
+            _require_ledger().updated_since,
+            device_library_id,
+            pass_type_id,
+            last_updated,
+        )
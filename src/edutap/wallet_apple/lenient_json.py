@@ -0,0 +1,55 @@
+"""
+Tolerant reading of pass.json files.
+
+Apple Wallet accepts pass.json files that are not strictly valid JSON,
+e.g. the sample passes of Apple contain trailing commas. Strict JSON is
+parsed with `json.loads` directly. Only if that fails, the quirks are
+removed in one regular expression pass, which skips string literals, and
+the result is parsed again:
+
+- a UTF-8 byte order mark,
+- ``// line`` and ``/* block */`` comments,
+- trailing commas in objects and arrays,
+- unescaped control characters (e.g. tabs) in strings.
+"""
+
+from typing import Any
+
+import json
+import re
+
+_BOM = "\ufeff"
+
+_COMMENT = r"//[^\n]*|/\*.*?\*/"
+
+_QUIRKS = re.compile(
+    rf"""
+    ("(?:[^"\\]|\\.)*")                     # string literal, kept as is
+    | {_COMMENT}                            # comment
+    | ,(?=(?:\s|{_COMMENT})*[\]}}])         # trailing comma
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+
+def _replace(match: re.Match) -> str:
+    string = match.group(1)
+    if string is not None:
+        return string
+    # keep a separator in place of comments, drop trailing commas
+    return " " if match.group(0)[0] == "/" else ""
+
+
+def loads(data: str | bytes | bytearray) -> Any:
+    """
+    Parses JSON with the quirks tolerated by Apple Wallet.
+
+    :raises json.JSONDecodeError: if the data is invalid even with the quirks removed
+    """
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError:
+        pass
+    if not isinstance(data, str):
+        data = bytes(data).decode("utf-8-sig")
+    return json.loads(_QUIRKS.sub(_replace, data.lstrip(_BOM)), strict=False)
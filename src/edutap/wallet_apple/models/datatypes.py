@@ -1,7 +1,7 @@
-from pydantic import BaseModel
+from edutap.wallet_apple.models.tracking import TrackedModel
 
 
-class Location(BaseModel):
+class Location(TrackedModel):
     """
     An object that represents a location that the system uses to show a relevant pass.
     see: https://developer.apple.com/documentation/walletpasses/pass/locations-data.dictionary
@@ -36,7 +36,7 @@ class Location(BaseModel):
     """
 
 
-class Beacon(BaseModel):
+class Beacon(TrackedModel):
     """
     An object that represents the identifier of a Bluetooth Low Energy beacon the system uses to show a relevant pass.
 
@@ -72,7 +72,7 @@ class Beacon(BaseModel):
     """
 
 
-class RelevantDate(BaseModel):
+class RelevantDate(TrackedModel):
     """
     An object that represents a date interval that the system uses to show a relevant pass.
 
@@ -101,7 +101,7 @@ class RelevantDate(BaseModel):
     """
 
 
-class NFC(BaseModel):
+class NFC(TrackedModel):
     """
     An object that represents the near-field communication (NFC) payload the device passes to an Apple Pay terminal.
 
@@ -22,6 +22,18 @@ class PushToken(BaseModel):
     passTypeIdentifier: str | None = None
 
 
+class Registration(BaseModel):
+    """
+    A pass registered on a device for update notifications, as handed to
+    `protocols.BatchPassRegistration` plugins.
+    """
+
+    deviceLibraryIdentifier: DeviceTypeIdentifier
+    passTypeIdentifier: str
+    serialNumber: str
+    pushToken: PushToken | None = None
+
+
 class SerialNumbers(BaseModel):
     """
     An object that contains serial numbers for the updatable passes on a device.
@@ -1,8 +1,8 @@
 from collections import OrderedDict
-from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
-from cryptography.x509 import Certificate
-from edutap.wallet_apple import crypto
+from edutap.wallet_apple import archive
+from edutap.wallet_apple import lenient_json
 from edutap.wallet_apple.models import semantic_tags
+from edutap.wallet_apple.models import tracking
 from edutap.wallet_apple.models.datatypes import Beacon
 from edutap.wallet_apple.models.datatypes import Location as Pass_Location
 from edutap.wallet_apple.models.datatypes import NFC
@@ -12,20 +12,27 @@ from edutap.wallet_apple.models.enums import BarcodeFormat
 from edutap.wallet_apple.models.enums import DateStyle
 from edutap.wallet_apple.models.enums import NumberStyle
 from edutap.wallet_apple.models.enums import TransitType
+from edutap.wallet_apple.models.tracking import TrackedModel
+from edutap.wallet_apple.models.unions import best_match
 from io import BytesIO
 from pathlib import Path
+from pydantic import AfterValidator
 from pydantic import AnyHttpUrl
 from pydantic import AnyUrl
 from pydantic import BaseModel
 from pydantic import computed_field
 from pydantic import ConfigDict
-from pydantic import EmailStr
 from pydantic import model_serializer
 from pydantic import SerializationInfo
-from pydantic.fields import FieldInfo
+from pydantic import Tag
+from pydantic import WithJsonSchema
+from pydantic.networks import validate_email
+from typing import Annotated
 from typing import Any
 from typing import Dict
 from typing import Literal
+from typing import TypeAlias
+from typing import Union
 from typing_extensions import deprecated
 
 import base64
@@ -34,9 +41,12 @@ import hashlib
 import json
 import pydantic
 import typing
-import yaml
 import zipfile
 
+if typing.TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
+    from cryptography.x509 import Certificate
+
 
 def bytearray_to_base64(bytearr):
     encoded_data = base64.b64encode(bytearr)
@@ -48,11 +58,44 @@ def base64_to_bytearray(base64_str):
     return decoded_data
 
 
+def _canonical_json(data: Any) -> str:
+    """pass.json with sorted keys for reproducible builds"""
+    return json.dumps(data, indent=4, sort_keys=True, ensure_ascii=False)
+
+
+def _dump_pass_json(
+    pass_object: "Pass", deterministic: bool = False, warnings: bool = True
+) -> str:
+    """pass.json of the pass object, without None values"""
+    if deterministic:
+        return _canonical_json(
+            pass_object.model_dump(
+                mode="json", exclude_none=True, by_alias=True, warnings=warnings
+            )
+        )
+    return pass_object.model_dump_json(
+        exclude_none=True, by_alias=True, indent=4, warnings=warnings
+    )
+
+
+def _validate_email(value: str) -> str:
+    return validate_email(value)[1]
+
+
+# same as `pydantic.EmailStr`, which imports email-validator when the model
+# is defined, here it is imported when the first email address is validated
+EmailStr = Annotated[
+    str,
+    AfterValidator(_validate_email),
+    WithJsonSchema({"type": "string", "format": "email"}),
+]
+
+
 # Barcode formats that are supported by iOS 6 and 7
 legacy_barcode_formats = [BarcodeFormat.PDF417, BarcodeFormat.QR, BarcodeFormat.AZTEC]
 
 
-class PassFieldContent(BaseModel):
+class PassFieldContent(TrackedModel):
     """
     An object that represents the information to display in a field on a pass.
     see: https://developer.apple.com/documentation/walletpasses/passfieldcontent
@@ -265,6 +308,16 @@ class SemanticPassFieldContent(PassFieldContent):
     """
 
 
+# fields with semantic tags are recognised by their "semantics" key
+FieldContent: TypeAlias = Annotated[
+    Union[
+        Annotated[PassFieldContent, Tag("PassFieldContent")],
+        Annotated[SemanticPassFieldContent, Tag("SemanticPassFieldContent")],
+    ],
+    best_match(PassFieldContent, SemanticPassFieldContent),
+]
+
+
 class AuxiliaryFields(PassFieldContent):
     """
     An object that represents the fields that display additional information on the front of a pass.
@@ -286,7 +339,7 @@ class AuxiliaryFields(PassFieldContent):
 Field = PassFieldContent  # Alias for backward compatibility
 
 
-class Barcode(BaseModel):
+class Barcode(TrackedModel):
     format: BarcodeFormat = BarcodeFormat.PDF417  # Required. Barcode format
     message: str  # Required. Message or payload to be displayed as a barcode
     messageEncoding: str = (
@@ -298,24 +351,22 @@ class Barcode(BaseModel):
 IBeacon = Beacon  # Alias for backward compatibility
 
 
-class PassInformation(BaseModel):
+class PassInformation(TrackedModel):
     model_config = ConfigDict(extra="forbid")  # verbietet zusätzliche Felder
 
-    headerFields: typing.List[PassFieldContent | SemanticPassFieldContent] = (
-        pydantic.Field(default_factory=list)
+    headerFields: typing.List[FieldContent] = pydantic.Field(
+        default_factory=list
     )  # Optional. Additional fields to be displayed in the header of the pass
-    primaryFields: typing.List[PassFieldContent | SemanticPassFieldContent] = (
-        pydantic.Field(default_factory=list)
+    primaryFields: typing.List[FieldContent] = pydantic.Field(
+        default_factory=list
     )  # Optional. Fields to be displayed prominently in the pass
-    secondaryFields: typing.List[PassFieldContent | SemanticPassFieldContent] = (
-        pydantic.Field(default_factory=list)
+    secondaryFields: typing.List[FieldContent] = pydantic.Field(
+        default_factory=list
     )  # Optional. Fields to be displayed on the front of the pass
-    backFields: typing.List[PassFieldContent | SemanticPassFieldContent] = (
-        pydantic.Field(default_factory=list)
+    backFields: typing.List[FieldContent] = pydantic.Field(
+        default_factory=list
     )  # Optional. Fields to be displayed on the back of the pass
-    auxiliaryFields: typing.List[PassFieldContent | SemanticPassFieldContent] = (
-        pydantic.Field(default_factory=list)
-    )
+    auxiliaryFields: typing.List[FieldContent] = pydantic.Field(default_factory=list)
     """
     Optional.
     An object that represents the fields that display additional information on the front of a pass.
@@ -326,6 +377,7 @@ class PassInformation(BaseModel):
     )  # Optional. Additional fields to be displayed on the front of the pass
 
     def addHeaderField(self, key, value, label, textAlignment=None):
+        tracking.touch(self)
         self.headerFields.append(
             PassFieldContent(
                 key=key, value=value, label=label, textAlignment=textAlignment
@@ -333,6 +385,7 @@ class PassInformation(BaseModel):
         )
 
     def addPrimaryField(self, key, value, label, textAlignment=None):
+        tracking.touch(self)
         self.primaryFields.append(
             PassFieldContent(
                 key=key, value=value, label=label, textAlignment=textAlignment
@@ -340,6 +393,7 @@ class PassInformation(BaseModel):
         )
 
     def addSecondaryField(self, key, value, label, textAlignment=None):
+        tracking.touch(self)
         self.secondaryFields.append(
             PassFieldContent(
                 key=key, value=value, label=label, textAlignment=textAlignment
@@ -347,6 +401,7 @@ class PassInformation(BaseModel):
         )
 
     def addBackField(self, key, value, label, textAlignment=None):
+        tracking.touch(self)
         self.backFields.append(
             PassFieldContent(
                 key=key, value=value, label=label, textAlignment=textAlignment
@@ -354,6 +409,7 @@ class PassInformation(BaseModel):
         )
 
     def addAuxiliaryField(self, key, value, label, textAlignment=None):
+        tracking.touch(self)
         self.auxiliaryFields.append(
             PassFieldContent(
                 key=key, value=value, label=label, textAlignment=textAlignment
@@ -361,6 +417,7 @@ class PassInformation(BaseModel):
         )
 
     def addAdditionalInfoFields(self, field_data: PassFieldContent | dict):
+        tracking.touch(self)
         self.additionalInfoFields.append(field_data)
 
 
@@ -419,7 +476,7 @@ class StoreCard(PassInformation):
     """
 
 
-class Pass(BaseModel):
+class Pass(TrackedModel):
     """
     Represents a pass object. This is the base class for all pass types.
 
@@ -836,6 +893,13 @@ class Pass(BaseModel):
     # experimental/reverse engineered
     revoked: bool = False
 
+    # the pass style, a pass has one of them, see `pass_model_registry`
+    boardingPass: BoardingPass | None = None
+    coupon: Coupon | None = None
+    eventTicket: EventTicket | None = None
+    generic: Generic | None = None
+    storeCard: StoreCard | None = None
+
     @property
     def pass_information(self):
         """Returns the pass information object by checking all passmodel entries using all()"""
@@ -851,14 +915,9 @@ class Pass(BaseModel):
         """
         validates a pass json string and returns a Pass object
         """
-        try:
-            data = json.loads(json_str)
-        except json.JSONDecodeError:
-            # in case of for example trailing commas, we use yaml
-            # to parse the json string which swallows trailing commas
-            # apple passes are allowed to have trailing commas, so we
-            # have to tolerate it too
-            data = yaml.safe_load(json_str)
+        # apple passes are allowed to have for example trailing commas,
+        # so we have to tolerate them too
+        data = lenient_json.loads(json_str)
         return cls.model_validate(data)
 
 
@@ -873,19 +932,95 @@ class PkPass(BaseModel):
 
     pass_object: Pass | None = None
 
+    _pass_json_pending: bool = pydantic.PrivateAttr(default=False)
+    """pass.json of a lazily loaded archive or of trusted data is validated
+    on first access"""
+
+    _pass_json_cache: tuple[Pass, int, bool, bytes, str] | None = pydantic.PrivateAttr(
+        default=None
+    )
+    """pass object, generation and deterministic flag the cached pass.json
+    was serialised from, the pass.json bytes and their SHA-1"""
+
     @property
     def pass_object_safe(self):
+        if self.pass_object is None and self._pass_json_pending:
+            self.pass_object = Pass.from_json(bytes(self.files["pass.json"]))
+            self._pass_json_pending = False
         if self.pass_object is None:
             raise ValueError("Pass object is not set")
         return self.pass_object
 
+    @property
+    def pass_type_identifier(self) -> str:
+        """
+        The pass type identifier, read from a pre-rendered pass.json (e.g.
+        of a `templates.PassTemplate`) without building the pass object.
+        """
+        if self.pass_object is not None:
+            return self.pass_object.passTypeIdentifier
+        if "pass.json" not in self.files:
+            raise ValueError("Pass object is not set")
+        data = lenient_json.loads(bytes(self.files["pass.json"]))
+        if not isinstance(data.get("passTypeIdentifier"), str):
+            raise ValueError("pass.json has no passTypeIdentifier")
+        return data["passTypeIdentifier"]
+
     files: dict = pydantic.Field(default_factory=dict, exclude=True)
     """# Holds the files to include in the .pkpass"""
 
+    deterministic: bool = pydantic.Field(default=False, exclude=True)
+    """
+    Reproducible builds: pass.json keys and manifest entries are sorted,
+    zip entries are written in name order with a fixed timestamp, so the
+    same content always results in the same bytes.
+    """
+
     @classmethod
     def from_pass(cls, pass_object: Pass):
         return cls(pass_object=pass_object)
 
+    def close(self) -> None:
+        """
+        Closes the archive of a lazily loaded pass, see
+        `archive.LazyMembers.close`. The pass is a context manager doing so
+        as well. Nothing to do for other passes.
+        """
+        if isinstance(self.files, archive.LazyMembers):
+            self.files.close()
+
+    def __enter__(self) -> "PkPass":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @classmethod
+    def from_trusted(cls, data: dict[str, Any]) -> "PkPass":
+        """
+        Creates a PkPass from trusted pass data, e.g. produced by our own
+        pipeline from validated models, without validating it.
+
+        The pass is constructed without validation and serialised as
+        pass.json like a validated one, with its defaults and without None
+        values, the nested data is kept as it is. Signing and exporting do
+        not build the `Pass` model at all. It is validated only when
+        `pass_object_safe` is used.
+        """
+        res = cls()
+        fields = dict(data)
+        if fields.get("barcodes"):
+            # the computed legacy barcode is made from the first one
+            fields["barcodes"] = [
+                Barcode.model_construct(**barcode) for barcode in fields["barcodes"]
+            ]
+        # the nested models are plain data, pydantic would warn about them
+        res.files["pass.json"] = _dump_pass_json(
+            Pass.model_construct(**fields), warnings=False
+        ).encode("utf-8")
+        res._pass_json_pending = True
+        return res
+
     @property
     def is_signed(self):
         return self.files.get("signature") is not None
@@ -919,14 +1054,17 @@ class PkPass(BaseModel):
 
         """
         res: Any
+        pass_object = (
+            self.pass_object_safe if self._pass_json_pending else self.pass_object
+        )
         if info.mode == "zip":
             res = self._build_zip()
         elif info.mode == "python":
-            res = self.pass_object.model_dump() if self.pass_object else {}
+            res = pass_object.model_dump() if pass_object else {}
         elif info.mode == "json":
             res = (
-                self.pass_object.model_dump_json(exclude_none=True, indent=4)
-                if self.pass_object
+                pass_object.model_dump_json(exclude_none=True, indent=4)
+                if pass_object
                 else {}
             )
         elif info.mode == "BytesIO":
@@ -936,26 +1074,99 @@ class PkPass(BaseModel):
 
         return res
 
-    def as_zip_bytesio(self) -> BytesIO:
+    def as_zip_bytesio(
+        self, compression: archive.CompressionPolicy | None = None
+    ) -> BytesIO:
         """
         creates a zip file and gives it back as a BytesIO object
         """
         res = BytesIO()
-        self._build_zip(res)
+        self._build_zip(res, compression=compression)
         res.seek(0)
         return res
 
+    def as_zip_stream(
+        self,
+        chunk_size: int = archive.DEFAULT_CHUNK_SIZE,
+        compression: archive.CompressionPolicy | None = None,
+    ) -> archive.PkPassStream:
+        """
+        creates a streaming zip writer with the size known in advance,
+        the archive is written on the fly while iterating over it
+        """
+        if "pass.json" not in self.files:
+            self.files["pass.json"] = self._pass_json_bytes[0]
+        if self.deterministic:
+            return archive.PkPassStream(
+                dict(sorted(self.files.items())),
+                chunk_size=chunk_size,
+                date_time=archive.DETERMINISTIC_DATE_TIME,
+                compression=compression,
+            )
+        return archive.PkPassStream(
+            self.files, chunk_size=chunk_size, compression=compression
+        )
+
     @property
     def _pass_dict(self) -> dict[str, Any]:
-        if self.pass_object is None:
-            raise ValueError("Pass object is not set")
-        return self.pass_object.model_dump(exclude_none=True, round_trip=True)
+        return self.pass_object_safe.model_dump(exclude_none=True, round_trip=True)
 
     @property
     def _pass_json(self) -> str:
+        return self._pass_json_bytes[0].decode("utf-8")
+
+    @property
+    def _pass_json_bytes(self) -> tuple[bytes, str]:
+        """
+        pass.json as bytes and its SHA-1 hex digest.
+
+        The serialisation is cached until a field of the pass or of a model in
+        it is assigned (see `tracking`), so signing and exporting serialise
+        the pass only once. Changes of lists or dicts in the pass are not
+        tracked, see `invalidate_pass_json`.
+        """
+        pass_object = self.pass_object
+        if pass_object is None:
+            pass_json = self._render_pass_json().encode("utf-8")
+            return pass_json, hashlib.sha1(pass_json).hexdigest()
+        cache = self._pass_json_cache
+        if (
+            cache is None
+            or cache[0] is not pass_object
+            or cache[1] != tracking.generation(pass_object)
+            or cache[2] != self.deterministic
+        ):
+            tracking.watch(pass_object)
+            generation = tracking.generation(pass_object)
+            pass_json = self._render_pass_json().encode("utf-8")
+            cache = self._pass_json_cache = (
+                pass_object,
+                generation,
+                self.deterministic,
+                pass_json,
+                hashlib.sha1(pass_json).hexdigest(),
+            )
+        return cache[3], cache[4]
+
+    def invalidate_pass_json(self) -> None:
+        """
+        Forgets the cached pass.json. Needed after changing lists or dicts of
+        the pass object in place, e.g. appending a field to
+        ``pass_object.storeCard.backFields``. The ``add...Field`` methods of
+        the pass models do not need it.
+        """
+        self._pass_json_cache = None
+
+    def _render_pass_json(self) -> str:
         if self.pass_object is None:
+            if "pass.json" in self.files:
+                # pre-rendered pass.json, e.g. from a `templates.PassTemplate`
+                pass_json = bytes(self.files["pass.json"])
+                if self.deterministic:
+                    return _canonical_json(json.loads(pass_json))
+                return pass_json.decode("utf-8")
             raise ValueError("Pass object is not set")
-        return self.pass_object.model_dump_json(exclude_none=True, indent=4)
+        return _dump_pass_json(self.pass_object, deterministic=self.deterministic)
 
     def _add_file(self, name: str, fd: typing.BinaryIO):
         """Adds a file to the pass. The file is stored in the files dict and the hash is stored in the hashes dict"""
@@ -965,24 +1176,44 @@ class PkPass(BaseModel):
     def _manifest(self):
         return self.files.get("manifest.json")
 
-    def _create_manifest(self):
+    def _file_hashes(self) -> dict[str, str]:
         """
-        Creates the hashes for all the files included in the pass file.
+        SHA-1 hex digests of the files of the manifest by name, renews pass.json.
         """
         excluded_files = ["signature", "manifest.json"]
-        pass_json = self._pass_json
+        pass_json, pass_json_sha1 = self._pass_json_bytes
+        self.files["pass.json"] = pass_json
+        hashes = {}
+        for filename, filedata in sorted(self.files.items()):
+            if filename == "pass.json":
+                hashes[filename] = pass_json_sha1
+            elif filename not in excluded_files:
+                hashes[filename] = hashlib.sha1(filedata).hexdigest()
+        return hashes
 
-        # if there is a manifest we want to keep the order of the files
-        old_manifest = self._manifest
+    def content_digest(self) -> str:
+        """
+        SHA-256 hex digest of the sorted manifest entries.
+
+        Passes with the same files have the same digest, independent of the
+        order of the manifest and of the signature, e.g. to find out if a
+        pass changed since it was delivered.
+        """
+        manifest = json.dumps(self._file_hashes(), sort_keys=True)
+        return hashlib.sha256(manifest.encode("utf-8")).hexdigest()
+
+    def _create_manifest(self):
+        """
+        Creates the hashes for all the files included in the pass file.
+        """
+        # if there is a manifest we want to keep the order of the files,
+        # reproducible builds always use sorted entries
+        old_manifest = None if self.deterministic else self._manifest
         if old_manifest:
             old_manifest_json = json.loads(old_manifest, object_pairs_hook=OrderedDict)
 
-        # renew pass.json
-        self.files["pass.json"] = pass_json.encode("utf-8")
-        hashes = {}
-        for filename, filedata in sorted(self.files.items()):
-            if filename not in excluded_files:
-                hashes[filename] = hashlib.sha1(filedata).hexdigest()
+        # renews pass.json
+        hashes = self._file_hashes()
 
         if old_manifest:
             # keep order of old manifest, remove unused files there and update new ones from hashes
@@ -992,16 +1223,18 @@ class PkPass(BaseModel):
 
             old_manifest_json.update(hashes)
             return json.dumps(old_manifest_json)
-        return json.dumps(hashes)
+        return json.dumps(hashes, sort_keys=self.deterministic)
 
     def _sign(
         self,
-        private_key: PrivateKeyTypes,
-        certificate: Certificate,
-        wwdr_certificate: Certificate,
+        private_key: "PrivateKeyTypes",
+        certificate: "Certificate",
+        wwdr_certificate: "Certificate",
     ):
-        self.files["pass.json"] = self._pass_json.encode("utf-8")
+        # cryptography is imported on first use, it is slow to import
+        from edutap.wallet_apple import crypto
 
+        # also renews pass.json
         manifest = self._create_manifest()
         self.files["manifest.json"] = manifest.encode("utf-8")
         signature = crypto.sign_manifest(
@@ -1019,6 +1252,8 @@ class PkPass(BaseModel):
         certificate_path: str | Path,
         wwdr_certificate_path: str | Path,
     ):
+        from edutap.wallet_apple import crypto
+
         self._sign(
             *crypto.load_key_files(
                 private_key_path, certificate_path, wwdr_certificate_path
@@ -1034,34 +1269,87 @@ class PkPass(BaseModel):
         """Same as sign, but we get the key and cert data direct as bytes instead
         of file paths.
         """
+        from edutap.wallet_apple import crypto
+
         self._sign(
             *crypto.create_keys(
                 private_key_data, certificate_data, wwdr_certificate_data
             )
         )
 
-    def _build_zip(self, fh: typing.BinaryIO | None = None) -> zipfile.ZipFile:
+    def _build_zip(
+        self,
+        fh: typing.BinaryIO | None = None,
+        compression: archive.CompressionPolicy | None = None,
+    ) -> zipfile.ZipFile:
         """
         builds a zip file from file content and returns the zipfile object
         if a file handle is given it writes the zip file to the file handle
+        the compression policy decides per file if it is deflated or stored
         """
         if fh is None:
             fh = BytesIO()
+        if compression is None:
+            compression = archive.DEFAULT_COMPRESSION
 
         if "pass.json" not in self.files:
-            self.files["pass.json"] = self._pass_json.encode("utf-8")
+            self.files["pass.json"] = self._pass_json_bytes[0]
+        names = sorted(self.files) if self.deterministic else list(self.files)
         with zipfile.ZipFile(fh, "w") as zf:
-            for filename, filedata in self.files.items():
-                zf.writestr(filename, filedata)
+            for filename in names:
+                filedata = self.files[filename]
+                zinfo: str | zipfile.ZipInfo = filename
+                if self.deterministic:
+                    zinfo = archive.deterministic_zipinfo(filename)
+                zf.writestr(
+                    zinfo,
+                    filedata,
+                    compress_type=compression.compress_type(filename),
+                    compresslevel=compression.level,
+                )
 
             zf.close()
             return zf
 
     @classmethod
-    def from_zip(cls, zip_file: typing.BinaryIO) -> "PkPass":
+    def from_zip(
+        cls,
+        zip_file: typing.BinaryIO | str | Path,
+        lazy: bool = False,
+        limits: archive.IngestionLimits | None = None,
+    ) -> "PkPass":
         """
         loads a .pkpass file from a zip file
+
+        :param zip_file: file object or path of the zip file
+        :param lazy: if True the files are read on first access and
+            pass.json is validated when `pass_object_safe` is used first.
+            A path is memory mapped, uncompressed files (images) are then
+            memoryviews on the mapped file. The file object must stay open
+            as long as the pass is used, `close` the pass when done.
+        :param limits: for untrusted archives, reading fails with
+            `archive.UntrustedArchiveError` as soon as a limit is exceeded.
         """
+        if limits is not None:
+            if lazy:
+                raise ValueError("untrusted archives can not be loaded lazily")
+            files, _ = archive.read_bounded(zip_file, limits)
+            if "pass.json" not in files:
+                raise archive.UntrustedArchiveError("archive has no pass.json")
+            res = cls.from_pass(Pass.from_json(files["pass.json"]))
+            res.files = files
+            return res
+        if lazy:
+            res = cls()
+            res.files = archive.LazyMembers(zip_file)  # type: ignore[assignment]
+            if "pass.json" not in res.files:
+                res.close()
+                raise KeyError("There is no item named 'pass.json' in the archive")
+            res._pass_json_pending = True
+            return res
+        if isinstance(zip_file, (str, Path)):
+            with open(zip_file, "rb") as fh:
+                return cls.from_zip(fh)
         with zipfile.ZipFile(zip_file) as zf:
             pass_json = zf.read("pass.json")
             # pass_dict = json.loads(pass_json)
@@ -1077,27 +1365,17 @@ class PkPass(BaseModel):
         verifies the signature of the pass
         :param: recompute_manifest: if True the manifest is recomputed before verifying
         """
+        from edutap.wallet_apple import crypto
+
         if not self.is_signed:
             raise ValueError("Pass is not signed")
 
         if recompute_manifest:
             manifest = self._create_manifest()
         else:
-            manifest = self._manifest
+            # may be a memoryview of a lazily loaded pass
+            manifest = bytes(self._manifest)
 
-        signature = self.files["signature"]
+        signature = bytes(self.files["signature"])
 
         return crypto.verify_manifest(manifest, signature)
-
-
-# hack in an optional field for each passmodel(passtype) since these are not known at compile time
-# because for each pass type the PassInformation is stored in a different field of which only one is used
-for jsonname, klass in pass_model_registry.items():
-    Pass.model_fields[jsonname] = FieldInfo(  # type: ignore
-        annotation=klass,  # type: ignore
-        required=False,
-        default=None,
-        exclude_none=True,
-    )
-# add mutually exclusive validator so that only one variant can be defined
-Pass.model_rebuild(force=True)
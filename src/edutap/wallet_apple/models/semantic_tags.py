@@ -1,8 +1,13 @@
+from edutap.wallet_apple.models.tracking import TrackedModel
+from edutap.wallet_apple.models.unions import best_match
 from edutap.wallet_apple.settings import Settings
-from pydantic import BaseModel
 from pydantic import ConfigDict
+from pydantic import Tag
 from pydantic.config import ExtraValues
+from typing import Annotated
 from typing import Literal
+from typing import TypeAlias
+from typing import Union
 
 settings = Settings()
 
@@ -23,7 +28,7 @@ EventType: Literal[
 ]
 
 
-class CurrencyAmount(BaseModel):
+class CurrencyAmount(TrackedModel):
     """
     An object that represents an amount of money and type of currency.
 
@@ -48,7 +53,7 @@ class CurrencyAmount(BaseModel):
     """
 
 
-class EventDateInfo(BaseModel):
+class EventDateInfo(TrackedModel):
     """
     An object that represents a date for an event.
 
@@ -89,7 +94,7 @@ class EventDateInfo(BaseModel):
     """
 
 
-class Location(BaseModel):
+class Location(TrackedModel):
     """
     An object that represents the coordinates of a location.
 
@@ -112,7 +117,7 @@ class Location(BaseModel):
     """
 
 
-class PersonNameComponents(BaseModel):
+class PersonNameComponents(TrackedModel):
     """
     An object that represents the parts of a person’s name.
     see: https://developer.apple.com/documentation/walletpasses/semantictagtype/personnamecomponents-data.dictionary
@@ -164,7 +169,7 @@ class PersonNameComponents(BaseModel):
     """
 
 
-class Seat(BaseModel):
+class Seat(TrackedModel):
     """
     An object that represents the identification of a seat for a transit journey or an event.
 
@@ -229,7 +234,7 @@ class Seat(BaseModel):
     """
 
 
-class WifiNetwork(BaseModel):
+class WifiNetwork(TrackedModel):
     """
     An object that contains information required to connect to a WiFi network.
 
@@ -252,7 +257,7 @@ class WifiNetwork(BaseModel):
     """
 
 
-class SemanticTags(BaseModel):  # EventTicketSemanticTags, BoardingPassSemanticTags):
+class SemanticTags(TrackedModel):  # EventTicketSemanticTags, BoardingPassSemanticTags):
     """
     An object that contains machine-readable metadata the system uses to offer a pass and suggest related actions.
 
@@ -278,7 +283,7 @@ class SemanticTags(BaseModel):  # EventTicketSemanticTags, BoardingPassSemanticT
     """
 
 
-class SeatRelatedSemanticTags(BaseModel):
+class SeatRelatedSemanticTags(TrackedModel):
     """
     Subclass of SemanticTags. with only the relevant attributes for seat related passes.
     """
@@ -978,4 +983,31 @@ BoardingPassSemantics = (
 )
 StoreCardSemantics = StoreCardSemanticTags
 
-Semantics = SemanticTags | EventTicketSemantics | BoardingPassSemantics
+Semantics: TypeAlias = Annotated[
+    Union[
+        Annotated[SemanticTags, Tag("SemanticTags")],
+        Annotated[EventTicketSemanticTags, Tag("EventTicketSemanticTags")],
+        Annotated[SportEventTypeSemanticTags, Tag("SportEventTypeSemanticTags")],
+        Annotated[BoardingPassSemanticTags, Tag("BoardingPassSemanticTags")],
+        Annotated[PKTransitTypeAirSemanticTags, Tag("PKTransitTypeAirSemanticTags")],
+        Annotated[PKTransitTypeBoatSemanticTags, Tag("PKTransitTypeBoatSemanticTags")],
+        Annotated[PKTransitTypeBusSemanticTags, Tag("PKTransitTypeBusSemanticTags")],
+        Annotated[
+            PKTransitTypeGenericSemanticTags, Tag("PKTransitTypeGenericSemanticTags")
+        ],
+        Annotated[
+            PKTransitTypeTrainSemanticTags, Tag("PKTransitTypeTrainSemanticTags")
+        ],
+    ],
+    best_match(
+        SemanticTags,
+        EventTicketSemanticTags,
+        SportEventTypeSemanticTags,
+        BoardingPassSemanticTags,
+        PKTransitTypeAirSemanticTags,
+        PKTransitTypeBoatSemanticTags,
+        PKTransitTypeBusSemanticTags,
+        PKTransitTypeGenericSemanticTags,
+        PKTransitTypeTrainSemanticTags,
+    ),
+]
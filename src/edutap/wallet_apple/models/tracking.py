@@ -0,0 +1,83 @@
+"""
+Change tracking for the pass models.
+
+Every `TrackedModel` has a generation that advances with every assignment
+to one of its fields. Cached serialisations (see `PkPass`) remember the
+generation of the pass they were made from and are only reused while it is
+unchanged.
+
+A model `watch`-ed by a cache links the models it contains to it, so
+assigning a field of e.g. a field content of the pass advances the
+generation of the pass as well. Only the pass being watched and the models
+in it are affected, changes to other passes leave its cache alone.
+
+Changes inside lists and dicts, e.g. appending a field, do not assign to a
+model and are not detected, `PkPass.invalidate_pass_json` drops the cache
+after such changes. The ``add...Field`` methods of the models advance the
+generation themselves.
+"""
+
+from pydantic import BaseModel
+from typing import Any
+from typing import Iterator
+
+import weakref
+
+
+def generation(model: "TrackedModel") -> int:
+    """The generation of the model, it changes with every field assignment."""
+    return getattr(model, "_tracking_generation", 0)
+
+
+def touch(model: "TrackedModel") -> None:
+    """Advances the generation of the model and of the models watching it."""
+    object.__setattr__(model, "_tracking_generation", generation(model) + 1)
+    for ref in getattr(model, "_tracking_parents", ()):
+        parent = ref()
+        if parent is not None:
+            touch(parent)
+
+
+def watch(model: "TrackedModel") -> None:
+    """
+    Links the models contained in the model to it, so assigning a field of
+    any of them advances the generation of the model as well.
+    """
+    if getattr(model, "_tracking_parents", None) is None:
+        object.__setattr__(model, "_tracking_parents", [])
+    for child in _contained(model.__dict__.values()):
+        _link(child, model)
+
+
+def _link(child: "TrackedModel", parent: "TrackedModel") -> None:
+    parents = getattr(child, "_tracking_parents", None)
+    if parents is None:
+        object.__setattr__(child, "_tracking_parents", [weakref.ref(parent)])
+        watch(child)
+    elif not any(ref() is parent for ref in parents):
+        parents.append(weakref.ref(parent))
+
+
+def _contained(values: Any) -> Iterator["TrackedModel"]:
+    for value in values:
+        if isinstance(value, TrackedModel):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            yield from _contained(value)
+        elif isinstance(value, dict):
+            yield from _contained(value.values())
+
+
+class TrackedModel(BaseModel):
+    """Base of the models that make up a pass.json."""
+
+    # set only once the model is changed or watched
+    __slots__ = ("_tracking_generation", "_tracking_parents", "__weakref__")
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if getattr(self, "_tracking_parents", None) is not None:
+            # models assigned to a watched model are watched as well
+            for child in _contained((value,)):
+                _link(child, self)
+        touch(self)
@@ -0,0 +1,53 @@
+"""
+Unions of pass models that are resolved in a single step.
+
+Pydantic validates a plain union of models against every member and keeps
+the best result ("smart mode"). The pass field and semantic tag models are
+subclasses of each other, so most data is valid for several of them and is
+validated several times. `best_match` is the discriminator of a union
+instead: the member is chosen by the keys of the data, before validating,
+with the same result as the smart mode.
+
+The members of the union are tagged with their class name, e.g.::
+
+    FieldContent: TypeAlias = Annotated[
+        Union[
+            Annotated[PassFieldContent, Tag("PassFieldContent")],
+            Annotated[SemanticPassFieldContent, Tag("SemanticPassFieldContent")],
+        ],
+        best_match(PassFieldContent, SemanticPassFieldContent),
+    ]
+"""
+
+from pydantic import BaseModel
+from pydantic import Discriminator
+from typing import Any
+from typing import Iterable
+
+
+def best_match(*models: type[BaseModel]) -> Discriminator:
+    """
+    Discriminator of a union of the models, tagged with their class names.
+
+    Data is validated by the model knowing most of its keys, the first one
+    of the given order if several know as many. Model instances are kept by
+    their own class or the nearest base class in the union.
+    """
+    fields = [(model.__name__, frozenset(model.model_fields)) for model in models]
+    names = {model: model.__name__ for model in models}
+
+    def discriminator(value: Any) -> str | None:
+        keys: Iterable[str]
+        if isinstance(value, BaseModel):
+            for cls in type(value).__mro__:
+                if cls in names:
+                    return names[cls]
+            keys = value.model_fields_set
+        elif isinstance(value, dict):
+            keys = value.keys()
+        else:
+            # pydantic reports data that is no object
+            return None
+        return max(fields, key=lambda item: len(item[1].intersection(keys)))[0]
+
+    return Discriminator(discriminator)
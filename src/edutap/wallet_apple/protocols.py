@@ -1,5 +1,6 @@
 # pylint: disable=too-few-public-methods
 from .models import handlers
+from typing import AsyncIterator
 from typing import Protocol
 from typing import runtime_checkable
 
@@ -14,7 +15,7 @@ class PassRegistration(Protocol):
 
     async def register_pass(
         self,
-        device_libray_id: str,
+        device_library_id: str,
         pass_type_id: str,
         serial_number: str,
         push_token: handlers.PushToken | None,
@@ -34,6 +35,52 @@ class PassRegistration(Protocol):
         """
 
 
+@runtime_checkable
+class BatchPassRegistration(Protocol):
+    """
+    Optional extension of a PassRegistration handler.
+
+    If a handler implements it, batched registrations (see
+    `registrations.RegistrationBatcher`) are written in one call instead of
+    one `register_pass` call per registration.
+    """
+
+    async def register_passes(
+        self,
+        registrations: list[handlers.Registration],
+    ) -> None:
+        """
+        Registers all passes, e.g. in one transaction. A registration may
+        be handed in again after a failure, it must be idempotent.
+        """
+
+
+@runtime_checkable
+class RegistrationLookup(Protocol):
+    """
+    Optional extension of a PassRegistration handler.
+
+    Used by the registration filter (see
+    `registration_filter.RegistrationFilter`) to look up the registrations
+    the filter may know, and to rebuild the filter.
+    """
+
+    async def is_registered(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+    ) -> bool:
+        """
+        Checks if the pass is registered on the device
+        """
+
+    def registrations(self) -> AsyncIterator[tuple[str, str, str]]:
+        """
+        All registrations as (device library id, pass type id, serial number)
+        """
+
+
 @runtime_checkable
 class PassDataAcquisition(Protocol):
     """
@@ -0,0 +1,295 @@
+"""
+Probabilistic filter of known registrations.
+
+Devices register passes they already hold again and again, Apple expects
+200 for a known registration and 201 for a new one. Telling them apart is
+a lookup in the plugin for every registration. The `RegistrationFilter`
+is a counting Bloom filter of the registrations: if a registration is not
+in the filter, it is new and the lookup is skipped. Only if the filter may
+know the registration, the plugins implementing
+`protocols.RegistrationLookup` are asked. Without such a plugin, a
+registration the filter may know is answered as known.
+
+A registration not in the filter is new for sure only if the worker is
+the only one registering passes: the filter of a worker does not learn
+the registrations of the other workers. With several workers, the filter
+is rebuilt from the plugins every ``rebuild_interval`` seconds, see
+`RegistrationFilter.rebuild_periodically`. A registration another worker
+made since the last rebuild is then answered as new once more, the
+plugins register idempotently. A filter neither ``exclusive`` nor rebuilt
+would have to look up every registration and saves nothing, the settings
+do not enable it.
+
+The filter is sized for a capacity and a false positive rate: with
+``capacity`` registrations in it, at most this share of new registrations
+is looked up in vain. The counters allow to remove unregistered passes.
+Counters that overflow stay at their maximum, so the filter never forgets
+a registration it still holds.
+
+The filter lives in the memory of the worker and starts empty. The
+lifespan of the FastAPI handlers rebuilds it from the plugins before the
+worker takes traffic and then every ``rebuild_interval``, see
+`RegistrationFilter.rebuild`.
+"""
+
+from edutap.wallet_apple.plugins import get_pass_registrations
+from edutap.wallet_apple.protocols import RegistrationLookup
+from edutap.wallet_apple.settings import Settings
+from pydantic import BaseModel
+from typing import Iterable
+
+import asyncio
+import functools
+import hashlib
+import math
+
+_Key = tuple[str, str, str]
+
+_MAX_COUNT = 255
+
+
+class FilterStats(BaseModel):
+    """Counters of a `RegistrationFilter`, e.g. for export as metrics."""
+
+    capacity: int
+    """registrations the filter is sized for"""
+
+    false_positive_rate: float
+    """configured false positive rate at capacity"""
+
+    estimated_false_positive_rate: float
+    """false positive rate at the current fill of the filter"""
+
+    items: int
+    """registrations in the filter"""
+
+    size: int
+    """bytes of the counters"""
+
+    definitely_new: int
+    """registrations not in the filter, answered without lookup"""
+
+    lookups: int
+    """registrations looked up in the plugins"""
+
+    false_positives: int
+    """lookups of registrations the filter may know that found none"""
+
+
+class RegistrationFilter:
+    """
+    Counting Bloom filter of (device, pass type, serial number).
+
+    :param capacity: number of registrations the filter is sized for.
+    :param false_positive_rate: share of new registrations reported as
+        maybe known, with ``capacity`` registrations in the filter.
+    :param exclusive: True if no other process registers passes, then
+        registrations not in the filter are answered as new without lookup.
+    :param rebuild_interval: seconds between rebuilds from the plugins, if
+        positive registrations not in the filter are answered as new
+        without lookup as well.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        false_positive_rate: float = 0.01,
+        exclusive: bool = False,
+        rebuild_interval: float = 0.0,
+    ) -> None:
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.exclusive = exclusive
+        self.rebuild_interval = rebuild_interval
+        # optimal number of counters and hash functions for the rate
+        self.size = math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._counters = bytearray(self.size)
+        self._items = 0
+        self._definitely_new = 0
+        self._lookups = 0
+        self._false_positives = 0
+        # filter being rebuilt, it gets the changes meanwhile as well
+        self._rebuilding: RegistrationFilter | None = None
+
+    def _positions(self, key: _Key) -> list[int]:
+        digest = hashlib.blake2b(
+            "\0".join(key).encode("utf-8"), digest_size=16
+        ).digest()
+        # double hashing, the second hash odd to reach all counters
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key: _Key) -> bool:
+        """False if the registration is not in the filter for sure."""
+        counters = self._counters
+        return all(counters[position] for position in self._positions(key))
+
+    def __len__(self) -> int:
+        return self._items
+
+    def add(self, key: _Key) -> None:
+        """Adds the registration, adding it twice counts it twice."""
+        if self._rebuilding is not None:
+            self._rebuilding.add(key)
+        counters = self._counters
+        for position in self._positions(key):
+            if counters[position] < _MAX_COUNT:
+                counters[position] += 1
+        self._items += 1
+
+    def discard(self, key: _Key) -> None:
+        """Removes the registration once, if the filter may know it."""
+        if self._rebuilding is not None:
+            self._rebuilding.discard(key)
+        positions = self._positions(key)
+        counters = self._counters
+        # removing an unknown registration would remove others
+        if not all(counters[position] for position in positions):
+            return
+        for position in positions:
+            if counters[position] < _MAX_COUNT:
+                counters[position] -= 1
+        self._items = max(self._items - 1, 0)
+
+    def fill(self, keys: Iterable[_Key]) -> None:
+        """Replaces the registrations in the filter with the given ones."""
+        self._counters = bytearray(self.size)
+        self._items = 0
+        for key in keys:
+            self.add(key)
+
+    async def rebuild(self) -> int:
+        """
+        Fills the filter with the registrations of the plugins implementing
+        `protocols.RegistrationLookup`, returns their number. The filter
+        answers from the old registrations until the new ones are read,
+        registrations added or removed meanwhile are applied to both.
+        Without such a plugin the filter is kept.
+        """
+        lookups = _lookups()
+        if not lookups:
+            return self._items
+        fresh = RegistrationFilter(
+            self.capacity, self.false_positive_rate, self.exclusive
+        )
+        self._rebuilding = fresh
+        try:
+            for plugin in lookups:
+                async for key in plugin.registrations():
+                    fresh.add(tuple(key))  # type: ignore[arg-type]
+        finally:
+            self._rebuilding = None
+        self._counters, self._items = fresh._counters, fresh._items
+        return self._items
+
+    async def rebuild_periodically(self) -> None:
+        """
+        Rebuilds the filter every ``rebuild_interval`` seconds, until
+        cancelled. Started by the lifespan of the FastAPI handlers, failed
+        rebuilds are logged and the old filter is kept.
+        """
+        while True:
+            await asyncio.sleep(self.rebuild_interval)
+            try:
+                await self.rebuild()
+            except Exception as e:
+                Settings().get_logger().error(
+                    "rebuild",
+                    realm="registration_filter",
+                    action="rebuild",
+                    error=str(e),
+                )
+
+    async def is_new(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        """
+        True if the pass is not registered on the device, looked up in the
+        plugins only if the filter may know the registration or is neither
+        `exclusive` nor rebuilt periodically.
+        """
+        maybe_known = (device_library_id, pass_type_id, serial_number) in self
+        if not maybe_known and (self.exclusive or self.rebuild_interval > 0):
+            self._definitely_new += 1
+            return True
+        lookups = _lookups()
+        if not lookups:
+            # nobody to ask, a registration of another worker counts as new
+            return not maybe_known
+        self._lookups += 1
+        for plugin in lookups:
+            if await plugin.is_registered(
+                device_library_id, pass_type_id, serial_number
+            ):
+                return False
+        if maybe_known:
+            self._false_positives += 1
+        return True
+
+    def estimated_false_positive_rate(self) -> float:
+        """The false positive rate at the current fill of the counters."""
+        used = self.size - self._counters.count(0)
+        return (used / self.size) ** self.hashes
+
+    def stats(self) -> FilterStats:
+        return FilterStats(
+            capacity=self.capacity,
+            false_positive_rate=self.false_positive_rate,
+            estimated_false_positive_rate=self.estimated_false_positive_rate(),
+            items=self._items,
+            size=self.size,
+            definitely_new=self._definitely_new,
+            lookups=self._lookups,
+            false_positives=self._false_positives,
+        )
+
+
+def _lookups() -> list[RegistrationLookup]:
+    return [
+        plugin
+        for plugin in get_pass_registrations()
+        if isinstance(plugin, RegistrationLookup)
+    ]
+
+
+@functools.cache
+def _registration_filter(
+    capacity: int, false_positive_rate: float, exclusive: bool, rebuild_interval: float
+) -> RegistrationFilter:
+    return RegistrationFilter(
+        capacity, false_positive_rate, exclusive, rebuild_interval
+    )
+
+
+def get_registration_filter(
+    settings: Settings | None = None,
+) -> RegistrationFilter | None:
+    """
+    The filter configured in the settings, None if it is not enabled or
+    would look up every registration.
+    """
+    if settings is None:
+        settings = Settings()
+    exclusive = settings.registration_filter_exclusive
+    # an exclusive filter learns all registrations itself
+    rebuild_interval = (
+        0.0 if exclusive else settings.registration_filter_rebuild_interval
+    )
+    if settings.registration_filter_capacity <= 0:
+        return None
+    if not exclusive and rebuild_interval <= 0:
+        return None
+    return _registration_filter(
+        settings.registration_filter_capacity,
+        settings.registration_filter_false_positive_rate,
+        exclusive,
+        rebuild_interval,
+    )
@@ -0,0 +1,495 @@
+"""
+Write-behind batching of pass registrations.
+
+After a pass is distributed widely, tens of thousands of devices register
+it within minutes, each registration a transaction of its own in the
+plugin. The `RegistrationBatcher` answers the device at once and writes
+the registrations in batches, when a batch is full or after a short
+delay, whichever comes first.
+
+Registrations are handed to the plugins at least once: a failed batch is
+written again, the plugins must register idempotently. A registration
+failing again and again is given up after a few attempts, so it does not
+block the others. Plugins implementing `protocols.BatchPassRegistration`
+get the whole batch in one call. Pending registrations are written when the app shuts down (see the
+lifespan of the FastAPI handlers). With a `RegistrationJournal` they are
+kept in a SQLite database until they are written, a worker starting
+writes the registrations left by a killed one. Without a journal, the
+registrations of the last delay are lost if a worker dies.
+
+Apple expects 201 for a new registration and 200 for a known one. A
+registration pending in the batcher is known, the others are looked up
+in the plugins implementing `protocols.RegistrationLookup`, see
+`is_registered`. The batcher itself does not tell them apart.
+"""
+
+from collections import deque
+from collections import OrderedDict
+from edutap.wallet_apple.models.handlers import PushToken
+from edutap.wallet_apple.models.handlers import Registration
+from edutap.wallet_apple.plugins import get_pass_registrations
+from edutap.wallet_apple.protocols import BatchPassRegistration
+from edutap.wallet_apple.protocols import RegistrationLookup
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+from pydantic import BaseModel
+from typing import cast
+from typing import Iterable
+
+import asyncio
+import functools
+import sqlite3
+import threading
+
+_Key = tuple[str, str, str]
+
+# a pending registration, its failed attempts so far and its journal row
+_Entry = tuple[Registration, int, int | None]
+
+
+class BatcherStats(BaseModel):
+    """Counters of a `RegistrationBatcher`, e.g. for export as metrics."""
+
+    pending: int
+    """registrations not written yet"""
+
+    written: int
+    """registrations written"""
+
+    batches: int
+    """batches written"""
+
+    failures: int
+    """batches that failed and are written again"""
+
+    dead_letters: int
+    """registrations given up on, see `RegistrationBatcher.dead_letters`"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_registrations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_library_id TEXT NOT NULL,
+    pass_type_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    push_token TEXT,
+    UNIQUE (device_library_id, pass_type_id, serial_number)
+);
+"""
+
+
+class RegistrationJournal:
+    """
+    Pending registrations in a SQLite database, shared by the processes
+    using the file.
+
+    A registration is added before the device is answered and removed once
+    it is written or given up. The database is written in WAL mode with
+    ``synchronous=NORMAL``: a killed worker loses nothing, a power failure
+    may lose the last registrations.
+
+    :param path: database file, created if missing.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def add(self, registration: Registration) -> int:
+        """
+        Adds the registration, replacing a pending one of the same pass and
+        device. Returns its row, to `remove` it.
+        """
+        push_token = registration.pushToken
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR REPLACE INTO pending_registrations"
+                " (device_library_id, pass_type_id, serial_number, push_token)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    registration.deviceLibraryIdentifier,
+                    registration.passTypeIdentifier,
+                    registration.serialNumber,
+                    push_token.pushToken if push_token is not None else None,
+                ),
+            )
+        return cast(int, cursor.lastrowid)
+
+    def remove(self, rows: Iterable[int]) -> None:
+        """Removes the rows, e.g. of written registrations."""
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM pending_registrations WHERE seq = ?",
+                [(row,) for row in rows],
+            )
+
+    def discard(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> None:
+        """Removes the registration, e.g. before the pass is unregistered."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM pending_registrations WHERE device_library_id = ?"
+                " AND pass_type_id = ? AND serial_number = ?",
+                (device_library_id, pass_type_id, serial_number),
+            )
+
+    def pending(self) -> list[tuple[Registration, int]]:
+        """The registrations in the journal with their rows, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, device_library_id, pass_type_id, serial_number,"
+                " push_token FROM pending_registrations ORDER BY seq"
+            ).fetchall()
+        return [
+            (
+                Registration(
+                    deviceLibraryIdentifier=device_library_id,
+                    passTypeIdentifier=pass_type_id,
+                    serialNumber=serial_number,
+                    pushToken=(
+                        PushToken(pushToken=push_token)
+                        if push_token is not None
+                        else None
+                    ),
+                ),
+                seq,
+            )
+            for seq, device_library_id, pass_type_id, serial_number, push_token in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RegistrationBatcher:
+    """
+    Collects registrations and writes them to the plugins in batches.
+
+    A failing batch is split in halves until the failing registrations are
+    found, the others are written. The failing ones are queued again behind
+    the later registrations, after ``max_attempts`` they are moved to
+    `dead_letters` and logged. With ``max_pending`` registrations waiting,
+    further registrations are written before the device is answered.
+
+    :param max_batch_size: a full batch is written at once.
+    :param max_delay: seconds a registration waits at most for its batch.
+    :param retry_delay: seconds before a failed batch is written again.
+    :param max_pending: registrations waiting to be written at most.
+    :param max_attempts: writes of a registration before it is given up.
+    :param journal: keeps the pending registrations until they are written.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 500,
+        max_delay: float = 0.5,
+        retry_delay: float = 1.0,
+        max_pending: int = 10000,
+        max_attempts: int = 5,
+        journal: RegistrationJournal | None = None,
+    ) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.journal = journal
+        # a newer registration of a pass on a device replaces the pending one
+        self._pending: OrderedDict[_Key, _Entry] = OrderedDict()
+        # registrations of the batch being written
+        self._writing: set[_Key] = set()
+        # the most recent registrations given up on
+        self.dead_letters: deque[Registration] = deque(maxlen=max_pending)
+        self._flushing: asyncio.Lock | None = None
+        self._timer: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._written = 0
+        self._batches = 0
+        self._failures = 0
+
+    def is_pending(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> bool:
+        """True if the registration is queued or being written."""
+        key = (device_library_id, pass_type_id, serial_number)
+        return key in self._pending or key in self._writing
+
+    async def register(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        serial_number: str,
+        push_token: PushToken | None = None,
+    ) -> None:
+        """
+        Queues the registration. Must be called in the event loop the
+        batches are written in.
+
+        :raises: the error of the plugin, if too many registrations are
+            pending and writing this one failed.
+        """
+        key = (device_library_id, pass_type_id, serial_number)
+        registration = Registration(
+            deviceLibraryIdentifier=device_library_id,
+            passTypeIdentifier=pass_type_id,
+            serialNumber=serial_number,
+            pushToken=push_token,
+        )
+        if len(self._pending) >= self.max_pending:
+            # the plugins do not keep up, the device waits for its write;
+            # a pending older registration must not overwrite this one
+            replaced = self._pending.pop(key, None)
+            await _write([registration])
+            self._written += 1
+            self._batches += 1
+            if replaced is not None:
+                await self._remove_from_journal([replaced])
+            return
+
+        row = None
+        if self.journal is not None:
+            row = await asyncio.to_thread(self.journal.add, registration)
+        self._pending.pop(key, None)
+        self._pending[key] = (registration, 0, row)
+        self._schedule()
+
+    async def recover(self) -> int:
+        """
+        Queues the registrations left in the journal, e.g. by a killed
+        worker, and returns their number. Called by the lifespan of the
+        FastAPI handlers when the worker starts.
+        """
+        if self.journal is None:
+            return 0
+        entries = await asyncio.to_thread(self.journal.pending)
+        for registration, row in entries:
+            self._pending.setdefault(_key(registration), (registration, 0, row))
+        if self._pending:
+            self._schedule()
+        return len(entries)
+
+    async def forget(
+        self, device_library_id: str, pass_type_id: str, serial_number: str
+    ) -> None:
+        """
+        Drops the pending registration, before the pass is unregistered. If
+        it is being written, the write is waited for, its errors are left to
+        the batcher.
+        """
+        key = (device_library_id, pass_type_id, serial_number)
+        self._pending.pop(key, None)
+        if key in self._writing and self._flushing is not None:
+            async with self._flushing:
+                # queued again after a failed write
+                self._pending.pop(key, None)
+        if self.journal is not None:
+            await asyncio.to_thread(self.journal.discard, *key)
+
+    async def flush(self) -> None:
+        """
+        Writes all pending registrations.
+
+        :raises: the first error of the plugin, if a registration failed.
+            The failed registrations stay pending, or are moved to the dead
+            letters after their last attempt.
+        """
+        if self._flushing is None:
+            self._flushing = asyncio.Lock()
+        async with self._flushing:
+            failed: list[_Entry] = []
+            error: Exception | None = None
+            while self._pending:
+                batch = [
+                    self._pending.popitem(last=False)[1]
+                    for _ in range(min(self.max_batch_size, len(self._pending)))
+                ]
+                self._writing = {_key(entry[0]) for entry in batch}
+                try:
+                    batch_error = await self._write_split(batch, failed)
+                finally:
+                    self._writing = set()
+                error = error or batch_error
+            # behind the registrations queued meanwhile
+            given_up = []
+            for registration, attempts, row in failed:
+                key = _key(registration)
+                if key in self._pending:
+                    # registered again meanwhile, the newer one is written
+                    continue
+                if attempts + 1 < self.max_attempts:
+                    self._pending[key] = (registration, attempts + 1, row)
+                    continue
+                self.dead_letters.append(registration)
+                given_up.append((registration, attempts, row))
+                Settings().get_logger().error(
+                    "register_pass",
+                    realm="registrations",
+                    action="give up",
+                    deviceLibraryIdentifier=registration.deviceLibraryIdentifier,
+                    passTypeIdentifier=registration.passTypeIdentifier,
+                    serialNumber=registration.serialNumber,
+                    attempts=attempts + 1,
+                )
+            await self._remove_from_journal(given_up)
+            if error is not None:
+                raise error
+
+    async def _write_split(
+        self,
+        batch: list[_Entry],
+        failed: list[_Entry],
+    ) -> Exception | None:
+        """
+        Writes the batch, a failing one in halves down to the failing
+        registrations, which are added to ``failed``. Returns the error.
+        """
+        try:
+            await _write([registration for registration, _, _ in batch])
+        except Exception as e:
+            self._failures += 1
+            if len(batch) == 1:
+                failed.extend(batch)
+                return e
+            middle = len(batch) // 2
+            first = await self._write_split(batch[:middle], failed)
+            second = await self._write_split(batch[middle:], failed)
+            return first or second
+        self._written += len(batch)
+        self._batches += 1
+        await self._remove_from_journal(batch)
+        return None
+
+    async def _remove_from_journal(self, entries: list[_Entry]) -> None:
+        rows = [row for _, _, row in entries if row is not None]
+        if self.journal is not None and rows:
+            await asyncio.to_thread(self.journal.remove, rows)
+
+    def stats(self) -> BatcherStats:
+        return BatcherStats(
+            pending=len(self._pending),
+            written=self._written,
+            batches=self._batches,
+            failures=self._failures,
+            dead_letters=len(self.dead_letters),
+        )
+
+    def _schedule(self) -> None:
+        if len(self._pending) >= self.max_batch_size:
+            self._start(self._flush_later(0))
+        elif self._timer is None or self._timer.done():
+            self._timer = self._start(self._flush_later(self.max_delay))
+
+    def _start(self, coroutine) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        # keep a reference until done
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        while not await self._flush_logged():
+            await asyncio.sleep(self.retry_delay)
+
+    async def _flush_logged(self) -> bool:
+        try:
+            await self.flush()
+        except Exception as e:
+            Settings().get_logger().error(
+                "register_pass",
+                realm="registrations",
+                action="write batch",
+                pending=len(self._pending),
+                error=str(e),
+            )
+            return False
+        return True
+
+
+def _key(registration: Registration) -> _Key:
+    return (
+        registration.deviceLibraryIdentifier,
+        registration.passTypeIdentifier,
+        registration.serialNumber,
+    )
+
+
+async def _write(batch: list[Registration]) -> None:
+    for plugin in get_pass_registrations():
+        if isinstance(plugin, BatchPassRegistration):
+            await plugin.register_passes(batch)
+            continue
+        for registration in batch:
+            await plugin.register_pass(
+                registration.deviceLibraryIdentifier,
+                registration.passTypeIdentifier,
+                registration.serialNumber,
+                registration.pushToken,
+            )
+
+
+async def is_registered(
+    device_library_id: str, pass_type_id: str, serial_number: str
+) -> bool | None:
+    """
+    True if one of the plugins implementing `protocols.RegistrationLookup`
+    knows the registration, None if no plugin implements it.
+    """
+    lookups = [
+        plugin
+        for plugin in get_pass_registrations()
+        if isinstance(plugin, RegistrationLookup)
+    ]
+    if not lookups:
+        return None
+    for plugin in lookups:
+        if await plugin.is_registered(device_library_id, pass_type_id, serial_number):
+            return True
+    return False
+
+
+@functools.cache
+def _registration_journal(path: Path) -> RegistrationJournal:
+    return RegistrationJournal(path)
+
+
+@functools.cache
+def _registration_batcher(
+    max_batch_size: int,
+    max_delay: float,
+    max_pending: int,
+    journal_path: Path | None,
+) -> RegistrationBatcher:
+    return RegistrationBatcher(
+        max_batch_size=max_batch_size,
+        max_delay=max_delay,
+        max_pending=max_pending,
+        journal=(
+            _registration_journal(journal_path) if journal_path is not None else None
+        ),
+    )
+
+
+def get_registration_batcher(
+    settings: Settings | None = None,
+) -> RegistrationBatcher | None:
+    """The batcher configured in the settings, None if it is not enabled."""
+    if settings is None:
+        settings = Settings()
+    if settings.registration_batch_size <= 0:
+        return None
+    return _registration_batcher(
+        settings.registration_batch_size,
+        settings.registration_batch_delay,
+        settings.registration_pending_max,
+        settings.registration_journal_path,
+    )
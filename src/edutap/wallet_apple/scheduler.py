@@ -0,0 +1,408 @@
+"""
+Updates of passes at given times.
+
+Some updates are due at known times, e.g. "doors open" at the start of an
+event or voiding a ticket when it expires. The scheduler keeps the future
+updates ordered by their due time and triggers them when they are due.
+Updates due in the same second are pushed as one campaign, see
+`api.trigger_updates`::
+
+    scheduler = UpdateScheduler(SQLiteJobStore("/var/lib/wallet/jobs.sqlite3"))
+    scheduler.schedule_pass(pkpass.pass_object)
+    await scheduler.run()
+
+`schedule_pass` takes the times from the pass: ``relevantDates``,
+``relevantDate``, ``expirationDate`` and the semantic ``eventStartDate``.
+The plugin decides what changes at that time, e.g. it sets ``voided`` for
+passes past their expiration date when the device fetches the update.
+To change the data before the push, give an own ``trigger``.
+
+The jobs are kept by a `JobStore`: `MemoryJobStore` is a heap in memory,
+`SQLiteJobStore` persists the jobs, several processes may share it, each
+job is taken by one of them. Time is read from a `Clock`, tests use a
+`ManualClock`.
+"""
+
+from edutap.wallet_apple import api
+from edutap.wallet_apple.models.passes import Pass
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+from typing import NamedTuple
+from typing import Protocol
+from typing import runtime_checkable
+
+import asyncio
+import datetime
+import functools
+import heapq
+import sqlite3
+import threading
+import time
+
+
+class ScheduledUpdate(NamedTuple):
+    """An update of a pass due at a time."""
+
+    due: int
+    """due time in seconds since the epoch"""
+
+    pass_type_id: str
+    serial_number: str
+
+    reason: str = ""
+    """why the update is due, e.g. the name of the field with the time"""
+
+
+@runtime_checkable
+class Clock(Protocol):
+    """Protocol definition of the time source of the scheduler"""
+
+    def now(self) -> float:
+        """seconds since the epoch"""
+
+    async def sleep(self, seconds: float) -> None:
+        """waits for the given seconds"""
+
+
+class SystemClock:
+    """The clock of the system."""
+
+    def now(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class ManualClock:
+    """A clock for tests, sleeping advances the time at once."""
+
+    def __init__(self, now: float = 0.0) -> None:
+        self._now = now
+
+    def now(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        self._now += seconds
+
+    async def sleep(self, seconds: float) -> None:
+        self.advance(max(seconds, 0.0))
+        await asyncio.sleep(0)
+
+
+@runtime_checkable
+class JobStore(Protocol):
+    """Protocol definition of the storage of scheduled updates"""
+
+    def add(self, jobs: Iterable[ScheduledUpdate]) -> None:
+        """Adds the jobs, a job added twice is kept once"""
+
+    def remove(self, pass_type_id: str, serial_number: str) -> int:
+        """Removes all jobs of the pass, returns their number"""
+
+    def next_due(self) -> int | None:
+        """Due time of the next job, None if there is none"""
+
+    def pop_batch(self, now: float) -> list[ScheduledUpdate]:
+        """
+        Removes and returns the jobs of the earliest due time, if it is not
+        after now
+        """
+
+
+class MemoryJobStore:
+    """Jobs in a heap in the memory of the process."""
+
+    def __init__(self) -> None:
+        self._heap: list[ScheduledUpdate] = []
+        self._jobs: set[ScheduledUpdate] = set()
+
+    def add(self, jobs: Iterable[ScheduledUpdate]) -> None:
+        for job in jobs:
+            if job not in self._jobs:
+                self._jobs.add(job)
+                heapq.heappush(self._heap, job)
+
+    def remove(self, pass_type_id: str, serial_number: str) -> int:
+        kept = [
+            job
+            for job in self._heap
+            if (job.pass_type_id, job.serial_number) != (pass_type_id, serial_number)
+        ]
+        removed = len(self._heap) - len(kept)
+        if removed:
+            heapq.heapify(kept)
+            self._heap = kept
+            self._jobs = set(kept)
+        return removed
+
+    def next_due(self) -> int | None:
+        return self._heap[0].due if self._heap else None
+
+    def pop_batch(self, now: float) -> list[ScheduledUpdate]:
+        if not self._heap or self._heap[0].due > now:
+            return []
+        due = self._heap[0].due
+        jobs = []
+        while self._heap and self._heap[0].due == due:
+            job = heapq.heappop(self._heap)
+            self._jobs.discard(job)
+            jobs.append(job)
+        return jobs
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class SQLiteJobStore:
+    """
+    Jobs in a SQLite database, ordered by an index on the due time.
+
+    :param path: database file, created if missing.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = path
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    due INTEGER NOT NULL,
+                    pass_type_id TEXT NOT NULL,
+                    serial_number TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    PRIMARY KEY (due, pass_type_id, serial_number, reason)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS jobs_pass
+                    ON jobs (pass_type_id, serial_number);
+                """)
+
+    def add(self, jobs: Iterable[ScheduledUpdate]) -> None:
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?)", jobs)
+            self._db.execute("COMMIT")
+
+    def remove(self, pass_type_id: str, serial_number: str) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE pass_type_id = ? AND serial_number = ?",
+                (pass_type_id, serial_number),
+            )
+            return cursor.rowcount
+
+    def next_due(self) -> int | None:
+        with self._lock:
+            return self._db.execute("SELECT MIN(due) FROM jobs").fetchone()[0]
+
+    def pop_batch(self, now: float) -> list[ScheduledUpdate]:
+        with self._lock:
+            # taken and removed in one transaction, once by one process
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                due = self._db.execute("SELECT MIN(due) FROM jobs").fetchone()[0]
+                rows = []
+                if due is not None and due <= now:
+                    rows = self._db.execute(
+                        "SELECT * FROM jobs WHERE due = ?", (due,)
+                    ).fetchall()
+                    self._db.execute("DELETE FROM jobs WHERE due = ?", (due,))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return [ScheduledUpdate(*row) for row in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def parse_date(value: str | None) -> int | None:
+    """
+    Seconds since the epoch of an ISO 8601 date of a pass, None if it is
+    missing or invalid. Dates without time zone are taken as UTC.
+    """
+    if not value:
+        return None
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
+
+
+def pass_dates(pass_object: Pass) -> list[tuple[str, int]]:
+    """The times of the pass an update may be due at, with the field names."""
+    dates = []
+    for relevant_date in pass_object.relevantDates or []:
+        dates.append(("relevantDates", relevant_date.date))
+        dates.append(("relevantDates", relevant_date.startDate))
+    # without the deprecation warning of the attribute
+    dates.append(("relevantDate", vars(pass_object).get("relevantDate")))
+    dates.append(("expirationDate", pass_object.expirationDate))
+    dates.append(
+        ("eventStartDate", getattr(pass_object.semantics, "eventStartDate", None))
+    )
+    return [
+        (name, due) for name, date in dates if (due := parse_date(date)) is not None
+    ]
+
+
+async def _trigger_updates(jobs: list[ScheduledUpdate]) -> Any:
+    return await api.trigger_updates(
+        dict.fromkeys((job.pass_type_id, job.serial_number) for job in jobs)
+    )
+
+
+class UpdateScheduler:
+    """
+    Triggers the updates of passes when they are due.
+
+    :param store: the scheduled jobs.
+    :param clock: the time source, the system clock by default.
+    :param trigger: called with the jobs of a batch, pushes an update of
+        their passes by default.
+    :param poll_interval: maximum seconds between two looks at the store,
+        to see jobs added by other processes.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        clock: Clock | None = None,
+        trigger: Callable[[list[ScheduledUpdate]], Awaitable[Any]] | None = None,
+        poll_interval: float = 60.0,
+    ) -> None:
+        self.store = store
+        self.clock = clock or SystemClock()
+        self.trigger = trigger or _trigger_updates
+        self.poll_interval = poll_interval
+        self._added = asyncio.Event()
+
+    def schedule(
+        self,
+        pass_type_id: str,
+        serial_number: str,
+        when: datetime.datetime | float,
+        reason: str = "",
+    ) -> None:
+        """Schedules an update of the pass, past times are due at once."""
+        if isinstance(when, datetime.datetime):
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=datetime.timezone.utc)
+            when = when.timestamp()
+        self.store.add(
+            [ScheduledUpdate(int(when), pass_type_id, serial_number, reason)]
+        )
+        self._added.set()
+
+    def schedule_pass(self, pass_object: Pass) -> list[ScheduledUpdate]:
+        """
+        Schedules updates of the pass at its future dates, returns the jobs.
+        """
+        now = self.clock.now()
+        jobs = [
+            ScheduledUpdate(
+                due, pass_object.passTypeIdentifier, pass_object.serialNumber, name
+            )
+            for name, due in pass_dates(pass_object)
+            if due > now
+        ]
+        self.store.add(jobs)
+        self._added.set()
+        return jobs
+
+    def unschedule(self, pass_type_id: str, serial_number: str) -> int:
+        """Removes the scheduled updates of the pass, e.g. if it was deleted."""
+        return self.store.remove(pass_type_id, serial_number)
+
+    async def run_due(self) -> int:
+        """
+        Triggers the updates due by now in batches of the same second,
+        returns the number of jobs triggered.
+
+        Each batch is taken from the store just before it is triggered. The
+        jobs of a failing batch are put back after the other batches ran,
+        then the first error is raised.
+        """
+        now = self.clock.now()
+        triggered = 0
+        failed: list[ScheduledUpdate] = []
+        error: Exception | None = None
+        try:
+            while batch := self.store.pop_batch(now):
+                try:
+                    await self.trigger(batch)
+                except BaseException as e:
+                    failed.extend(batch)
+                    if not isinstance(e, Exception):
+                        raise
+                    error = error or e
+                else:
+                    triggered += len(batch)
+        finally:
+            if failed:
+                self.store.add(failed)
+        if error is not None:
+            raise error
+        return triggered
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Triggers the updates when they are due, until stopped."""
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            self._added.clear()
+            try:
+                await self.run_due()
+            except Exception as e:
+                Settings().get_logger().error(
+                    "update_pass",
+                    realm="scheduler",
+                    action="run due",
+                    error=str(e),
+                )
+                # the failed jobs are due again, retried after the interval
+                next_due = None
+            else:
+                next_due = self.store.next_due()
+            delay = self.poll_interval
+            if next_due is not None:
+                delay = min(max(next_due - self.clock.now(), 0.0), delay)
+            sleep = asyncio.ensure_future(self.clock.sleep(delay))
+            wakeups = [asyncio.ensure_future(self._added.wait())]
+            wakeups.append(asyncio.ensure_future(stop.wait()))
+            await asyncio.wait([sleep, *wakeups], return_when=asyncio.FIRST_COMPLETED)
+            for task in (sleep, *wakeups):
+                task.cancel()
+
+
+@functools.cache
+def _sqlite_job_store(path: Path) -> SQLiteJobStore:
+    return SQLiteJobStore(path)
+
+
+def get_job_store(settings: Settings | None = None) -> JobStore | None:
+    """The persistent job store of the settings, None if it is not enabled."""
+    if settings is None:
+        settings = Settings()
+    if settings.scheduler_db_path is None:
+        return None
+    return _sqlite_job_store(settings.scheduler_db_path)
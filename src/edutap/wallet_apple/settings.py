@@ -4,10 +4,8 @@ from pydantic_settings import BaseSettings
 from pydantic_settings import SettingsConfigDict
 from typing import Literal
 
+import functools
 import os
-import structlog  # type: ignore
-
-logger = structlog.get_logger("edutap.wallet_apple")
 
 ROOT_DIR = Path(__file__).parents[3].resolve()
 
@@ -59,6 +57,142 @@ class Settings(BaseSettings):
     pydantic_extra: Literal["allow", "ignore", "forbid"] = "forbid"
     """How to handle extra fields in the pass data"""
 
+    zip_compression: Literal["auto", "stored", "deflated"] = "auto"
+    """Compression of the files in delivered pkpass archives.
+    `auto` deflates text files and stores already compressed images,
+    `stored` and `deflated` apply to all files.
+    """
+
+    zip_compression_level: int = Field(default=6, ge=0, le=9)
+    """zlib compression level for deflated files in pkpass archives"""
+
+    pass_store_dir: Path | None = None
+    """If set, signed passes are cached in a content addressed store in this
+    directory and shared between worker processes, see `store.PassStore`.
+    The cached pass is invalidated by `api.trigger_update`.
+    """
+
+    pass_store_max_size: int = 1 << 30
+    """Maximum disk usage of the pass store in bytes"""
+
+    pass_store_max_age: float | None = Field(default=3600.0, gt=0)
+    """Seconds a stored pass is served before it is rendered anew, None
+    serves it until it is invalidated"""
+
+    ingest_max_members: int = 100
+    """Maximum number of files in untrusted pkpass archives"""
+
+    ingest_max_member_size: int = 10 * 1024 * 1024
+    """Maximum uncompressed size of a file in untrusted pkpass archives in bytes"""
+
+    ingest_max_total_size: int = 20 * 1024 * 1024
+    """Maximum uncompressed size of untrusted pkpass archives in bytes"""
+
+    ingest_max_ratio: float = 100.0
+    """Maximum compression ratio of a file in untrusted pkpass archives"""
+
+    validate_trusted: bool = False
+    """If true, pass data marked as trusted (``api.new(data, trusted=True)``)
+    is validated anyway, e.g. for debugging a pipeline"""
+
+    deterministic_builds: bool = False
+    """If true, delivered pkpass archives are built reproducibly:
+    the same pass content always results in the same archive bytes
+    (except for the signature, which contains the signing time).
+    """
+
+    updatable_passes_cache_ttl: float = 0.0
+    """If positive, the updatable passes of a device are cached for this
+    many seconds in each worker, see `update_cache.UpdatablePassesCache`"""
+
+    updatable_passes_cache_max_entries: int = 10000
+    """Maximum number of cached lists of updatable passes"""
+
+    update_ledger_path: Path | None = None
+    """If set, pass updates and registrations are kept in a SQLite database
+    at this path, see `ledger.SQLiteLedger`"""
+
+    push_only_if_changed: bool = False
+    """If true, `api.trigger_update` renders the pass first and pushes only
+    if its content changed since the last push, see `digests`"""
+
+    pass_digest_store_path: Path | None = None
+    """SQLite database of the digests of the pushed passes, needed for
+    `push_only_if_changed`"""
+
+    scheduler_db_path: Path | None = None
+    """SQLite database of the updates scheduled at future times,
+    see `scheduler.UpdateScheduler`"""
+
+    registration_batch_size: int = 0
+    """If positive, registrations are answered at once and written to the
+    plugins in batches of up to this size, see
+    `registrations.RegistrationBatcher`"""
+
+    registration_batch_delay: float = 0.5
+    """Seconds a registration waits at most for its batch to be written"""
+
+    registration_pending_max: int = 10000
+    """Number of registrations waiting for their batch at most, further
+    registrations are written before the device is answered"""
+
+    registration_journal_path: Path | None = None
+    """If set, pending registrations are kept in a SQLite database at this
+    path until they are written, the registrations of a killed worker are
+    written by the next worker starting, see
+    `registrations.RegistrationJournal`"""
+
+    registration_filter_capacity: int = 0
+    """If positive, known registrations are kept in a probabilistic filter
+    sized for this number, registrations not in the filter are answered as
+    new without asking the plugins, see
+    `registration_filter.RegistrationFilter`"""
+
+    registration_filter_false_positive_rate: float = Field(default=0.01, gt=0, lt=1)
+    """Share of new registrations the filter reports as maybe known at its
+    capacity, these are looked up in the plugins"""
+
+    registration_filter_exclusive: bool = False
+    """True if this worker is the only process registering passes, then
+    registrations not in the filter are new for sure and the filter is not
+    rebuilt. Otherwise the filter of a worker learns the registrations of
+    the other workers by its rebuilds"""
+
+    registration_filter_rebuild_interval: float = 300.0
+    """Seconds between rebuilds of the filter of a worker that is not
+    exclusive from the plugins, registrations of other workers since the
+    last rebuild are answered as new. 0 disables such a filter"""
+
+    auth_failure_burst: int = 0
+    """If positive, a client address or device failing authentication more
+    often than this is rejected with 429 before the plugins are asked, see
+    `throttling.AuthGuard`"""
+
+    auth_failure_rate: float = Field(default=0.1, gt=0)
+    """Failed authentications per second allowed after the burst"""
+
+    auth_throttle_max_clients: int = 100000
+    """Number of client addresses and devices tracked for throttling"""
+
+    failed_token_cache_ttl: float = 0.0
+    """If positive, tokens failing authentication are rejected with 401
+    for this many seconds without asking the plugins again"""
+
+    failed_token_cache_max_entries: int = 100000
+    """Maximum number of failed tokens remembered"""
+
+    push_campaign_window: float | None = Field(default=None, gt=0)
+    """If set, the pushes of `api.trigger_update` are spread over at least
+    this many seconds, see `campaign.PushPacing`"""
+
+    push_target_fetch_qps: float | None = Field(default=None, gt=0)
+    """If set, pushes are sent at a rate that keeps the requests of the
+    notified devices below this many per second"""
+
+    push_fetches_per_device: float = Field(default=2.0, gt=0)
+    """Requests a device sends after a push, to derive the push rate from
+    `push_target_fetch_qps`"""
+
     def get_certificate_path(self, pass_type_identifier: str) -> Path:
         """Path to the certificate file for the given pass type identifier."""
         return self.cert_dir / f"certificate-{pass_type_identifier}.pem"
@@ -69,4 +203,12 @@ class Settings(BaseSettings):
 
     def get_logger(self):
         """A Structlog based logger."""
-        return logger
+        return _get_logger()
+
+
+@functools.cache
+def _get_logger():
+    # structlog is imported on first use, it is slow to import
+    import structlog  # type: ignore
+
+    return structlog.get_logger("edutap.wallet_apple")
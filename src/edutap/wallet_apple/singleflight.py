@@ -0,0 +1,111 @@
+"""
+Coalescing of concurrent identical calls.
+
+After a push to many devices holding the same pass, all of them request
+the updated pass within seconds. `SingleFlight` runs one call per key at a
+time; requests for a key already in flight await the same call and share
+its result::
+
+    flights = SingleFlight()
+    content = await flights.do(("pass.demo", "1234", True), render)
+
+The call runs as a task of its own, a caller that is cancelled (e.g. the
+device went away) does not cancel it for the others.
+"""
+
+from pydantic import BaseModel
+from typing import Awaitable
+from typing import Callable
+from typing import Generic
+from typing import Hashable
+from typing import TypeVar
+
+import asyncio
+
+T = TypeVar("T")
+
+
+class SingleFlightStats(BaseModel):
+    """Counters of a `SingleFlight`, e.g. for export as metrics."""
+
+    calls: int = 0
+    """calls run, one per key and flight"""
+
+    coalesced: int = 0
+    """requests served by a call already in flight"""
+
+    waiters: dict[str, int] = {}
+    """requests waiting per key in flight, keys joined with '/'"""
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+def _key_label(key: Hashable) -> str:
+    if isinstance(key, tuple):
+        return "/".join(str(part) for part in key)
+    return str(key)
+
+
+class SingleFlight(Generic[T]):
+    """Runs at most one call per key at a time, within one event loop."""
+
+    def __init__(self) -> None:
+        self._flights: dict[Hashable, _Flight] = {}
+        self._calls = 0
+        self._coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Result of ``func()``, shared with all concurrent requests of the key.
+
+        Exceptions of the call are raised to every waiting request. Once the
+        call is done, the next request of the key starts a new one.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+
+            def land(task: asyncio.Future) -> None:
+                self._land(key, flight)
+
+            flight.task.add_done_callback(land)
+            self._calls += 1
+        else:
+            self._coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+    def _land(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # retrieved, even if all requests went away meanwhile
+            flight.task.exception()
+
+    def waiters(self, key: Hashable) -> int:
+        """Number of requests waiting for the call of the key in flight."""
+        flight = self._flights.get(key)
+        return flight.waiters if flight is not None else 0
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(
+            calls=self._calls,
+            coalesced=self._coalesced,
+            waiters={
+                _key_label(key): flight.waiters for key, flight in self._flights.items()
+            },
+        )
+
+    def __len__(self) -> int:
+        """Number of calls in flight."""
+        return len(self._flights)
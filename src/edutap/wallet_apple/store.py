@@ -0,0 +1,301 @@
+"""
+Content addressed on-disk store for rendered (signed) pkpass archives.
+
+Archives are stored under their SHA-256 digest, a small index maps
+``(passTypeIdentifier, serialNumber)`` to the digest of the current
+rendering. All files are written to a temporary file first and moved in
+place with an atomic rename, so several worker processes can share one
+store directory without locking. Disk usage is bounded by evicting the
+least recently used archives once the size cap is exceeded, and index
+entries older than a maximum age turn into misses.
+
+Renderings for update requests of the devices are indexed apart from the
+ones for downloads, the plugins may render the two differently (see the
+``update`` argument of ``get_pass_data``).
+
+`invalidate` changes the version of the pass. A rendering that started
+before is stored, but only made current if the version is still the one
+read before rendering (see `version` and `set_current`), so a stale
+rendering in flight does not overwrite the invalidation.
+
+Layout of the store directory::
+
+    objects/<digest[:2]>/<digest>.pkpass
+    index/<key[:2]>/<key>      (contains the digest of the current archive)
+    index/<key[:2]>/<key>-update     (same for update requests)
+    versions/<key[:2]>/<key>   (random token, renewed by every invalidation)
+    tmp/
+"""
+
+from edutap.wallet_apple.settings import Settings
+from pathlib import Path
+from typing import BinaryIO
+from typing import Iterable
+
+import functools
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class PassStore:
+    """
+    Shares rendered passes between processes via the filesystem.
+
+    :param root: directory of the store, created if missing.
+    :param max_size: maximum size of all stored archives in bytes.
+    :param max_age: seconds a rendering stays current, None for no limit.
+    """
+
+    rescan_interval = 1000
+    """Number of writes after which the size of the store is determined anew,
+    in between the size is estimated from this process' own writes."""
+
+    def __init__(
+        self, root: str | Path, max_size: int = 1 << 30, max_age: float | None = None
+    ):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._estimated_size: int | None = None
+        self._writes = 0
+        self._objects = self.root / "objects"
+        self._index = self.root / "index"
+        self._versions = self.root / "versions"
+        self._tmp = self.root / "tmp"
+        for directory in (self._objects, self._index, self._versions, self._tmp):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _key(pass_type_id: str, serial_number: str) -> str:
+        return hashlib.sha256(f"{pass_type_id}\0{serial_number}".encode()).hexdigest()
+
+    def _index_path(
+        self, pass_type_id: str, serial_number: str, update: bool = False
+    ) -> Path:
+        key = self._key(pass_type_id, serial_number)
+        return self._index / key[:2] / (f"{key}-update" if update else key)
+
+    def _version_path(self, pass_type_id: str, serial_number: str) -> Path:
+        key = self._key(pass_type_id, serial_number)
+        return self._versions / key[:2] / key
+
+    def object_path(self, digest: str) -> Path:
+        """Path of the archive with the given SHA-256 hex digest."""
+        return self._objects / digest[:2] / f"{digest}.pkpass"
+
+    def _write_tmp(self, chunks: Iterable[bytes | memoryview]) -> tuple[str, str]:
+        """Writes the chunks to a temporary file, returns its name and SHA-256."""
+        digest = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    fh.write(chunk)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        return tmp_name, digest.hexdigest()
+
+    def _move(self, tmp_name: str, target: Path) -> None:
+        """Atomically moves the temporary file in place."""
+        target.parent.mkdir(exist_ok=True)
+        os.replace(tmp_name, target)
+
+    def get_digest(
+        self, pass_type_id: str, serial_number: str, update: bool = False
+    ) -> str | None:
+        """
+        Digest of the current archive of the pass, if any and not too old.
+
+        :param update: the archive rendered for update requests.
+        """
+        index_path = self._index_path(pass_type_id, serial_number, update)
+        try:
+            if (
+                self.max_age is not None
+                and index_path.stat().st_mtime < time.time() - self.max_age
+            ):
+                return None
+            return index_path.read_text()
+        except FileNotFoundError:
+            return None
+
+    def version(self, pass_type_id: str, serial_number: str) -> str:
+        """
+        Version of the pass, read before rendering it and handed to `put`.
+        """
+        try:
+            return self._version_path(pass_type_id, serial_number).read_text()
+        except FileNotFoundError:
+            return ""
+
+    def get_path(
+        self, pass_type_id: str, serial_number: str, update: bool = False
+    ) -> Path | None:
+        """
+        Path of the current archive of the pass or None on a miss.
+
+        A hit marks the archive as recently used.
+
+        :param update: the archive rendered for update requests.
+        """
+        digest = self.get_digest(pass_type_id, serial_number, update)
+        if digest is None:
+            return None
+        path = self.object_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted meanwhile
+            return None
+        return path
+
+    def put(
+        self,
+        pass_type_id: str,
+        serial_number: str,
+        data: bytes | BinaryIO | Iterable[bytes | memoryview],
+        version: str | None = None,
+        update: bool = False,
+    ) -> Path:
+        """
+        Stores the archive and makes it the current one of the pass.
+
+        :param data: the archive as bytes, file object or iterable of chunks,
+            e.g. a `archive.PkPassStream`.
+        :param version: the `version` of the pass read before rendering it,
+            the archive is not made current if the pass was invalidated
+            since. None makes it current in any case.
+        :param update: the archive is rendered for update requests.
+        :return: path of the stored archive.
+        """
+        path = self.add(data)
+        self.set_current(pass_type_id, serial_number, path, version, update)
+        return path
+
+    def add(self, data: bytes | BinaryIO | Iterable[bytes | memoryview]) -> Path:
+        """Stores the archive without making it current, returns its path."""
+        chunks: Iterable[bytes | memoryview]
+        if isinstance(data, bytes):
+            chunks = [data]
+        elif hasattr(data, "read"):
+            chunks = iter(functools.partial(data.read, READ_CHUNK_SIZE), b"")  # type: ignore[union-attr]
+        else:
+            chunks = data  # type: ignore[assignment]
+
+        tmp_name, digest = self._write_tmp(chunks)
+        path = self.object_path(digest)
+        self._move(tmp_name, path)
+
+        self._writes += 1
+        if self._estimated_size is None or self._writes >= self.rescan_interval:
+            self.evict(keep=path)
+        else:
+            self._estimated_size += path.stat().st_size
+            if self._estimated_size > self.max_size:
+                self.evict(keep=path)
+        return path
+
+    def set_current(
+        self,
+        pass_type_id: str,
+        serial_number: str,
+        path: Path,
+        version: str | None = None,
+        update: bool = False,
+    ) -> bool:
+        """
+        Makes the stored archive the current one of the pass, unless the
+        pass was invalidated since its `version` was read. Returns True if
+        the archive is current.
+
+        :param update: the archive is rendered for update requests.
+        """
+        if version is not None and version != self.version(pass_type_id, serial_number):
+            return False
+        index_path = self._index_path(pass_type_id, serial_number, update)
+        tmp_name, _ = self._write_tmp([path.stem.encode()])
+        self._move(tmp_name, index_path)
+        if version is not None and version != self.version(pass_type_id, serial_number):
+            # invalidated while writing, the invalidation may have missed
+            # the index entry; a miss is always safe
+            self._unlink(index_path)
+            return False
+        return True
+
+    def invalidate(self, pass_type_id: str, serial_number: str) -> None:
+        """Forgets the current archives of the pass, e.g. after its data changed."""
+        # the new version first, renderings in flight do not become current
+        tmp_name, _ = self._write_tmp([uuid.uuid4().hex.encode()])
+        self._move(tmp_name, self._version_path(pass_type_id, serial_number))
+        self._unlink(self._index_path(pass_type_id, serial_number))
+        self._unlink(self._index_path(pass_type_id, serial_number, update=True))
+
+    @staticmethod
+    def _unlink(path: Path) -> None:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def size(self) -> int:
+        """Total size of all stored archives in bytes."""
+        return sum(path.stat().st_size for path in self._objects.glob("*/*.pkpass"))
+
+    def evict(self, keep: Path | None = None) -> list[Path]:
+        """
+        Removes the least recently used archives until the store fits into
+        `max_size`. Index entries of evicted archives turn into misses.
+
+        :param keep: archive that must not be evicted, e.g. the one just written.
+        """
+        entries = []
+        total = 0
+        for path in self._objects.glob("*/*.pkpass"):
+            if path == keep:
+                total += path.stat().st_size
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        evicted = []
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.append(path)
+        self._estimated_size = total
+        self._writes = 0
+        return evicted
+
+
+@functools.cache
+def _pass_store(root: Path, max_size: int, max_age: float | None) -> PassStore:
+    return PassStore(root, max_size=max_size, max_age=max_age)
+
+
+def get_pass_store(settings: Settings | None = None) -> PassStore | None:
+    """The store configured in the settings, None if it is not enabled."""
+    if settings is None:
+        settings = Settings()
+    if settings.pass_store_dir is None:
+        return None
+    return _pass_store(
+        settings.pass_store_dir,
+        settings.pass_store_max_size,
+        settings.pass_store_max_age,
+    )
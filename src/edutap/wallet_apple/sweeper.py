@@ -0,0 +1,251 @@
+"""
+Bulk voiding of expired passes.
+
+The sweeper takes candidate passes from a source, keeps those whose
+``expirationDate`` has passed, renders them voided with a compiled
+`templates.PassTemplate`, signs and saves them, and pushes the updates in
+batches::
+
+    voided = PassTemplate.compile(
+        pass_object.model_copy(update={"voided": True}),
+        {"serialNumber": "serialNumber", "name": "storeCard.primaryFields.0.value"},
+    )
+    sweeper = Sweeper(voided, save=save_pass, checkpoint=SweepCheckpoint(path))
+    report = await sweeper.run(source)
+
+The source is called with the key ``(passTypeIdentifier, serialNumber)``
+of the last pass of the last finished batch, None at the start, and yields
+the candidates after it in a stable order, e.g. ordered by the key. After
+each batch the key is written to the checkpoint, so an interrupted sweep
+resumes with the next batch. A pass of an interrupted batch may be
+processed twice.
+
+With ``dry_run=True`` nothing is saved or pushed: the candidates are
+counted and a few passes are rendered to estimate the runtime.
+"""
+
+from edutap.wallet_apple import api
+from edutap.wallet_apple.models.passes import PkPass
+from edutap.wallet_apple.scheduler import parse_date
+from edutap.wallet_apple.settings import Settings
+from edutap.wallet_apple.templates import PassTemplate
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+
+import json
+import os
+import tempfile
+import time
+
+
+class SweepCandidate(BaseModel):
+    """A pass that may be expired."""
+
+    pass_type_id: str
+    serial_number: str
+
+    expiration_date: str | None
+    """ISO 8601 date of ``expirationDate`` of the pass"""
+
+    values: dict[str, Any] = {}
+    """placeholder values of the template for the pass"""
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.pass_type_id, self.serial_number)
+
+
+class SweepReport(BaseModel):
+    """Outcome of a sweep."""
+
+    dry_run: bool
+    resumed_after: tuple[str, str] | None = None
+    """key of the checkpoint the sweep resumed after"""
+
+    scanned: int = 0
+    """candidates looked at"""
+
+    expired: int = 0
+    """candidates past their expiration date"""
+
+    voided: int = 0
+    """passes rendered voided and saved"""
+
+    batches: int = 0
+    """batches of pushes triggered"""
+
+    seconds_per_pass: float | None = None
+    """measured time to render and sign one pass"""
+
+    estimated_seconds: float | None = None
+    """dry run only: estimated time to render and sign the expired passes,
+    the pushes not included"""
+
+    elapsed: float = 0.0
+
+
+class SweepCheckpoint:
+    """
+    Progress of a sweep in a JSON file, replaced atomically.
+
+    :param path: the file, its directory must exist.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+
+    def load(self) -> dict[str, Any] | None:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: dict[str, Any]) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_name, self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class Sweeper:
+    """
+    Voids expired passes in batches.
+
+    :param template: compiled voided pass, rendered with the values of the
+        candidates. A rendered pass must have the pass type identifier and
+        serial number of its candidate, e.g. with a placeholder for
+        ``serialNumber``.
+    :param save: stores a voided pass, so the plugin delivers it from now on.
+    :param checkpoint: progress for resuming, optional.
+    :param batch_size: passes saved before their updates are pushed.
+    :param sign: sign the rendered passes.
+    :param trigger: pushes the updates of the passes of a batch,
+        `api.trigger_updates` by default.
+    :param sample_size: passes rendered by a dry run to measure the time.
+    """
+
+    def __init__(
+        self,
+        template: PassTemplate,
+        save: Callable[[SweepCandidate, PkPass], Awaitable[Any]],
+        checkpoint: SweepCheckpoint | None = None,
+        batch_size: int = 1000,
+        sign: bool = True,
+        trigger: Callable[[list[tuple[str, str]]], Awaitable[Any]] | None = None,
+        sample_size: int = 20,
+        settings: Settings | None = None,
+    ) -> None:
+        self.template = template
+        self.save = save
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.sign = sign
+        self.trigger = trigger or self._trigger_updates
+        self.sample_size = sample_size
+        self.settings = settings or Settings()
+
+    async def _trigger_updates(self, passes: list[tuple[str, str]]) -> Any:
+        return await api.trigger_updates(passes, settings=self.settings)
+
+    def render(self, candidate: SweepCandidate) -> PkPass:
+        """
+        The voided pass of the candidate, signed if enabled.
+
+        :raises ValueError: if the pass type identifier or serial number of
+            the rendered pass are not those of the candidate.
+        """
+        pkpass = self.template.pkpass(**candidate.values)
+        pass_json = json.loads(pkpass.files["pass.json"])
+        for name, expected in (
+            ("passTypeIdentifier", candidate.pass_type_id),
+            ("serialNumber", candidate.serial_number),
+        ):
+            # it would be signed and delivered as another pass
+            if pass_json.get(name) != expected:
+                raise ValueError(
+                    f"rendered {name} {pass_json.get(name)!r} is not"
+                    f" {expected!r} of the candidate"
+                )
+        if self.sign:
+            pkpass._sign(*api._signing_identity(candidate.pass_type_id, self.settings))
+        return pkpass
+
+    async def run(
+        self,
+        source: Callable[[tuple[str, str] | None], Iterable[SweepCandidate]],
+        dry_run: bool = False,
+        now: float | None = None,
+    ) -> SweepReport:
+        """
+        Sweeps the candidates of the source, resuming after the checkpoint.
+
+        :param now: the passes expired before this time (seconds since the
+            epoch) are voided, the time of the checkpoint or the current
+            time by default.
+        """
+        started = time.monotonic()
+        report = SweepReport(dry_run=dry_run)
+        state = None
+        if self.checkpoint is not None and not dry_run:
+            state = self.checkpoint.load()
+        after = None
+        if state is not None:
+            after = tuple(state["after"]) if state["after"] is not None else None
+            report.resumed_after = after
+            now = state["now"] if now is None else now
+        if now is None:
+            now = time.time()
+
+        render_time = 0.0
+        rendered = 0
+        batch: list[SweepCandidate] = []
+        for candidate in source(after):  # type: ignore[arg-type]
+            report.scanned += 1
+            expires = parse_date(candidate.expiration_date)
+            if expires is None or expires > now:
+                continue
+            report.expired += 1
+            if dry_run:
+                if rendered < self.sample_size:
+                    start = time.perf_counter()
+                    self.render(candidate)
+                    render_time += time.perf_counter() - start
+                    rendered += 1
+                continue
+            start = time.perf_counter()
+            pkpass = self.render(candidate)
+            render_time += time.perf_counter() - start
+            rendered += 1
+            await self.save(candidate, pkpass)
+            report.voided += 1
+            batch.append(candidate)
+            if len(batch) >= self.batch_size:
+                await self._finish_batch(batch, now, report)
+                batch = []
+        if batch:
+            await self._finish_batch(batch, now, report)
+
+        if rendered:
+            report.seconds_per_pass = render_time / rendered
+        if dry_run and report.seconds_per_pass is not None:
+            report.estimated_seconds = report.seconds_per_pass * report.expired
+        if self.checkpoint is not None and not dry_run:
+            self.checkpoint.clear()
+        report.elapsed = time.monotonic() - started
+        return report
+
+    async def _finish_batch(
+        self, batch: list[SweepCandidate], now: float, report: SweepReport
+    ) -> None:
+        # one push per pass, even if it is listed twice
+        await self.trigger(list(dict.fromkeys(candidate.key for candidate in batch)))
+        report.batches += 1
+        if self.checkpoint is not None:
+            self.checkpoint.save({"after": batch[-1].key, "now": now})
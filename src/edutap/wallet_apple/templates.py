@@ -0,0 +1,193 @@
+"""
+Compiled pass.json templates for high volume pass generation.
+
+A `PassTemplate` is compiled once from a validated `Pass`. The fields that
+differ per pass holder (serial number, barcode message, field values, ...)
+are declared as placeholders and addressed by their dotted path in the pass,
+e.g. ``serialNumber``, ``barcodes.0.message`` or
+``storeCard.primaryFields.0.value``.
+
+The pass is serialised once with unique markers at the placeholder positions
+and split into static byte chunks. Rendering an instance validates and
+JSON-encodes only the placeholder values and joins them with the chunks.
+The result is byte-identical to what `PkPass` produces for the fully
+validated pass.
+"""
+
+from edutap.wallet_apple.models.passes import Pass
+from edutap.wallet_apple.models.passes import PkPass
+from enum import Enum
+from pydantic import BaseModel
+from pydantic import TypeAdapter
+from typing import Any
+
+import typing
+import uuid
+
+_SCALAR_TYPES = (str, int, float, bool, bytes, Enum)
+
+
+def _unwrap_list(annotation: Any) -> Any:
+    """Returns the item annotation of a (optional) list annotation."""
+    for arg in (annotation, *typing.get_args(annotation)):
+        if typing.get_origin(arg) is list:
+            return typing.get_args(arg)[0]
+    raise ValueError(f"{annotation} is not a list annotation")
+
+
+def _resolve(pass_object: Pass, path: str) -> tuple[Any, str | int, Any]:
+    """
+    Walks the dotted path and returns the parent object, the last path
+    segment (attribute name or list index) and the annotation of the target.
+    """
+    parent: Any = None
+    current: Any = pass_object
+    annotation: Any = type(pass_object)
+    segment: str | int = ""
+    for part in path.split("."):
+        parent = current
+        if isinstance(current, BaseModel):
+            segment = part
+            field = type(current).model_fields.get(part)
+            if field is None:
+                raise ValueError(f"placeholder path {path!r}: unknown field {part!r}")
+            annotation = field.annotation
+            current = getattr(current, part)
+        elif isinstance(current, list):
+            segment = int(part)
+            annotation = _unwrap_list(annotation)
+            current = current[segment]
+        else:
+            raise ValueError(f"placeholder path {path!r}: cannot descend into {part!r}")
+        if current is None:
+            raise ValueError(f"placeholder path {path!r} is not set in the template")
+
+    if not isinstance(current, _SCALAR_TYPES):
+        raise ValueError(f"placeholder path {path!r} does not point to a scalar value")
+    return parent, segment, annotation
+
+
+class PassTemplate:
+    """
+    A pre-serialised pass.json with typed, JSON-escaped placeholders.
+
+    Use `PassTemplate.compile` to create one and `render` or `pkpass` to
+    produce the individual passes.
+    """
+
+    def __init__(
+        self,
+        chunks: list[bytes],
+        slots: list[str],
+        adapters: dict[str, TypeAdapter],
+        files: dict[str, bytes] | None = None,
+    ):
+        self._chunks = chunks
+        self._slots = slots
+        self._adapters = adapters
+        self.files = dict(files or {})
+        """Static files (images, localizations) added to every rendered pass"""
+
+    @property
+    def placeholders(self) -> list[str]:
+        """Names of the placeholders that need a value when rendering."""
+        return list(self._adapters)
+
+    @classmethod
+    def compile(
+        cls,
+        pass_object: Pass,
+        placeholders: dict[str, str],
+        files: dict[str, bytes] | None = None,
+    ) -> "PassTemplate":
+        """
+        Compiles a validated pass into a template.
+
+        :param pass_object: validated pass, the values at the placeholder
+            paths are only used to check the path exists.
+        :param placeholders: mapping of placeholder name to dotted path in the pass.
+        :param files: static files to include in every rendered `PkPass`.
+        """
+        template_object = pass_object.model_copy(deep=True)
+        prefix = f"edutap-placeholder-{uuid.uuid4().hex}-"
+        adapters: dict[str, TypeAdapter] = {}
+        # the serialised markers and the names of their placeholders
+        markers: dict[bytes, str] = {}
+        for name, path in placeholders.items():
+            parent, segment, annotation = _resolve(template_object, path)
+            marker = f"{prefix}{name}"
+            if isinstance(segment, int):
+                # list index
+                parent[segment] = marker
+            else:
+                # assignment is not validated, so the marker is accepted for
+                # non-string fields too, the serializer just passes it through
+                setattr(parent, segment, marker)
+            adapters[name] = TypeAdapter(annotation)
+            markers[f'"{marker}"'.encode()] = name
+
+        pass_json = template_object.model_dump_json(
+            exclude_none=True, indent=4, warnings=False
+        ).encode("utf-8")
+
+        chunks: list[bytes] = []
+        slots: list[str] = []
+        position = 0
+        while True:
+            found = [
+                (index, serialised)
+                for serialised in markers
+                if (index := pass_json.find(serialised, position)) >= 0
+            ]
+            if not found:
+                break
+            index, serialised = min(found)
+            chunks.append(pass_json[position:index])
+            slots.append(markers[serialised])
+            position = index + len(serialised)
+        chunks.append(pass_json[position:])
+
+        missing = set(placeholders) - set(slots)
+        if missing:
+            raise ValueError(f"placeholders not serialised: {sorted(missing)}")
+        return cls(chunks, slots, adapters, files)
+
+    def _encode(self, values: dict[str, Any]) -> dict[str, bytes]:
+        unknown = set(values) - set(self._adapters)
+        if unknown:
+            raise ValueError(f"unknown placeholders: {sorted(unknown)}")
+        encoded = {}
+        for name, adapter in self._adapters.items():
+            if name not in values:
+                raise ValueError(f"missing value for placeholder {name!r}")
+            value = adapter.validate_python(values[name])
+            if value is None:
+                raise ValueError(f"placeholder {name!r} must not be None")
+            encoded[name] = adapter.dump_json(value)
+        return encoded
+
+    def render(self, **values: Any) -> bytes:
+        """
+        Renders the pass.json bytes for one pass.
+
+        Each value is validated against the type of the field it replaces,
+        a `pydantic.ValidationError` is raised for values of the wrong type.
+        """
+        encoded = self._encode(values)
+        parts = [self._chunks[0]]
+        for slot, chunk in zip(self._slots, self._chunks[1:]):
+            parts.append(encoded[slot])
+            parts.append(chunk)
+        return b"".join(parts)
+
+    def pkpass(self, **values: Any) -> PkPass:
+        """
+        Renders a `PkPass` with the static files and the rendered pass.json.
+
+        The returned pass has no `pass_object`, it is meant to be signed and
+        exported directly, e.g. with `api.sign`.
+        """
+        pkpass = PkPass()
+        pkpass.files = dict(self.files)
+        pkpass.files["pass.json"] = self.render(**values)
+        return pkpass
@@ -0,0 +1,226 @@
+"""
+Throttling of clients failing authentication.
+
+Scanners try tokens at ``/download-pass/{token}`` and the ``Authorization``
+header of the device endpoints, each try costs a decryption or a call to
+the plugin. The `AuthGuard` rejects such requests before the plugins are
+asked:
+
+- failed tokens are remembered for a while, trying the same token again
+  is rejected with 401 at once;
+- every failure takes a token from the bucket of the client address and,
+  for the device endpoints, of the device. A client with an empty bucket
+  is rejected with 429 until the bucket refilled.
+
+Successful requests take nothing from the buckets, devices behind a shared
+address are throttled only if they fail. The state is kept in the memory
+of the worker. Behind a reverse proxy, run the server with the proxy
+headers enabled, or all clients share the address of the proxy.
+"""
+
+from collections import OrderedDict
+from edutap.wallet_apple.settings import Settings
+from pydantic import BaseModel
+from typing import Callable
+from typing import Iterable
+
+import functools
+import hashlib
+import time
+
+
+class GuardStats(BaseModel):
+    """Counters of an `AuthGuard`, e.g. for export as metrics."""
+
+    failures: int
+    """failed authentications"""
+
+    rejected_throttled: int
+    """requests rejected because the client failed too often"""
+
+    rejected_failed_token: int
+    """requests rejected because the token failed before"""
+
+    clients: int
+    """clients with a bucket"""
+
+    failed_tokens: int
+    """failed tokens remembered"""
+
+
+class TokenBuckets:
+    """
+    Token buckets per key, bounded to the most recently used keys.
+
+    :param rate: tokens refilled per second.
+    :param burst: size of a bucket.
+    :param max_keys: number of buckets, dropped buckets start full again.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_keys: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def _level(self, key: str, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(self.burst)
+        tokens, last = bucket
+        return min(float(self.burst), tokens + (now - last) * self.rate)
+
+    def allows(self, key: str) -> bool:
+        """True if the bucket of the key has a token left."""
+        return self._level(key, self.clock()) >= 1.0
+
+    def take(self, key: str) -> None:
+        """Takes a token from the bucket of the key, if there is one left."""
+        now = self.clock()
+        self._buckets[key] = (max(self._level(key, now) - 1.0, 0.0), now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class FailedTokens:
+    """
+    Digests of failed tokens with a time to live.
+
+    :param ttl: seconds a failed token is remembered.
+    :param max_entries: number of tokens, the oldest ones are dropped first.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._expires: OrderedDict[bytes, float] = OrderedDict()
+
+    @staticmethod
+    def _digest(token: Iterable[str | None]) -> bytes:
+        data = "\0".join(part or "" for part in token).encode("utf-8")
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def __contains__(self, token: Iterable[str | None]) -> bool:
+        digest = self._digest(token)
+        expires = self._expires.get(digest)
+        if expires is None:
+            return False
+        if expires <= self.clock():
+            del self._expires[digest]
+            return False
+        return True
+
+    def add(self, token: Iterable[str | None]) -> None:
+        digest = self._digest(token)
+        self._expires[digest] = self.clock() + self.ttl
+        self._expires.move_to_end(digest)
+        while len(self._expires) > self.max_entries:
+            self._expires.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+class AuthGuard:
+    """
+    Rejects clients failing authentication, before the plugins are asked.
+
+    Clients are given as keys like ``ip:192.0.2.1`` or ``device:<id>``,
+    tokens as tuples of the token and what it authenticates.
+
+    :param buckets: failures allowed per client, None to not throttle.
+    :param failed_tokens: failed tokens, None to not remember them.
+    """
+
+    def __init__(
+        self,
+        buckets: TokenBuckets | None = None,
+        failed_tokens: FailedTokens | None = None,
+    ) -> None:
+        self.buckets = buckets
+        self.failed_tokens = failed_tokens
+        self._failures = 0
+        self._rejected_throttled = 0
+        self._rejected_failed_token = 0
+
+    def check(self, clients: Iterable[str], token: Iterable[str | None]) -> str | None:
+        """
+        The reason to reject the request, ``"throttled"`` or
+        ``"failed token"``, None if it is to be authenticated.
+        """
+        if self.buckets is not None and not all(
+            self.buckets.allows(client) for client in clients
+        ):
+            self._rejected_throttled += 1
+            return "throttled"
+        if self.failed_tokens is not None and token in self.failed_tokens:
+            self._rejected_failed_token += 1
+            # trying a failed token again is a failure as well
+            self._take(clients)
+            return "failed token"
+        return None
+
+    def failed(self, clients: Iterable[str], token: Iterable[str | None]) -> None:
+        """Records a failed authentication of the clients with the token."""
+        self._failures += 1
+        if self.failed_tokens is not None:
+            self.failed_tokens.add(token)
+        self._take(clients)
+
+    def _take(self, clients: Iterable[str]) -> None:
+        if self.buckets is not None:
+            for client in clients:
+                self.buckets.take(client)
+
+    def stats(self) -> GuardStats:
+        return GuardStats(
+            failures=self._failures,
+            rejected_throttled=self._rejected_throttled,
+            rejected_failed_token=self._rejected_failed_token,
+            clients=len(self.buckets) if self.buckets is not None else 0,
+            failed_tokens=(
+                len(self.failed_tokens) if self.failed_tokens is not None else 0
+            ),
+        )
+
+
+@functools.cache
+def _auth_guard(
+    rate: float, burst: int, max_clients: int, ttl: float, max_tokens: int
+) -> AuthGuard:
+    return AuthGuard(
+        buckets=TokenBuckets(rate, burst, max_clients) if burst > 0 else None,
+        failed_tokens=FailedTokens(ttl, max_tokens) if ttl > 0 else None,
+    )
+
+
+def get_auth_guard(settings: Settings | None = None) -> AuthGuard | None:
+    """The guard configured in the settings, None if it is not enabled."""
+    if settings is None:
+        settings = Settings()
+    if settings.auth_failure_burst <= 0 and settings.failed_token_cache_ttl <= 0:
+        return None
+    return _auth_guard(
+        settings.auth_failure_rate,
+        settings.auth_failure_burst,
+        settings.auth_throttle_max_clients,
+        settings.failed_token_cache_ttl,
+        settings.failed_token_cache_max_entries,
+    )
@@ -0,0 +1,146 @@
+"""
+Short-lived cache of the updatable passes of devices.
+
+Devices ask for their updatable passes again and again with the same
+``passesUpdatedSince`` tag, e.g. whenever the pass is shown. The answers
+of the plugin are kept for a few seconds per ``(deviceLibraryIdentifier,
+passTypeIdentifier, passesUpdatedSince)``, in the memory of the worker.
+
+Registering or unregistering a pass drops the cached answers of the
+device, `api.trigger_update` drops those of the pass type. Other worker
+processes learn about an update only from the update ledger: with a
+ledger, every answer is cached with the sequence number of the last
+update of its pass type and is outdated once the number changed. Without
+a ledger, answers without passes are not cached, a device would miss the
+update announced by a push until the TTL expired. Other answers are kept
+until the TTL expires, so keep it short.
+"""
+
+from collections import OrderedDict
+from edutap.wallet_apple.models.handlers import SerialNumbers
+from edutap.wallet_apple.settings import Settings
+
+import functools
+import time
+
+_Key = tuple[str, str, str | None]
+
+
+class UpdatablePassesCache:
+    """
+    Bounded cache of `SerialNumbers` with a time to live.
+
+    :param ttl: seconds an answer is kept.
+    :param max_entries: maximum number of answers, the least recently used
+        ones are dropped first.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[
+            _Key, tuple[float, int, int | None, SerialNumbers]
+        ] = OrderedDict()
+        # tags cached per device and pass type, to drop them on registration
+        self._tags: dict[tuple[str, str], set[str | None]] = {}
+        # answers of older generations of a pass type are outdated
+        self._generations: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        last_updated: str | None,
+        sequence: int | None = None,
+    ) -> SerialNumbers | None:
+        """
+        The cached answer, None if there is none or it is outdated.
+
+        :param sequence: the last update of the pass type in the ledger,
+            answers cached with another one are outdated.
+        """
+        key = (device_library_id, pass_type_id, last_updated)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, generation, cached_sequence, serial_numbers = entry
+            if (
+                expires > time.monotonic()
+                and generation == self._generations.get(pass_type_id, 0)
+                and cached_sequence == sequence
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return serial_numbers
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        device_library_id: str,
+        pass_type_id: str,
+        last_updated: str | None,
+        serial_numbers: SerialNumbers,
+        sequence: int | None = None,
+    ) -> None:
+        """
+        Caches the answer. Without the sequence of the ledger, answers
+        without passes are not cached, other workers cannot outdate them.
+        """
+        if sequence is None and not serial_numbers.serialNumbers:
+            return
+        key = (device_library_id, pass_type_id, last_updated)
+        self._entries[key] = (
+            time.monotonic() + self.ttl,
+            self._generations.get(pass_type_id, 0),
+            sequence,
+            serial_numbers,
+        )
+        self._entries.move_to_end(key)
+        self._tags.setdefault(key[:2], set()).add(last_updated)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(
+        self, pass_type_id: str, device_library_id: str | None = None
+    ) -> None:
+        """
+        Drops the answers of a device, or of all devices if none is given.
+        """
+        if device_library_id is None:
+            self._generations[pass_type_id] = self._generations.get(pass_type_id, 0) + 1
+            return
+        for last_updated in self._tags.pop((device_library_id, pass_type_id), ()):
+            del self._entries[(device_library_id, pass_type_id, last_updated)]
+
+    def _remove(self, key: _Key) -> None:
+        del self._entries[key]
+        tags = self._tags.get(key[:2])
+        if tags is not None:
+            tags.discard(key[2])
+            if not tags:
+                del self._tags[key[:2]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@functools.cache
+def _updatable_passes_cache(ttl: float, max_entries: int) -> UpdatablePassesCache:
+    return UpdatablePassesCache(ttl, max_entries=max_entries)
+
+
+def get_updatable_passes_cache(
+    settings: Settings | None = None,
+) -> UpdatablePassesCache | None:
+    """The cache configured in the settings, None if it is not enabled."""
+    if settings is None:
+        settings = Settings()
+    if settings.updatable_passes_cache_ttl <= 0:
+        return None
+    return _updatable_passes_cache(
+        settings.updatable_passes_cache_ttl,
+        settings.updatable_passes_cache_max_entries,
+    )
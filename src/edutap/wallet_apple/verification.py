@@ -0,0 +1,243 @@
+"""
+Verification of raw pkpass archives.
+
+Unlike `PkPass.verify`, the archive is checked as it is: every member is
+streamed once and hashed, the hashes are compared with manifest.json and
+the PKCS#7 signature is checked over the raw manifest bytes. No `Pass`
+model is built, so this is suitable for bulk audits::
+
+    python -m edutap.wallet_apple.verification -j 8 /path/to/passes
+"""
+
+from edutap.wallet_apple import crypto
+from edutap.wallet_apple.archive import DEFAULT_CHUNK_SIZE
+from edutap.wallet_apple.archive import IngestionLimits
+from edutap.wallet_apple.archive import UntrustedArchiveError
+from pathlib import Path
+from pydantic import BaseModel
+from typing import BinaryIO
+from typing import Iterable
+from typing import Iterator
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import zipfile
+import zlib
+
+UNHASHED_FILES = ("manifest.json", "signature")
+
+
+class VerificationResult(BaseModel):
+    """Outcome of the verification of one archive."""
+
+    source: str
+    """path of the archive, if known"""
+
+    errors: list[str] = []
+    """all problems found, empty if the archive is valid"""
+
+    signature_checked: bool = False
+    """False if the signature was not checked, e.g. because the installed
+    cryptography library does not support the verification"""
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def _hash_members(
+    zf: zipfile.ZipFile,
+    limits: IngestionLimits | None,
+    chunk_size: int,
+) -> tuple[dict[str, str], dict[str, bytes]]:
+    """
+    Streams all members once, returns the SHA-1 hex digests of the hashed
+    members and the raw content of manifest and signature.
+    """
+    infos = zf.infolist()
+    if limits is not None:
+        limits.check_declared(infos)
+    hashes = {}
+    raw = {}
+    for info in infos:
+        sha1 = hashlib.sha1()
+        chunks = []
+        size = 0
+        with zf.open(info) as member:
+            while chunk := member.read(chunk_size):
+                size += len(chunk)
+                if limits is not None:
+                    limits.check_member(info, size)
+                if info.filename in UNHASHED_FILES:
+                    chunks.append(chunk)
+                else:
+                    sha1.update(chunk)
+        if info.filename in UNHASHED_FILES:
+            raw[info.filename] = b"".join(chunks)
+        else:
+            hashes[info.filename] = sha1.hexdigest()
+    return hashes, raw
+
+
+def verify_archive(
+    zip_file: BinaryIO | str | Path,
+    check_signature: bool = True,
+    limits: IngestionLimits | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> VerificationResult:
+    """
+    Verifies a pkpass archive without loading it into a `PkPass`.
+
+    :param zip_file: file object or path of the archive.
+    :param check_signature: check the PKCS#7 signature over manifest.json,
+        skipped if the cryptography library does not support it.
+    :param limits: optional bounds, for archives from untrusted sources.
+    :return: the result, errors of the archive are reported in it and never
+        raised, so one broken archive does not abort a bulk audit.
+    """
+    result = VerificationResult(
+        source=str(zip_file) if isinstance(zip_file, (str, Path)) else "<stream>"
+    )
+    try:
+        _verify(result, zip_file, check_signature, limits, chunk_size)
+    except Exception as ex:
+        result.errors.append(f"verification failed: {ex!r}")
+    return result
+
+
+def _verify(
+    result: VerificationResult,
+    zip_file: BinaryIO | str | Path,
+    check_signature: bool,
+    limits: IngestionLimits | None,
+    chunk_size: int,
+) -> None:
+    try:
+        with zipfile.ZipFile(zip_file) as zf:
+            hashes, raw = _hash_members(zf, limits, chunk_size)
+    except (
+        zipfile.BadZipFile,
+        UntrustedArchiveError,
+        OSError,
+        zlib.error,
+        EOFError,
+        NotImplementedError,
+    ) as ex:
+        result.errors.append(f"unreadable archive: {ex}")
+        return
+
+    if "pass.json" not in hashes:
+        result.errors.append("pass.json is missing")
+    if "manifest.json" not in raw:
+        result.errors.append("manifest.json is missing")
+        return
+    try:
+        manifest = json.loads(raw["manifest.json"])
+    except ValueError as ex:
+        result.errors.append(f"manifest.json is invalid: {ex}")
+        return
+    if not isinstance(manifest, dict):
+        result.errors.append("manifest.json is not an object")
+        return
+
+    for name, digest in hashes.items():
+        if name not in manifest:
+            result.errors.append(f"{name} is not in the manifest")
+        elif manifest[name] != digest:
+            result.errors.append(f"{name} does not match the manifest")
+    for name in manifest:
+        if name not in hashes:
+            result.errors.append(f"{name} of the manifest is missing")
+
+    if check_signature and crypto.supports_verification():
+        if "signature" not in raw:
+            result.errors.append("signature is missing")
+        else:
+            try:
+                crypto.verify_manifest(raw["manifest.json"], raw["signature"])
+            except crypto.VerificationError as ex:
+                result.errors.append(f"signature is invalid: {ex}")
+            except ValueError as ex:
+                # e.g. a signature that is no PKCS#7 structure at all
+                result.errors.append(f"signature is unreadable: {ex}")
+            result.signature_checked = True
+
+
+def iter_pkpass_files(paths: Iterable[str | Path]) -> Iterator[Path]:
+    """All ``.pkpass`` files of the given files and directories (recursively)."""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob("*.pkpass"))
+        else:
+            yield path
+
+
+def verify_many(
+    paths: Iterable[str | Path],
+    workers: int | None = None,
+    check_signature: bool = True,
+) -> Iterator[VerificationResult]:
+    """
+    Verifies many archives in parallel worker processes.
+
+    Results are yielded in the order of the files.
+    """
+    files = list(iter_pkpass_files(paths))
+    if workers == 1:
+        for path in files:
+            yield verify_archive(path, check_signature=check_signature)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(
+            verify_archive,
+            files,
+            [check_signature] * len(files),
+            chunksize=32,
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Command line interface for bulk audits, returns the exit code."""
+    parser = argparse.ArgumentParser(
+        prog="python -m edutap.wallet_apple.verification",
+        description="Verify manifests and signatures of pkpass archives.",
+    )
+    parser.add_argument("paths", nargs="+", help="pkpass files or directories")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--no-signature",
+        action="store_true",
+        help="only check the manifest hashes",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="also list valid archives"
+    )
+    args = parser.parse_args(argv)
+
+    total = failed = 0
+    for result in verify_many(
+        args.paths, workers=args.jobs, check_signature=not args.no_signature
+    ):
+        total += 1
+        if not result.ok:
+            failed += 1
+            for error in result.errors:
+                print(f"{result.source}: {error}")
+        elif args.verbose:
+            print(f"{result.source}: ok")
+    print(f"{total} archives verified, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,9 @@ from plugins import SettingsTest
 from pydantic import ValidationError
 
 import conftest as conftest
+import datetime
 import json
+import os
 import pytest
 
 settings = SettingsTest()
@@ -250,3 +252,286 @@ def test_sign_existing_generic_pass_and_get_bytes_io(
                 fh1.write(zip_fh.read())
 
         load_pass_viewer(ofile)
+
+
+def test_load_pass_from_zip_lazy(apple_passes_dir):
+    path = apple_passes_dir / "BoardingPass.pkpass"
+    with open(path, "rb") as fh:
+        eager = api.new(file=fh)
+
+    pkpass = api.new(file=path, lazy=True)
+    # nothing is read or validated before it is used
+    assert pkpass.pass_object is None
+    assert not any(pkpass.files.is_loaded(name) for name in pkpass.files)
+    assert set(pkpass.files) == set(eager.files)
+
+    assert pkpass.is_signed
+    assert not pkpass.files.is_loaded("logo@2x.png")
+    # stored images are memoryviews on the mapped file
+    assert isinstance(pkpass.files["icon.png"], memoryview)
+    assert pkpass.files["icon.png"] == eager.files["icon.png"]
+    assert pkpass.files["logo.png"] == eager.files["logo.png"]
+
+    # the pass json is validated on first use
+    assert pkpass.pass_object_safe == eager.pass_object_safe
+    assert pkpass.pass_object is not None
+    pkpass.close()
+
+
+def test_close_lazy_pass(apple_passes_dir):
+    path = apple_passes_dir / "BoardingPass.pkpass"
+    with api.new(file=path, lazy=True) as pkpass:
+        icon = bytes(pkpass.files["icon.png"])
+        assert isinstance(pkpass.files["icon.png"], memoryview)
+    assert pkpass.files._mmap.closed
+    # read members stay available as copies
+    assert pkpass.files["icon.png"] == icon
+    assert not isinstance(pkpass.files["icon.png"], memoryview)
+    with pytest.raises(ValueError):
+        pkpass.files["logo.png"]
+    # closing twice is fine
+    pkpass.close()
+
+
+def test_lazy_pass_roundtrip(apple_passes_dir):
+    path = apple_passes_dir / "BoardingPass.pkpass"
+    pkpass = api.new(file=path, lazy=True)
+    original_pass_json = bytes(pkpass.files["pass.json"])
+
+    # without touching the pass object, pass.json is kept as is
+    pkpass.files["manifest.json"] = pkpass._create_manifest().encode()
+    assert pkpass.files["pass.json"] == original_pass_json
+    reloaded = api.new(file=api.pkpass(pkpass))
+    assert set(reloaded.files) == set(pkpass.files)
+    for name in reloaded.files:
+        assert reloaded.files[name] == pkpass.files[name]
+
+    # changes on the pass object are written
+    pkpass = api.new(file=path, lazy=True)
+    pkpass.pass_object_safe.serialNumber = "lazy-1"
+    del pkpass.files["logo@2x.png"]
+    reloaded = api.new(file=BytesIO(api.pkpass_stream(pkpass).getvalue()))
+    assert reloaded.pass_object_safe.serialNumber == "lazy-1"
+    assert "logo@2x.png" not in reloaded.files
+
+
+@pytest.mark.skipif(not key_files_exist(), reason="key files are missing")
+@pytest.mark.parametrize("pass_type_id", settings.get_available_passtype_ids())
+def test_sign_lazy_pass(apple_passes_dir, settings_test: Settings, pass_type_id: str):
+    with open(apple_passes_dir / "BoardingPass.pkpass", "rb") as fh:
+        pkpass = api.new(file=fh, lazy=True)
+        pkpass.pass_object_safe.passTypeIdentifier = pass_type_id
+        pkpass.pass_object_safe.teamIdentifier = settings_test.team_identifier
+        api.sign(pkpass, settings=settings_test)
+        assert pkpass.is_signed
+        reloaded = api.new(file=api.pkpass(pkpass))
+        assert reloaded.pass_object_safe.teamIdentifier == settings_test.team_identifier
+
+
+@pytest.mark.parametrize(
+    "json_file", ["event_ticket.json", "semantic-fields-pass.json", "coupon.json"]
+)
+def test_new_pass_from_trusted_data(json_file):
+    with open(conftest.jsons / json_file, encoding="utf-8") as fh:
+        data = json.load(fh)
+    validated = api.new(data=data)
+
+    pkpass = api.new(data=data, trusted=True, settings=Settings())
+    # the pass object is not built for signing and exporting
+    assert pkpass.pass_object is None
+    # with the defaults and computed fields of the pass, without None values
+    assert json.loads(pkpass.files["pass.json"]).keys() == (
+        json.loads(validated._pass_json).keys()
+    )
+    reloaded = api.new(file=api.pkpass(pkpass))
+    assert reloaded.pass_object_safe == validated.pass_object_safe
+
+    # it is validated when used
+    assert pkpass.pass_object_safe == validated.pass_object_safe
+
+
+@pytest.mark.skipif(not conftest.key_files_exist(), reason="key files missing")
+def test_sign_trusted_pass(settings_test: Settings):
+    with open(conftest.jsons / "event_ticket.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["passTypeIdentifier"] = settings_test.get_available_passtype_ids()[0]
+
+    pkpass = api.new(data=data, trusted=True, settings=Settings())
+    api.sign(pkpass, settings=settings_test)
+    assert pkpass.is_signed
+    # signing takes the pass type identifier from the raw pass.json
+    assert pkpass.pass_object is None
+    assert pkpass._pass_json_pending
+
+
+def test_trusted_data_with_python_values():
+    with open(conftest.jsons / "event_ticket.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["userInfo"] = {"issued": datetime.date(2025, 5, 1)}
+    data["barcodes"] = [data.pop("barcode")]
+
+    pkpass = api.new(data=data, trusted=True, settings=Settings())
+    pass_json = json.loads(pkpass.files["pass.json"])
+    assert pass_json["userInfo"] == {"issued": "2025-05-01"}
+    assert pass_json["barcode"] == pass_json["barcodes"][0]
+    assert pkpass.pass_object_safe.userInfo == {"issued": "2025-05-01"}
+
+
+def test_validate_trusted_data():
+    with open(conftest.jsons / "ecca25-gala-broken.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+
+    pkpass = api.new(data=data, trusted=True, settings=Settings())
+    with pytest.raises(ValidationError):
+        pkpass.pass_object_safe
+
+    with pytest.raises(ValidationError):
+        api.new(data=data, trusted=True, settings=Settings(validate_trusted=True))
+
+
+def test_warmup(settings_test: Settings, tmp_path):
+    ids = api.warmup(settings_test)
+    if key_files_exist():
+        assert ids == settings_test.get_available_passtype_ids()
+    # without keys the cycle runs unsigned
+    assert api.warmup(Settings(cert_dir=tmp_path, fernet_key=None)) == []
+
+
+@pytest.mark.skipif(not key_files_exist(), reason="key files are missing")
+def test_signing_identity_is_cached(settings_test: Settings, tmp_path):
+    from edutap.wallet_apple import crypto
+
+    paths = []
+    for path in (
+        settings_test.private_key,
+        settings_test.get_certificate_path(
+            settings_test.get_available_passtype_ids()[0]
+        ),
+        settings_test.wwdr_certificate,
+    ):
+        paths.append(tmp_path / path.name)
+        paths[-1].write_bytes(path.read_bytes())
+
+    identity = crypto.load_signing_identity(*paths)
+    assert crypto.load_signing_identity(*paths) is identity
+    # a renewed certificate is loaded again
+    os.utime(paths[1], ns=(0, 0))
+    assert crypto.load_signing_identity(*paths) is not identity
+
+
+def test_content_digest(apple_passes_dir):
+    with open(apple_passes_dir / "BoardingPass.pkpass", "rb") as fh:
+        digest = api.new(file=fh, lazy=True).content_digest()
+    with open(apple_passes_dir / "BoardingPass.pkpass", "rb") as fh:
+        pkpass = api.new(file=fh)
+    assert len(digest) == 64
+    # independent of manifest and signature
+    pkpass.files["manifest.json"] = b"{}"
+    pkpass.files.pop("signature", None)
+    assert pkpass.content_digest() == api.new(file=api.pkpass(pkpass)).content_digest()
+    pkpass.pass_object_safe.description = "changed"
+    assert pkpass.content_digest() != digest
+
+
+def test_trigger_update_only_if_changed(entrypoints_testing, monkeypatch):
+    from edutap.wallet_apple import digests
+    from edutap.wallet_apple import ledger
+
+    import asyncio
+    import plugins
+
+    settings_test = SettingsTest()
+    unsigned = (settings_test.unsigned_passes_dir / "1234.pkpass").read_bytes()
+    content = {"data": unsigned}
+
+    async def get_pass_data(self, *, pass_type_id, serial_number, update=False):
+        return BytesIO(content["data"])
+
+    monkeypatch.setattr(plugins.TestPassDataAcquisition, "get_pass_data", get_pass_data)
+    update_ledger = ledger.MemoryLedger()
+    ledger.use_update_ledger(update_ledger)
+    digests.use_digest_store(digests.MemoryDigestStore())
+    try:
+
+        async def trigger():
+            await api.trigger_update(
+                "pass.demo", "1234", settings=settings_test, only_if_changed=True
+            )
+            return update_ledger.updated_since("device", "pass.demo", "0").lastUpdated
+
+        assert asyncio.run(trigger()) == "1"
+        # same content, no update
+        assert asyncio.run(trigger()) == "1"
+
+        changed = api.new(file=BytesIO(unsigned))
+        changed.pass_object_safe.description = "doors open"
+        content["data"] = api.pkpass(changed).read()
+        assert asyncio.run(trigger()) == "2"
+    finally:
+        ledger.use_update_ledger(None)
+        digests.use_digest_store(None)
+
+    with pytest.raises(ValueError):
+        asyncio.run(
+            api.trigger_update(
+                "pass.demo", "1234", settings=settings_test, only_if_changed=True
+            )
+        )
+
+
+def test_trigger_update_failed_push_is_retried(entrypoints_testing, monkeypatch):
+    from edutap.wallet_apple import digests
+    from edutap.wallet_apple.models.handlers import PushToken
+
+    import asyncio
+    import httpx
+    import plugins
+    import ssl
+
+    unsigned = (SettingsTest().unsigned_passes_dir / "1234.pkpass").read_bytes()
+
+    async def get_pass_data(self, *, pass_type_id, serial_number, update=False):
+        return BytesIO(unsigned)
+
+    async def get_push_tokens(self, device_type_id, pass_type_id, serial_number):
+        return [PushToken(pushToken="token")]
+
+    status = {"code": 500}
+    posted = []
+
+    async def post(self, url, **kwargs):
+        posted.append(url)
+        return httpx.Response(status["code"])
+
+    monkeypatch.setattr(plugins.TestPassDataAcquisition, "get_pass_data", get_pass_data)
+    monkeypatch.setattr(
+        plugins.TestPassDataAcquisition, "get_push_tokens", get_push_tokens
+    )
+    monkeypatch.setattr(httpx.AsyncClient, "post", post)
+    digest_store = digests.MemoryDigestStore()
+    digests.use_digest_store(digest_store)
+    try:
+
+        def trigger():
+            return asyncio.run(
+                api.trigger_update(
+                    "pass.demo",
+                    "1234",
+                    settings=SettingsTest(),
+                    ssl_context=ssl.create_default_context(),
+                    only_if_changed=True,
+                )
+            )
+
+        # the push failed, the same content is pushed again
+        assert trigger() == []
+        assert digest_store.get("pass.demo", "1234") is None
+        status["code"] = 200
+        assert len(trigger()) == 1
+        assert digest_store.get("pass.demo", "1234") is not None
+        assert len(posted) == 2
+        # pushed, unchanged from now on
+        assert trigger() == []
+        assert len(posted) == 2
+    finally:
+        digests.use_digest_store(None)
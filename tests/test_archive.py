@@ -0,0 +1,300 @@
+from conftest import create_shell_pass
+from edutap.wallet_apple import api
+from edutap.wallet_apple.archive import CompressionPolicy
+from edutap.wallet_apple.archive import IngestionLimits
+from edutap.wallet_apple.archive import PkPassStream
+from edutap.wallet_apple.archive import read_bounded
+from edutap.wallet_apple.archive import UntrustedArchiveError
+from edutap.wallet_apple.models.passes import PkPass
+from io import BytesIO
+from pydantic import ValidationError
+
+import asyncio
+import conftest
+import hashlib
+import json
+import pytest
+import struct
+import time
+import zipfile
+
+
+def read_zip(data: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_stream_is_valid_zip():
+    files = {
+        "pass.json": b'{"a": 1}',
+        "icon.png": (conftest.resources / "white_square.png").read_bytes(),
+        "de.lproj/pass.strings": '"x" = "Grüße";'.encode(),
+        "ünïcode.png": b"\x00" * 10,
+        "empty": b"",
+    }
+    stream = PkPassStream(files)
+    data = stream.getvalue()
+
+    assert len(stream) == len(data) == stream.content_length
+    assert read_zip(data) == files
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        assert zf.namelist() == list(files)
+
+
+def test_stream_chunks():
+    big = bytes(range(256)) * 1000
+    stream = PkPassStream({"big.bin": big, "small": b"x"}, chunk_size=1000)
+    chunks = list(stream)
+    assert max(len(chunk) for chunk in chunks) <= 1000
+    # the member data is not copied
+    assert any(isinstance(chunk, memoryview) for chunk in chunks)
+    assert read_zip(b"".join(chunks))["big.bin"] == big
+
+
+def test_stream_async():
+    stream = PkPassStream({"pass.json": b"{}"})
+
+    async def consume():
+        return b"".join([bytes(chunk) async for chunk in stream])
+
+    assert asyncio.run(consume()) == stream.getvalue()
+
+
+def test_pkpass_stream_matches_bytesio():
+    pkpass = create_shell_pass()
+    pkpass._add_file("icon.png", open(conftest.resources / "white_square.png", "rb"))
+
+    streamed = api.pkpass_stream(pkpass).getvalue()
+    built = api.pkpass(pkpass).getvalue()
+    assert read_zip(streamed) == read_zip(built)
+
+    reloaded = api.new(file=BytesIO(streamed))
+    assert reloaded.pass_object_safe.serialNumber == "1234567"
+
+
+def test_compression_policy():
+    policy = CompressionPolicy()
+    assert policy.compress_type("pass.json") == zipfile.ZIP_DEFLATED
+    assert policy.compress_type("de.lproj/pass.strings") == zipfile.ZIP_DEFLATED
+    assert policy.compress_type("signature") == zipfile.ZIP_DEFLATED
+    assert policy.compress_type("icon@2x.png") == zipfile.ZIP_STORED
+    assert policy.compress_type("strip.JPG") == zipfile.ZIP_STORED
+
+    stored = CompressionPolicy(method="stored")
+    assert stored.compress_type("pass.json") == zipfile.ZIP_STORED
+    deflated = CompressionPolicy(method="deflated")
+    assert deflated.compress_type("icon.png") == zipfile.ZIP_DEFLATED
+
+    with pytest.raises(ValidationError):
+        CompressionPolicy(level=10)
+
+
+def test_compression_policy_from_settings(settings_test):
+    settings_test.zip_compression = "stored"
+    settings_test.zip_compression_level = 9
+    policy = CompressionPolicy.from_settings(settings_test)
+    assert policy.method == "stored"
+    assert policy.level == 9
+
+
+@pytest.mark.parametrize("method", ["auto", "stored", "deflated"])
+@pytest.mark.parametrize("level", [1, 9])
+def test_compressed_archives(method, level):
+    with zipfile.ZipFile(conftest.data / "apple_passes" / "Event.pkpass") as zf:
+        files = {name: zf.read(name) for name in zf.namelist()}
+    policy = CompressionPolicy(method=method, level=level)
+
+    stream = PkPassStream(files, compression=policy)
+    streamed = stream.getvalue()
+    assert len(stream) == len(streamed)
+    assert read_zip(streamed) == files
+
+    pkpass = PkPass()
+    pkpass.files = dict(files)
+    built = pkpass.as_zip_bytesio(compression=policy).getvalue()
+    assert read_zip(built) == files
+
+    for data in (streamed, built):
+        with zipfile.ZipFile(BytesIO(data)) as zf:
+            for info in zf.infolist():
+                assert info.compress_type == policy.compress_type(info.filename)
+
+
+def test_compression_saves_bytes():
+    pkpass = create_shell_pass()
+    stored = api.pkpass_stream(pkpass, compression=CompressionPolicy(method="stored"))
+    auto = api.pkpass_stream(pkpass)
+    assert len(auto) < len(stored)
+
+
+def build_deterministic(data: dict, file_order: list[str]) -> PkPass:
+    pkpass = api.new(data=data)
+    pkpass.deterministic = True
+    for name in file_order:
+        with open(conftest.resources / "white_square.png", "rb") as fh:
+            pkpass._add_file(name, fh)
+    pkpass.files["manifest.json"] = pkpass._create_manifest().encode("utf-8")
+    return pkpass
+
+
+def test_deterministic_builds(monkeypatch):
+    with open(conftest.jsons / "storecard_with_nfc.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["userInfo"] = {"b": 1, "a": 2}
+    shuffled = json.loads(json.dumps(dict(reversed(list(data.items())))))
+    shuffled["userInfo"] = {"a": 2, "b": 1}
+
+    first = build_deterministic(data, ["icon.png", "logo.png"])
+    built1 = first.as_zip_bytesio().getvalue()
+    streamed1 = first.as_zip_stream().getvalue()
+
+    # an hour later, with different input order
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+    second = build_deterministic(shuffled, ["logo.png", "icon.png"])
+    built2 = second.as_zip_bytesio().getvalue()
+    streamed2 = second.as_zip_stream().getvalue()
+
+    assert built1 == built2 == streamed1 == streamed2
+
+    with zipfile.ZipFile(BytesIO(built1)) as zf:
+        assert zf.namelist() == sorted(zf.namelist())
+        for info in zf.infolist():
+            assert info.date_time == (1980, 1, 1, 0, 0, 0)
+        manifest = zf.read("manifest.json")
+        assert list(json.loads(manifest)) == sorted(json.loads(manifest))
+        pass_json = json.loads(zf.read("pass.json"))
+        assert list(pass_json) == sorted(pass_json)
+
+
+def test_deterministic_template_pass():
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    template = api.new_template(data, {"serial": "serialNumber"})
+
+    pkpass = template.pkpass(serial="1")
+    pkpass.deterministic = True
+    pkpass.files["manifest.json"] = pkpass._create_manifest().encode("utf-8")
+
+    expected = build_deterministic(dict(data, serialNumber="1"), [])
+    assert pkpass.files["pass.json"] == expected.files["pass.json"]
+    assert pkpass.as_zip_stream().getvalue() == expected.as_zip_stream().getvalue()
+
+
+def make_zip(files: dict[str, bytes]) -> BytesIO:
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+@pytest.mark.parametrize(
+    "filename",
+    ["BoardingPass", "Coupon", "Event", "Generic", "StoreCard"],
+)
+def test_read_bounded_apple_passes(apple_passes_dir, filename):
+    path = apple_passes_dir / f"{filename}.pkpass"
+    files, hashes = read_bounded(path)
+    with zipfile.ZipFile(path) as zf:
+        assert files == {name: zf.read(name) for name in zf.namelist()}
+    assert hashes == {
+        name: hashlib.sha1(data).hexdigest() for name, data in files.items()
+    }
+
+    pkpass = api.new(file=path, limits=IngestionLimits())
+    assert pkpass.pass_object_safe.serialNumber
+    assert pkpass.files == files
+
+
+def test_read_bounded_zip_bomb():
+    bomb = make_zip({"pass.json": b"{}", "icon.png": b"\0" * (50 * 1024 * 1024)})
+    # rejected from the declared sizes, before decompressing anything
+    with pytest.raises(UntrustedArchiveError, match="icon.png exceeds"):
+        read_bounded(bomb)
+    bomb.seek(0)
+    with pytest.raises(UntrustedArchiveError, match="compression ratio"):
+        read_bounded(bomb, IngestionLimits(max_member_size=100 * 1024 * 1024))
+    bomb.seek(0)
+    with pytest.raises(UntrustedArchiveError, match="bytes uncompressed"):
+        read_bounded(
+            bomb,
+            IngestionLimits(max_member_size=100 * 1024 * 1024, max_ratio=1e6),
+        )
+
+
+def corrupt_deflated(data: BytesIO, name: str) -> BytesIO:
+    """overwrites the start of the compressed data of a member"""
+    with zipfile.ZipFile(data) as zf:
+        info = zf.getinfo(name)
+    raw = bytearray(data.getvalue())
+    name_length, extra_length = struct.unpack_from("<HH", raw, info.header_offset + 26)
+    # a final block of the reserved type, invalid for zlib
+    raw[info.header_offset + 30 + name_length + extra_length] = 0xFF
+    return BytesIO(bytes(raw))
+
+
+def test_read_bounded_corrupt_data():
+    data = BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("pass.json", b"{}" * 100)
+    with pytest.raises(UntrustedArchiveError, match="cannot be decompressed"):
+        read_bounded(corrupt_deflated(data, "pass.json"))
+
+
+def test_read_bounded_crc_mismatch():
+    data = BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("pass.json", b'{"serialNumber": "1234"}')
+    raw = data.getvalue().replace(b"1234", b"4321")
+    with pytest.raises(UntrustedArchiveError, match="pass.json cannot be"):
+        read_bounded(BytesIO(raw))
+
+
+@pytest.mark.parametrize("payload", [b"", b"not a zip archive", b"PK\x05\x06" * 8])
+def test_read_bounded_no_zip(payload):
+    with pytest.raises(UntrustedArchiveError, match="not a zip archive"):
+        read_bounded(BytesIO(payload))
+
+
+def test_read_bounded_limits():
+    files = {f"{i}.png": b"x" for i in range(5)}
+    with pytest.raises(UntrustedArchiveError, match="5 files"):
+        read_bounded(make_zip(files), IngestionLimits(max_members=4))
+    assert read_bounded(make_zip(files), IngestionLimits(max_members=5))[0] == files
+
+    with pytest.raises(UntrustedArchiveError, match="exceeds 3 bytes"):
+        read_bounded(make_zip({"a": b"abcd"}), IngestionLimits(max_member_size=3))
+
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("pass.json", b"{}")
+        with pytest.warns(UserWarning):
+            zf.writestr("pass.json", b"{}")
+    with pytest.raises(UntrustedArchiveError, match="duplicate"):
+        read_bounded(buf)
+
+
+def test_read_bounded_manifest():
+    files = {"pass.json": b"{}", "icon.png": b"icon"}
+    manifest = {name: hashlib.sha1(data).hexdigest() for name, data in files.items()}
+    files["manifest.json"] = json.dumps(manifest).encode()
+    files["signature"] = b"sig"
+    assert read_bounded(make_zip(files))[0] == files
+
+    files["icon.png"] = b"changed"
+    with pytest.raises(UntrustedArchiveError, match="manifest"):
+        read_bounded(make_zip(files))
+    assert read_bounded(make_zip(files), IngestionLimits(check_manifest=False))
+
+
+def test_limits_from_settings():
+    from edutap.wallet_apple.settings import Settings
+
+    limits = IngestionLimits.from_settings(
+        Settings(ingest_max_members=3, ingest_max_ratio=5)
+    )
+    assert limits.max_members == 3
+    assert limits.max_ratio == 5
@@ -0,0 +1,58 @@
+from edutap.wallet_apple.campaign import PushPacing
+from edutap.wallet_apple.campaign import run_campaign
+from plugins import SettingsTest
+
+import asyncio
+import datetime
+import pytest
+import time
+
+
+def test_interval():
+    assert PushPacing().interval(1000) == 0.0
+    # 50 requests per second are 25 devices per second
+    assert PushPacing(target_fetch_qps=50).interval(1000) == 0.04
+    # the window stretches small campaigns
+    assert PushPacing(window=600, target_fetch_qps=50).interval(1000) == 0.6
+    assert PushPacing(window=10, target_fetch_qps=50).interval(1000) == 0.04
+    assert PushPacing(window=10).interval(0) == 0.0
+
+
+def test_pacing_from_settings(monkeypatch):
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PUSH_CAMPAIGN_WINDOW", "60")
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PUSH_TARGET_FETCH_QPS", "100")
+    pacing = PushPacing.from_settings(SettingsTest())
+    assert pacing == PushPacing(window=60, target_fetch_qps=100)
+
+
+@pytest.mark.parametrize("pacing", [None, PushPacing(window=0.1)])
+def test_run_campaign(pacing):
+    sent = []
+    reports = []
+
+    async def send(push):
+        sent.append((push, time.monotonic()))
+        return push != "rejected"
+
+    pushes = ["a", "b", "rejected", "d", "e"]
+    start = time.monotonic()
+    progress = asyncio.run(
+        run_campaign(
+            pushes,
+            send,
+            pacing,
+            on_progress=lambda p: reports.append((p.sent, p.estimated_completion)),
+        )
+    )
+
+    assert [push for push, _ in sent] == pushes
+    assert progress.done
+    assert (progress.total, progress.sent, progress.updated) == (5, 5, 4)
+    assert [count for count, _ in reports] == [1, 2, 3, 4, 5]
+    assert progress.estimated_completion >= progress.started
+    if pacing is not None:
+        assert progress.interval == pytest.approx(0.02)
+        # the last push is due after 4 intervals
+        assert sent[-1][1] - start >= 0.08
+        # after the first push, 4 more are due
+        assert reports[0][1] - progress.started >= datetime.timedelta(seconds=0.08)
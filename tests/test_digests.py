@@ -0,0 +1,27 @@
+from edutap.wallet_apple import digests
+
+import pytest
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_digest_store(kind, tmp_path):
+    if kind == "memory":
+        digest_store = digests.MemoryDigestStore()
+    else:
+        digest_store = digests.SQLiteDigestStore(tmp_path / "digests.sqlite3")
+    assert isinstance(digest_store, digests.DigestStore)
+    assert digest_store.get("pass.demo", "1234") is None
+    digest_store.put("pass.demo", "1234", "a" * 64)
+    digest_store.put("pass.demo", "1234", "b" * 64)
+    assert digest_store.get("pass.demo", "1234") == "b" * 64
+    assert digest_store.get("pass.demo", "5678") is None
+
+
+def test_get_digest_store(tmp_path):
+    from plugins import SettingsTest
+
+    assert digests.get_digest_store(SettingsTest()) is None
+    settings = SettingsTest(pass_digest_store_path=tmp_path / "digests.sqlite3")
+    digest_store = digests.get_digest_store(settings)
+    assert isinstance(digest_store, digests.SQLiteDigestStore)
+    assert digests.get_digest_store(settings) is digest_store
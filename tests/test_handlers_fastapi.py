@@ -163,6 +163,7 @@ def test_get_pass(
     response = fastapi_client.get(download_link)
 
     assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
 
     cd = response.headers.get("content-disposition")
     parser = HeaderParser()
@@ -201,6 +202,135 @@ def test_get_pass(
     print(pass2)
 
 
+@pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_get_pass_from_store(
+    entrypoints_testing, fastapi_client, settings_fastapi, monkeypatch, tmp_path
+):
+    from edutap.wallet_apple.store import get_pass_store
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_STORE_DIR", str(tmp_path))
+    download_link = api.save_link(
+        pass_type_id=settings_fastapi.pass_type_identifier,
+        serial_number=settings_fastapi.initial_pass_serialnumber,
+        schema="http",
+    )
+
+    response = fastapi_client.get(download_link)
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    store = get_pass_store()
+    assert store is not None
+    path = store.get_path(
+        settings_fastapi.pass_type_identifier,
+        settings_fastapi.initial_pass_serialnumber,
+    )
+    assert path is not None
+    assert path.read_bytes() == response.content
+
+    # served from the store, without signing it again
+    response2 = fastapi_client.get(download_link)
+    assert response2.status_code == 200
+    assert response2.content == response.content
+
+    # after invalidation the pass is rendered anew
+    store.invalidate(
+        settings_fastapi.pass_type_identifier,
+        settings_fastapi.initial_pass_serialnumber,
+    )
+    response3 = fastapi_client.get(download_link)
+    assert response3.status_code == 200
+    assert api.new(file=BytesIO(response3.content)).is_signed
+
+
+@pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_get_pass_evicted_from_store(
+    entrypoints_testing, fastapi_client, settings_fastapi, monkeypatch, tmp_path
+):
+    from edutap.wallet_apple.store import get_pass_store
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_STORE_DIR", str(tmp_path))
+    store = get_pass_store()
+    assert store is not None
+    download_link = api.save_link(
+        pass_type_id=settings_fastapi.pass_type_identifier,
+        serial_number=settings_fastapi.initial_pass_serialnumber,
+        schema="http",
+    )
+
+    # evicted by another worker right after it was stored
+    set_current = store.set_current
+
+    def set_current_and_evict(pass_type_id, serial_number, path, *args):
+        current = set_current(pass_type_id, serial_number, path, *args)
+        path.unlink()
+        return current
+
+    monkeypatch.setattr(store, "set_current", set_current_and_evict)
+    response = fastapi_client.get(download_link)
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert api.new(file=BytesIO(response.content)).is_signed
+
+    # evicted after it was found in the index
+    monkeypatch.undo()
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_STORE_DIR", str(tmp_path))
+    fastapi_client.get(download_link)
+    get_path = store.get_path
+
+    def get_path_and_evict(*args):
+        path = get_path(*args)
+        path.unlink()
+        return path
+
+    monkeypatch.setattr(store, "get_path", get_path_and_evict)
+    response = fastapi_client.get(download_link)
+    assert response.status_code == 200
+    assert api.new(file=BytesIO(response.content)).is_signed
+
+
+@pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_update_during_rendering_is_not_overwritten(
+    entrypoints_testing, fastapi_client, settings_fastapi, monkeypatch, tmp_path
+):
+    from edutap.wallet_apple.handlers import fastapi as handler_module
+    from edutap.wallet_apple.store import get_pass_store
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_STORE_DIR", str(tmp_path))
+    store = get_pass_store()
+    assert store is not None
+    ptid = settings_fastapi.pass_type_identifier
+    serial_number = settings_fastapi.initial_pass_serialnumber
+
+    get_pass_data = handler_module.get_pass_data
+    calls = []
+
+    async def get_pass_data_updated_meanwhile(*args, **kwargs):
+        pass_data = await get_pass_data(*args, **kwargs)
+        calls.append(args)
+        if len(calls) == 1:
+            # e.g. `api.trigger_update` in another worker
+            store.invalidate(ptid, serial_number)
+        return pass_data
+
+    monkeypatch.setattr(
+        handler_module, "get_pass_data", get_pass_data_updated_meanwhile
+    )
+    download_link = api.save_link(
+        pass_type_id=ptid, serial_number=serial_number, schema="http"
+    )
+    response = fastapi_client.get(download_link)
+    assert response.status_code == 200
+    # rendered again with the data after the update, which is kept
+    assert len(calls) == 2
+    path = store.get_path(ptid, serial_number)
+    assert path is not None
+    assert path.read_bytes() == response.content
+
+
 @pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
 @pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
 def test_get_updated_pass(
@@ -404,6 +534,92 @@ def test_list_updateable_passes(
     assert len(logs) == 2
 
 
+@pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_list_updateable_passes_cached(
+    entrypoints_testing, fastapi_client, settings_fastapi, monkeypatch
+):
+    from edutap.wallet_apple import ledger
+    from edutap.wallet_apple.update_cache import _updatable_passes_cache
+
+    import plugins
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_UPDATABLE_PASSES_CACHE_TTL", "60")
+    _updatable_passes_cache.cache_clear()
+    calls = []
+    original = plugins.TestPassDataAcquisition.get_update_serial_numbers
+
+    async def get_update_serial_numbers(self, *args):
+        calls.append(args)
+        return await original(self, *args)
+
+    monkeypatch.setattr(
+        plugins.TestPassDataAcquisition,
+        "get_update_serial_numbers",
+        get_update_serial_numbers,
+    )
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    pass_type_id = settings_fastapi.pass_type_identifier
+    url = f"/apple_update_service/v1/devices/{device_id}/registrations/{pass_type_id}?passesUpdatedSince=letztens"
+
+    for _ in range(3):
+        response = fastapi_client.get(url)
+        assert response.status_code == 200
+        assert response.json()["serialNumbers"] == ["1234"]
+    assert len(calls) == 1
+
+    # another tag is another answer
+    assert fastapi_client.get(url + "2").status_code == 200
+    assert len(calls) == 2
+
+    # unregistering changes the passes of the device
+    token = api.create_auth_token(pass_type_id, "1234").decode("utf-8")
+    response = fastapi_client.delete(
+        f"/apple_update_service/v1/devices/{device_id}/registrations/{pass_type_id}/1234",
+        headers={"authorization": f"ApplePass {token}"},
+    )
+    assert response.status_code == 200
+    assert fastapi_client.get(url).status_code == 200
+    assert fastapi_client.get(url + "2").status_code == 200
+    assert len(calls) == 4
+
+    # an update recorded by another worker outdates the cached answers
+    update_ledger = ledger.MemoryLedger()
+    ledger.use_update_ledger(update_ledger)
+    try:
+        assert fastapi_client.get(url).status_code == 200
+        assert fastapi_client.get(url).status_code == 200
+        assert len(calls) == 5
+        update_ledger.record_update(pass_type_id, "1234")
+        assert fastapi_client.get(url).status_code == 200
+        assert len(calls) == 6
+    finally:
+        ledger.use_update_ledger(None)
+    _updatable_passes_cache.cache_clear()
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_list_updateable_passes_no_content(
+    entrypoints_testing, fastapi_client, settings_fastapi, monkeypatch
+):
+    import plugins
+
+    async def get_update_serial_numbers(self, *args):
+        return handlers.SerialNumbers(serialNumbers=[], lastUpdated="letztens")
+
+    monkeypatch.setattr(
+        plugins.TestPassDataAcquisition,
+        "get_update_serial_numbers",
+        get_update_serial_numbers,
+    )
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    response = fastapi_client.get(
+        f"/apple_update_service/v1/devices/{device_id}/registrations/{settings_fastapi.pass_type_identifier}?passesUpdatedSince=letztens"
+    )
+    assert response.status_code == 204
+    assert response.content == b""
+
+
 @pytest.mark.skipif(not key_files_exist(), reason="key and cert files missing")
 @pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
 def test_logging(entrypoints_testing, fastapi_client, settings_fastapi, testlog):
@@ -455,3 +671,253 @@ def test_start_server(entrypoints_testing, settings_fastapi):
         # ssl_keyfile=settings_fastapi.cert_dir / "ssl" / "key.pem",
         # ssl_certfile=settings_fastapi.cert_dir / "ssl" / "cert.pem",
     )
+
+
+def test_lifespan_warms_up(monkeypatch):
+    from edutap.wallet_apple.handlers.fastapi import lifespan
+
+    warmed = []
+    monkeypatch.setattr(api, "warmup", warmed.append)
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router_download_pass)
+    assert warmed == []
+    with TestClient(app):
+        assert len(warmed) == 1
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_concurrent_deliveries_share_one_rendering(monkeypatch, settings_fastapi):
+    from edutap.wallet_apple.handlers import fastapi as handler_module
+
+    import asyncio
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_DATA_PASSTHROUGH", "true")
+    unsigned = (settings_fastapi.unsigned_passes_dir / "1234.pkpass").read_bytes()
+    calls = []
+
+    async def get_pass_data(pass_type_identifier, serial_number, update):
+        calls.append(serial_number)
+        await asyncio.sleep(0.01)
+        return BytesIO(unsigned)
+
+    monkeypatch.setattr(handler_module, "get_pass_data", get_pass_data)
+
+    async def deliver_all():
+        return await asyncio.gather(
+            *(
+                handler_module.deliver_pass(
+                    "pass.demo.lmu.de", "1234", update=True, filename="1234.pkpass"
+                )
+                for _ in range(10)
+            )
+        )
+
+    responses = asyncio.run(deliver_all())
+    assert calls == ["1234"]
+    assert [response.body for response in responses] == [unsigned] * 10
+    assert handler_module.render_flights.stats().waiters == {}
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_delivery_uses_the_settings_of_the_request(monkeypatch, settings_fastapi):
+    from edutap.wallet_apple.handlers import fastapi as handler_module
+
+    import asyncio
+
+    unsigned = (settings_fastapi.unsigned_passes_dir / "1234.pkpass").read_bytes()
+
+    async def get_pass_data(pass_type_identifier, serial_number, update):
+        return BytesIO(unsigned)
+
+    monkeypatch.setattr(handler_module, "get_pass_data", get_pass_data)
+    # e.g. overridden with `app.dependency_overrides[get_settings]`
+    settings = settings_fastapi.model_copy(update={"pass_data_passthrough": True})
+    response = asyncio.run(
+        handler_module.deliver_pass(
+            "pass.demo.lmu.de",
+            "1234",
+            update=False,
+            filename="1234.pkpass",
+            settings=settings,
+        )
+    )
+    assert response.body == unsigned
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_delivery_after_an_update_renders_again(monkeypatch, settings_fastapi):
+    from edutap.wallet_apple import ledger
+    from edutap.wallet_apple.handlers import fastapi as handler_module
+
+    import asyncio
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_PASS_DATA_PASSTHROUGH", "true")
+    unsigned = (settings_fastapi.unsigned_passes_dir / "1234.pkpass").read_bytes()
+    update_ledger = ledger.MemoryLedger()
+    calls = []
+
+    async def get_pass_data(pass_type_identifier, serial_number, update):
+        calls.append(update_ledger.latest_update(pass_type_identifier, serial_number))
+        await asyncio.sleep(0.01)
+        return BytesIO(unsigned)
+
+    monkeypatch.setattr(handler_module, "get_pass_data", get_pass_data)
+
+    def deliver():
+        return handler_module.deliver_pass(
+            "pass.demo.lmu.de", "1234", update=True, filename="1234.pkpass"
+        )
+
+    async def deliver_around_update():
+        before = asyncio.ensure_future(deliver())
+        while not calls:
+            await asyncio.sleep(0)
+        update_ledger.record_update("pass.demo.lmu.de", "1234")
+        # not served the rendering started before the update
+        return await asyncio.gather(before, deliver(), deliver())
+
+    ledger.use_update_ledger(update_ledger)
+    try:
+        responses = asyncio.run(deliver_around_update())
+    finally:
+        ledger.use_update_ledger(None)
+    assert calls == [0, 1]
+    assert len(responses) == 3
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_register_pass_batched(
+    entrypoints_testing, settings_fastapi, testlog, monkeypatch
+):
+    from edutap.wallet_apple.handlers import fastapi as handler_module
+    from edutap.wallet_apple.handlers.fastapi import lifespan
+    from edutap.wallet_apple.registrations import _registration_batcher
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_BATCH_SIZE", "100")
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_BATCH_DELAY", "60")
+    monkeypatch.setattr(api, "warmup", lambda settings: None)
+
+    async def is_registered(device_library_id, pass_type_id, serial_number):
+        return False
+
+    # the test plugins cannot look up registrations
+    monkeypatch.setattr(handler_module, "is_registered", is_registered)
+    _registration_batcher.cache_clear()
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router_apple_wallet)
+
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    token = api.create_auth_token(settings_fastapi.pass_type_identifier, "1234").decode(
+        "utf-8"
+    )
+    url = f"/apple_update_service/v1/devices/{device_id}/registrations/{settings_fastapi.pass_type_identifier}/1234"
+
+    def handler_calls():
+        return [
+            log
+            for log in testlog
+            if log["realm"] == "handlers" and log["event"] == "register_pass"
+        ]
+
+    with TestClient(app) as client:
+        for status_code in (201, 200):
+            response = client.post(
+                url,
+                json={"pushToken": "333333"},
+                headers={"authorization": f"ApplePass {token}"},
+            )
+            assert response.status_code == status_code
+        # answered before the plugins are called
+        assert handler_calls() == []
+
+    # written when the app stops, once to each of the two plugins
+    assert len(handler_calls()) == 2
+    _registration_batcher.cache_clear()
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_register_pass_filtered(fastapi_client, settings_fastapi, monkeypatch):
+    from edutap.wallet_apple.registration_filter import _registration_filter
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_FILTER_CAPACITY", "1000")
+    _registration_filter.cache_clear()
+
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    token = api.create_auth_token(settings_fastapi.pass_type_identifier, "1234").decode(
+        "utf-8"
+    )
+    url = f"/apple_update_service/v1/devices/{device_id}/registrations/{settings_fastapi.pass_type_identifier}/1234"
+
+    client = fastapi_client
+    # the test plugins cannot look up registrations, the filter decides
+    for status_code in (201, 200):
+        response = client.post(
+            url,
+            json={"pushToken": "333333"},
+            headers={"authorization": f"ApplePass {token}"},
+        )
+        assert response.status_code == status_code
+    response = client.delete(url, headers={"authorization": f"ApplePass {token}"})
+    assert response.status_code == 200
+    response = client.post(
+        url,
+        json={"pushToken": "333333"},
+        headers={"authorization": f"ApplePass {token}"},
+    )
+    assert response.status_code == 201
+    _registration_filter.cache_clear()
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_failing_clients_are_throttled(fastapi_client, settings_fastapi, monkeypatch):
+    from edutap.wallet_apple.throttling import _auth_guard
+    from edutap.wallet_apple.throttling import get_auth_guard
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_AUTH_FAILURE_BURST", "3")
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_FAILED_TOKEN_CACHE_TTL", "60")
+    _auth_guard.cache_clear()
+
+    client = fastapi_client
+    assert (
+        client.get("/apple_update_service/v1/download-pass/garbage").status_code == 401
+    )
+    # the same token again is rejected before it is decrypted
+    assert (
+        client.get("/apple_update_service/v1/download-pass/garbage").status_code == 401
+    )
+
+    # a token of another pass, the plugin is asked once
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    token = api.create_auth_token(settings_fastapi.pass_type_identifier, "1234").decode(
+        "utf-8"
+    )
+    url = f"/apple_update_service/v1/devices/{device_id}/registrations/{settings_fastapi.pass_type_identifier}/9999"
+    response = client.delete(url, headers={"authorization": f"ApplePass {token}"})
+    assert response.status_code == 401
+
+    # the address failed three times
+    response = client.get("/apple_update_service/v1/download-pass/other")
+    assert response.status_code == 429
+
+    stats = get_auth_guard().stats()
+    assert stats.failures == 2
+    assert stats.rejected_failed_token == 1
+    assert stats.rejected_throttled == 1
+    _auth_guard.cache_clear()
+
+
+@pytest.mark.skipif(not have_fastapi, reason="fastapi not installed")
+def test_malformed_authorization(fastapi_client, settings_fastapi, monkeypatch):
+    from edutap.wallet_apple.throttling import _auth_guard
+    from edutap.wallet_apple.throttling import get_auth_guard
+
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_AUTH_FAILURE_BURST", "3")
+    _auth_guard.cache_clear()
+
+    device_id = "a0ccefd5944f32bcae520d64c4dc7a16"
+    url = f"/apple_update_service/v1/devices/{device_id}/registrations/{settings_fastapi.pass_type_identifier}/1234"
+    # no token after the scheme
+    response = fastapi_client.delete(url, headers={"authorization": "ApplePass"})
+    assert response.status_code == 401
+    assert get_auth_guard().stats().failures == 1
+    _auth_guard.cache_clear()
@@ -0,0 +1,50 @@
+import importlib.util
+import pytest
+import subprocess
+import sys
+
+LAZY_MODULES = ["httpx", "cryptography", "structlog", "email_validator"]
+
+
+def imported_modules(module: str) -> dict[str, int]:
+    """the modules imported by a fresh interpreter and their cumulative µs"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["edutap.wallet_apple.api", "edutap.wallet_apple.models.passes"],
+)
+def test_slow_dependencies_are_imported_lazily(module):
+    modules = imported_modules(module)
+    assert module in modules
+    for lazy in LAZY_MODULES:
+        assert not any(
+            name == lazy or name.startswith(f"{lazy}.") for name in modules
+        ), f"{lazy} is imported by {module}"
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("fastapi") is None, reason="fastapi not installed"
+)
+def test_handlers_import_cryptography_lazily():
+    # fastapi imports email_validator itself
+    module = "edutap.wallet_apple.handlers.fastapi"
+    modules = imported_modules(module)
+    assert module in modules
+    for lazy in ["httpx", "cryptography", "structlog"]:
+        assert not any(
+            name == lazy or name.startswith(f"{lazy}.") for name in modules
+        ), f"{lazy} is imported by {module}"
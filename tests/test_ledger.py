@@ -0,0 +1,163 @@
+from edutap.wallet_apple import ledger
+from edutap.wallet_apple.models.handlers import PushToken
+
+import asyncio
+import pytest
+import threading
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def update_ledger(request, tmp_path):
+    if request.param == "memory":
+        yield ledger.MemoryLedger()
+    else:
+        sqlite_ledger = ledger.SQLiteLedger(tmp_path / "ledger.sqlite3")
+        yield sqlite_ledger
+        sqlite_ledger.close()
+
+
+def test_registrations(update_ledger):
+    assert update_ledger.register("device", "pass.demo", "1", "token-1")
+    assert not update_ledger.register("device", "pass.demo", "1", "token-2")
+    assert update_ledger.register("other", "pass.demo", "1", None)
+    assert update_ledger.push_tokens("pass.demo", "1") == [
+        PushToken(
+            pushToken="token-2",
+            deviceLibraryIdentifier="device",
+            passTypeIdentifier="pass.demo",
+        )
+    ]
+    assert update_ledger.unregister("device", "pass.demo", "1")
+    assert not update_ledger.unregister("device", "pass.demo", "1")
+    assert not update_ledger.is_registered("device", "pass.demo", "1")
+    assert update_ledger.is_registered("other", "pass.demo", "1")
+    assert update_ledger.registrations() == [("other", "pass.demo", "1")]
+    assert update_ledger.push_tokens("pass.demo", "1") == []
+
+
+def test_updated_since(update_ledger):
+    for serial_number in ("1", "2", "3"):
+        update_ledger.register("device", "pass.demo", serial_number)
+    update_ledger.register("device", "pass.other", "1")
+
+    # without a tag, all registered passes are updatable
+    result = update_ledger.updated_since("device", "pass.demo")
+    assert sorted(result.serialNumbers) == ["1", "2", "3"]
+    assert result.lastUpdated == "0"
+
+    assert update_ledger.record_update("pass.demo", "2") == 1
+    assert update_ledger.record_update("pass.other", "1") == 2
+    assert update_ledger.record_update("pass.demo", "4") == 3
+    assert update_ledger.record_update("pass.demo", "1") == 4
+    result = update_ledger.updated_since("device", "pass.demo", "0")
+    assert result.serialNumbers == ["2", "1"]
+    assert result.lastUpdated == "4"
+
+    # a pass updated again is listed once, at its last update
+    update_ledger.record_update("pass.demo", "2")
+    assert update_ledger.updated_since("device", "pass.demo", "4").serialNumbers == [
+        "2"
+    ]
+    assert update_ledger.updated_since("device", "pass.demo", "5").serialNumbers == []
+    assert update_ledger.updated_since("other", "pass.demo", "0").serialNumbers == []
+
+    # foreign tags are no tags
+    result = update_ledger.updated_since("device", "pass.demo", "2021-09-01")
+    assert sorted(result.serialNumbers) == ["1", "2", "3"]
+
+
+def test_sqlite_ledger_is_shared(tmp_path):
+    first = ledger.SQLiteLedger(tmp_path / "ledger.sqlite3")
+    second = ledger.SQLiteLedger(tmp_path / "ledger.sqlite3")
+    first.register("device", "pass.demo", "1")
+    assert first.record_update("pass.demo", "1") == 1
+    assert second.record_update("pass.demo", "1") == 2
+    assert second.updated_since("device", "pass.demo", "1").serialNumbers == ["1"]
+    first.close()
+    second.close()
+
+
+def test_plugin_adapters():
+    memory_ledger = ledger.MemoryLedger()
+    ledger.use_update_ledger(memory_ledger)
+    try:
+        registration = ledger.LedgerPassRegistration()
+        updates = ledger.LedgerUpdates()
+
+        async def run():
+            await registration.register_pass(
+                device_library_id="device",
+                pass_type_id="pass.demo",
+                serial_number="1",
+                push_token=PushToken(pushToken="token"),
+            )
+            tokens = await updates.get_push_tokens(None, "pass.demo", "1")
+            assert [token.pushToken for token in tokens] == ["token"]
+            memory_ledger.record_update("pass.demo", "1")
+            serial_numbers = await updates.get_update_serial_numbers(
+                "device", "pass.demo", "0"
+            )
+            assert serial_numbers.serialNumbers == ["1"]
+            await registration.unregister_pass("device", "pass.demo", "1")
+            assert await updates.get_push_tokens(None, "pass.demo", "1") == []
+
+        asyncio.run(run())
+    finally:
+        ledger.use_update_ledger(None)
+
+    with pytest.raises(LookupError):
+        asyncio.run(ledger.LedgerUpdates().get_push_tokens(None, "pass.demo", "1"))
+
+
+def test_plugin_adapters_do_not_block_the_event_loop():
+    threads = []
+
+    class RecordingLedger(ledger.MemoryLedger):
+        def is_registered(self, *args) -> bool:
+            threads.append(threading.get_ident())
+            return super().is_registered(*args)
+
+    ledger.use_update_ledger(RecordingLedger())
+    try:
+        registration = ledger.LedgerPassRegistration()
+        assert not asyncio.run(registration.is_registered("device", "pass.demo", "1"))
+    finally:
+        ledger.use_update_ledger(None)
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_ledgers_implement_the_protocol(update_ledger):
+    assert isinstance(update_ledger, ledger.UpdateLedger)
+
+
+def test_updated_since_does_not_lock(tmp_path):
+    import sqlite3
+
+    update_ledger = ledger.SQLiteLedger(tmp_path / "ledger.sqlite3")
+    update_ledger.register("device", "pass.demo", "1")
+    update_ledger.record_update("pass.demo", "1")
+    # fail at once instead of waiting for the write lock
+    update_ledger._db.execute("PRAGMA busy_timeout = 0")
+    writer = sqlite3.connect(tmp_path / "ledger.sqlite3", isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        serial_numbers = update_ledger.updated_since("device", "pass.demo", "0")
+        assert serial_numbers.serialNumbers == ["1"]
+        assert serial_numbers.lastUpdated == "1"
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+        update_ledger.close()
+
+
+def test_latest_update(update_ledger):
+    assert update_ledger.latest_update("pass.demo") == 0
+    update_ledger.record_update("pass.demo", "1")
+    update_ledger.record_update("pass.other", "1")
+    update_ledger.record_update("pass.demo", "2")
+    update_ledger.record_update("pass.demo", "1")
+    assert update_ledger.latest_update("pass.demo") == 4
+    assert update_ledger.latest_update("pass.other") == 2
+    assert update_ledger.latest_update("pass.demo", "1") == 4
+    assert update_ledger.latest_update("pass.demo", "2") == 3
+    assert update_ledger.latest_update("pass.demo", "3") == 0
@@ -0,0 +1,56 @@
+from edutap.wallet_apple import lenient_json
+from edutap.wallet_apple.models.passes import Pass
+
+import conftest
+import json
+import pytest
+import zipfile
+
+
+@pytest.mark.parametrize(
+    "json_file", sorted(path.name for path in conftest.jsons.glob("*.json"))
+)
+def test_strict_json_corpus(json_file):
+    data = (conftest.jsons / json_file).read_bytes()
+    assert lenient_json.loads(data) == json.loads(data)
+    assert lenient_json.loads(data.decode("utf-8")) == json.loads(data)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": 1,}', {"a": 1}),
+        ('{"a": [1, 2, ], }', {"a": [1, 2]}),
+        ('{"a": [1, 2,\n  ]\n,\n}', {"a": [1, 2]}),
+        ("\ufeff{}", {}),
+        (b'\xef\xbb\xbf{"a": 1,}', {"a": 1}),
+        ('{"a": 1, // comment\n "b": 2 /* block\n comment */}', {"a": 1, "b": 2}),
+        ('{"a": 1, /* trailing comma before a comment */ }', {"a": 1}),
+        ('{"a": 1, // trailing comma before a line comment\n}', {"a": 1}),
+        ('{"a": "tab\there",}', {"a": "tab\there"}),
+        # quirks inside of strings are kept
+        ('{"a": "x,}", "b": "// no comment",}', {"a": "x,}", "b": "// no comment"}),
+        (
+            '{"a": "/* no */", "b": "esc\\"aped,]",}',
+            {"a": "/* no */", "b": 'esc"aped,]'},
+        ),
+    ],
+)
+def test_quirks(text, expected):
+    assert lenient_json.loads(text) == expected
+
+
+@pytest.mark.parametrize("text", ['{"a": 1,,}', "{'a': 1}", '{"a": }', "[1, 2"])
+def test_invalid(text):
+    with pytest.raises(json.JSONDecodeError):
+        lenient_json.loads(text)
+
+
+def test_apple_pass_with_trailing_commas(apple_passes_dir):
+    with zipfile.ZipFile(apple_passes_dir / "BoardingPass.pkpass") as zf:
+        pass_json = zf.read("pass.json")
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(pass_json)
+
+    pass_object = Pass.from_json(pass_json)
+    assert pass_object.serialNumber == lenient_json.loads(pass_json)["serialNumber"]
@@ -1,9 +1,12 @@
 from conftest import create_shell_pass
 from edutap.wallet_apple.models import passes
 from edutap.wallet_apple.models.passes import BarcodeFormat
+from pydantic import ValidationError
 
 import conftest as conftest
+import hashlib
 import json
+import pytest
 
 
 def test_model():
@@ -87,6 +90,15 @@ def test_load_coupon():
     assert json_
 
 
+def test_pass_styles_are_declared():
+    fields = passes.Pass.model_fields
+    for name, klass in passes.pass_model_registry.items():
+        assert fields[name].annotation == klass | None
+        assert fields[name].default is None
+    # the styles are the last fields, in the order of the registry
+    assert list(fields)[-5:] == list(passes.pass_model_registry)
+
+
 def test_basic_pass():
     pkpass = create_shell_pass()
     passobject = pkpass.pass_object
@@ -202,3 +214,79 @@ def test_files():
     manifest_json = passfile._create_manifest()
     manifest = json.loads(manifest_json)
     assert "170eed23019542b0a2890a0bf753effea0db181a" == manifest["logo.png"]
+
+
+def test_pass_json_is_serialised_once(monkeypatch):
+    passfile = create_shell_pass()
+    passfile._add_file("icon.png", open(conftest.resources / "white_square.png", "rb"))
+    calls = []
+    render = passes.PkPass._render_pass_json
+
+    def counting_render(self):
+        calls.append(self)
+        return render(self)
+
+    monkeypatch.setattr(passes.PkPass, "_render_pass_json", counting_render)
+
+    manifest = json.loads(passfile._create_manifest())
+    passfile._create_manifest()
+    passfile.as_zip_bytesio()
+    passfile.as_zip_stream()
+    assert len(calls) == 1
+    assert (
+        manifest["pass.json"] == hashlib.sha1(passfile.files["pass.json"]).hexdigest()
+    )
+
+    # assigning a field, however deep, invalidates the cached pass.json
+    pass_information = passfile.pass_object.pass_information
+    passfile._create_manifest()
+    assert len(calls) == 1
+    pass_information.primaryFields[0].value = "changed"
+    passfile._create_manifest()
+    assert len(calls) == 2
+    pass_json = json.loads(passfile.files["pass.json"])
+    assert pass_json["storeCard"]["primaryFields"][0]["value"] == "changed"
+
+    # the add methods change lists in place, they invalidate too
+    pass_information.addBackField("b", "back", "Back")
+    passfile._create_manifest()
+    assert len(calls) == 3
+    assert b'"back"' in passfile.files["pass.json"]
+
+    # changes of other passes do not
+    other = create_shell_pass()
+    other_information = other.pass_object.pass_information
+    other._create_manifest()
+    other_information.primaryFields[0].value = "other"
+    other_information.addBackField("o", "other", "Other")
+    passfile._create_manifest()
+    assert len(calls) == 4
+
+    # reading the pass object keeps the cache
+    assert passfile.pass_object.serialNumber == passfile.pass_object_safe.serialNumber
+    passfile._create_manifest()
+    assert len(calls) == 4
+
+    # in place changes of lists need an explicit invalidation
+    passfile.pass_object.pass_information.backFields.clear()
+    passfile._create_manifest()
+    assert b'"back"' in passfile.files["pass.json"]
+    passfile.invalidate_pass_json()
+    passfile._create_manifest()
+    assert len(calls) == 5
+    assert b'"back"' not in passfile.files["pass.json"]
+
+    # a replaced pass object is serialised anew
+    passfile.pass_object = create_shell_pass().pass_object
+    passfile._create_manifest()
+    assert b'"back"' not in passfile.files["pass.json"]
+
+
+def test_contact_venue_email():
+    data = json.loads(open(conftest.jsons / "event_ticket.json").read())
+    data["contactVenueEmail"] = "Info@Example.com"
+    assert passes.Pass.model_validate(data).contactVenueEmail == "info@example.com"
+
+    data["contactVenueEmail"] = "no email"
+    with pytest.raises(ValidationError):
+        passes.Pass.model_validate(data)
@@ -0,0 +1,141 @@
+from edutap.wallet_apple import ledger
+from edutap.wallet_apple import registration_filter
+from edutap.wallet_apple.registration_filter import RegistrationFilter
+from edutap.wallet_apple.settings import Settings
+
+import asyncio
+import pytest
+
+
+def keys(count, device="device"):
+    return [(f"{device}-{i}", "pass.demo", str(i)) for i in range(count)]
+
+
+def test_add_and_discard():
+    bloom = RegistrationFilter(1000, 0.01)
+    assert bloom.hashes == 7
+    key = ("device", "pass.demo", "1")
+    assert key not in bloom
+    bloom.add(key)
+    assert key in bloom
+    assert len(bloom) == 1
+    bloom.discard(key)
+    assert key not in bloom
+    assert len(bloom) == 0
+    # unknown registrations do not remove others
+    bloom.fill(keys(10))
+    bloom.discard(("unknown", "pass.demo", "1"))
+    assert all(key in bloom for key in keys(10))
+
+    with pytest.raises(ValueError):
+        RegistrationFilter(1000, 1.5)
+
+
+def test_false_positive_rate():
+    bloom = RegistrationFilter(10000, 0.01)
+    bloom.fill(keys(10000))
+    assert all(key in bloom for key in keys(10000))
+    false_positives = sum(key in bloom for key in keys(10000, device="other"))
+    assert false_positives / 10000 < 0.02
+    assert bloom.stats().estimated_false_positive_rate == pytest.approx(0.01, rel=0.3)
+
+
+@pytest.fixture
+def memory_ledger(monkeypatch):
+    memory_ledger = ledger.MemoryLedger()
+    ledger.use_update_ledger(memory_ledger)
+    plugins = [ledger.LedgerPassRegistration()]
+    monkeypatch.setattr(registration_filter, "get_pass_registrations", lambda: plugins)
+    yield memory_ledger
+    ledger.use_update_ledger(None)
+
+
+def test_is_new_looks_up_maybe_known(memory_ledger):
+    bloom = RegistrationFilter(100, 0.01, exclusive=True)
+    key = ("device", "pass.demo", "1")
+
+    async def run():
+        assert await bloom.is_new(*key)
+        memory_ledger.register(*key)
+        bloom.add(key)
+        assert not await bloom.is_new(*key)
+        # known to the filter only, e.g. a false positive
+        bloom.add(("device", "pass.demo", "2"))
+        assert await bloom.is_new("device", "pass.demo", "2")
+
+    asyncio.run(run())
+    stats = bloom.stats()
+    assert (stats.definitely_new, stats.lookups, stats.false_positives) == (1, 2, 1)
+
+
+def test_is_new_with_several_workers(memory_ledger):
+    worker_a = RegistrationFilter(100, 0.01)
+    worker_b = RegistrationFilter(100, 0.01)
+    key = ("device", "pass.demo", "1")
+
+    async def run():
+        assert await worker_a.is_new(*key)
+        memory_ledger.register(*key)
+        worker_a.add(key)
+        # not in the filter of worker B, but registered meanwhile
+        assert key not in worker_b
+        assert not await worker_b.is_new(*key)
+        assert await worker_b.is_new("device", "pass.demo", "2")
+
+    asyncio.run(run())
+    stats = worker_b.stats()
+    assert (stats.definitely_new, stats.lookups, stats.false_positives) == (0, 2, 0)
+
+
+def test_rebuild_from_plugins(memory_ledger):
+    for key in keys(50):
+        memory_ledger.register(*key)
+    bloom = RegistrationFilter(100, 0.01)
+    bloom.add(("stale", "pass.demo", "1"))
+
+    assert asyncio.run(bloom.rebuild()) == 50
+    assert all(key in bloom for key in keys(50))
+    assert ("stale", "pass.demo", "1") not in bloom
+
+
+def test_is_new_with_rebuilt_filters(memory_ledger):
+    worker_a = RegistrationFilter(100, 0.01, rebuild_interval=0.01)
+    worker_b = RegistrationFilter(100, 0.01, rebuild_interval=0.01)
+    key = ("device", "pass.demo", "1")
+
+    async def run():
+        rebuilds = asyncio.create_task(worker_b.rebuild_periodically())
+        assert await worker_a.is_new(*key)
+        memory_ledger.register(*key)
+        worker_a.add(key)
+        # worker B learns the registration of worker A with its next rebuild
+        await asyncio.sleep(0.05)
+        rebuilds.cancel()
+        assert key in worker_b
+        assert not await worker_b.is_new(*key)
+        assert await worker_b.is_new("device", "pass.demo", "2")
+
+    asyncio.run(run())
+    stats = worker_b.stats()
+    assert (stats.definitely_new, stats.lookups, stats.false_positives) == (1, 1, 0)
+
+
+def test_rebuild_without_lookups(monkeypatch):
+    monkeypatch.setattr(registration_filter, "get_pass_registrations", lambda: [])
+    bloom = RegistrationFilter(100, 0.01)
+    bloom.add(("device", "pass.demo", "1"))
+    assert asyncio.run(bloom.rebuild()) == 1
+    assert ("device", "pass.demo", "1") in bloom
+
+
+def test_filter_settings(monkeypatch):
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_FILTER_CAPACITY", "1000")
+    bloom = registration_filter.get_registration_filter(Settings())
+    assert bloom is not None and bloom.rebuild_interval == 300
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_FILTER_EXCLUSIVE", "true")
+    bloom = registration_filter.get_registration_filter(Settings())
+    assert bloom is not None and bloom.rebuild_interval == 0
+    # neither exclusive nor rebuilt, every registration would be looked up
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_FILTER_EXCLUSIVE", "false")
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_REGISTRATION_FILTER_REBUILD_INTERVAL", "0")
+    assert registration_filter.get_registration_filter(Settings()) is None
@@ -0,0 +1,222 @@
+from edutap.wallet_apple import registrations
+from edutap.wallet_apple.models.handlers import PushToken
+from edutap.wallet_apple.registrations import RegistrationBatcher
+from edutap.wallet_apple.registrations import RegistrationJournal
+
+import asyncio
+import pytest
+
+
+class SinglePlugin:
+    def __init__(self):
+        self.calls = []
+
+    async def register_pass(self, device_id, pass_type_id, serial_number, push_token):
+        self.calls.append(serial_number)
+
+    async def unregister_pass(self, device_id, pass_type_id, serial_number):
+        pass
+
+
+class BatchPlugin(SinglePlugin):
+    def __init__(self, failures=0):
+        super().__init__()
+        self.batches = []
+        self.failures = failures
+
+    async def register_passes(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database is down")
+        self.batches.append([registration.serialNumber for registration in batch])
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    plugins = [BatchPlugin(), SinglePlugin()]
+    monkeypatch.setattr(registrations, "get_pass_registrations", lambda: plugins)
+    return plugins
+
+
+def test_batches_by_size(plugins):
+    batcher = RegistrationBatcher(max_batch_size=3, max_delay=60)
+    batch_plugin, single_plugin = plugins
+
+    async def run():
+        for number in range(7):
+            await batcher.register("device", "pass.demo", str(number))
+        # the full batches are written without waiting for the delay
+        await asyncio.sleep(0.01)
+        assert batch_plugin.batches[:2] == [["0", "1", "2"], ["3", "4", "5"]]
+        await batcher.flush()
+
+    asyncio.run(run())
+    assert batch_plugin.batches == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert single_plugin.calls == [str(number) for number in range(7)]
+    stats = batcher.stats()
+    assert (stats.pending, stats.written, stats.batches) == (0, 7, 3)
+
+
+def test_batches_by_time(plugins):
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=0.01)
+
+    async def run():
+        await batcher.register("device", "pass.demo", "1", PushToken(pushToken="token"))
+        await batcher.register("device", "pass.demo", "2")
+        assert plugins[0].batches == []
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert plugins[0].batches == [["1", "2"]]
+
+
+def test_failed_batches_are_written_again(monkeypatch):
+    plugins = [BatchPlugin(failures=2)]
+    monkeypatch.setattr(registrations, "get_pass_registrations", lambda: plugins)
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=0.01, retry_delay=0.01)
+
+    async def run():
+        await batcher.register("device", "pass.demo", "1")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert plugins[0].batches == [["1"]]
+    assert batcher.stats().failures == 2
+    assert batcher.stats().pending == 0
+
+
+def test_full_batches_are_written_again(monkeypatch):
+    # the batch and both of its halves fail
+    plugins = [BatchPlugin(failures=3)]
+    monkeypatch.setattr(registrations, "get_pass_registrations", lambda: plugins)
+    batcher = RegistrationBatcher(max_batch_size=2, max_delay=60, retry_delay=0.01)
+
+    async def run():
+        await batcher.register("device", "pass.demo", "1")
+        await batcher.register("device", "pass.demo", "2")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    # the failed full batch was retried without waiting for the delay
+    assert plugins[0].batches == [["1", "2"]]
+    assert batcher.stats().pending == 0
+
+
+class PickyPlugin(BatchPlugin):
+    async def register_passes(self, batch):
+        if any(registration.serialNumber == "bad" for registration in batch):
+            raise ValueError("invalid serial number")
+        await super().register_passes(batch)
+
+
+def test_failing_registrations_are_given_up(monkeypatch):
+    plugins = [PickyPlugin()]
+    monkeypatch.setattr(registrations, "get_pass_registrations", lambda: plugins)
+    batcher = RegistrationBatcher(max_batch_size=4, max_delay=60, max_attempts=2)
+
+    async def run():
+        for serial_number in ("1", "bad", "2", "3"):
+            await batcher.register("device", "pass.demo", serial_number)
+        with pytest.raises(ValueError):
+            await batcher.flush()
+        # the others are written, the failing one is queued behind later ones
+        assert sum(plugins[0].batches, []) == ["1", "2", "3"]
+        await batcher.register("device", "pass.demo", "4")
+        with pytest.raises(ValueError):
+            await batcher.flush()
+        await batcher.flush()
+
+    asyncio.run(run())
+    assert sum(plugins[0].batches, []) == ["1", "2", "3", "4"]
+    assert [registration.serialNumber for registration in batcher.dead_letters] == [
+        "bad"
+    ]
+    stats = batcher.stats()
+    assert (stats.pending, stats.written, stats.dead_letters) == (0, 4, 1)
+
+
+def test_backpressure(monkeypatch):
+    plugins = [BatchPlugin()]
+    monkeypatch.setattr(registrations, "get_pass_registrations", lambda: plugins)
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=60, max_pending=2)
+
+    async def run():
+        await batcher.register("device", "pass.demo", "1")
+        await batcher.register("device", "pass.demo", "2")
+        # full, written before the device is answered
+        await batcher.register("device", "pass.demo", "3")
+        assert plugins[0].batches == [["3"]]
+        plugins[0].failures = 1
+        with pytest.raises(ConnectionError):
+            await batcher.register("device", "pass.demo", "4")
+        await batcher.flush()
+
+    asyncio.run(run())
+    assert plugins[0].batches == [["3"], ["1", "2"]]
+
+
+def test_pending_registrations(plugins):
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=60)
+
+    async def run():
+        await batcher.register("device", "pass.demo", "1")
+        await batcher.register("device", "pass.demo", "1", PushToken(pushToken="new"))
+        await batcher.register("other", "pass.demo", "1")
+        assert batcher.is_pending("device", "pass.demo", "1")
+        assert batcher.stats().pending == 2
+        plugins[0].failures = 1
+        # dropped without writing, a failing plugin does not fail it
+        await batcher.forget("device", "pass.demo", "1")
+        assert not batcher.is_pending("device", "pass.demo", "1")
+        assert plugins[0].batches == []
+        await batcher.flush()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert batcher.is_pending("other", "pass.demo", "1")
+    assert plugins[0].batches == []
+
+
+def test_is_registered(plugins, monkeypatch):
+    class LookupPlugin(SinglePlugin):
+        async def is_registered(self, device_id, pass_type_id, serial_number):
+            return serial_number == "1"
+
+        async def registrations(self):
+            yield ("device", "pass.demo", "1")
+
+    # nobody to ask
+    assert asyncio.run(registrations.is_registered("device", "pass.demo", "1")) is None
+    plugins.append(LookupPlugin())
+    assert asyncio.run(registrations.is_registered("device", "pass.demo", "1"))
+    assert not asyncio.run(registrations.is_registered("device", "pass.demo", "2"))
+
+
+def test_journal_recovery(plugins, tmp_path):
+    path = tmp_path / "journal.sqlite"
+    journal = RegistrationJournal(path)
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=60, journal=journal)
+
+    async def crash():
+        await batcher.register("device", "pass.demo", "1", PushToken(pushToken="a"))
+        await batcher.register("device", "pass.demo", "2")
+        await batcher.register("device", "pass.demo", "1", PushToken(pushToken="b"))
+        await batcher.register("device", "pass.demo", "3")
+        await batcher.forget("device", "pass.demo", "3")
+
+    # the worker is killed before the batch is written
+    asyncio.run(crash())
+    journal.close()
+    assert plugins[0].batches == []
+
+    journal = RegistrationJournal(path)
+    batcher = RegistrationBatcher(max_batch_size=100, max_delay=60, journal=journal)
+
+    async def restart():
+        assert await batcher.recover() == 2
+        await batcher.flush()
+
+    asyncio.run(restart())
+    assert plugins[0].batches == [["2", "1"]]
+    assert journal.pending() == []
+    journal.close()
@@ -0,0 +1,173 @@
+from edutap.wallet_apple import api
+from edutap.wallet_apple import scheduler
+from edutap.wallet_apple.scheduler import ManualClock
+from edutap.wallet_apple.scheduler import ScheduledUpdate
+from edutap.wallet_apple.scheduler import UpdateScheduler
+
+import asyncio
+import datetime
+import json
+import pytest
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def job_store(request, tmp_path):
+    if request.param == "memory":
+        yield scheduler.MemoryJobStore()
+    else:
+        store = scheduler.SQLiteJobStore(tmp_path / "jobs.sqlite3")
+        yield store
+        store.close()
+
+
+def test_parse_date():
+    assert scheduler.parse_date("1970-01-01T00:01Z") == 60
+    assert scheduler.parse_date("1970-01-01T01:01+01:00") == 60
+    assert scheduler.parse_date("1970-01-01T00:01:00") == 60
+    assert scheduler.parse_date("") is None
+    assert scheduler.parse_date("tomorrow") is None
+
+
+def test_pass_dates(passes_json_dir):
+    data = json.loads((passes_json_dir / "event_ticket.json").read_text())
+    data["expirationDate"] = "2030-01-01T00:00Z"
+    data["relevantDates"] = [{"startDate": "2029-12-31T20:00Z"}]
+    data["semantics"] = {"eventStartDate": "2029-12-31T21:00Z"}
+    pass_object = api.new(data=data).pass_object
+    assert scheduler.pass_dates(pass_object) == [
+        ("relevantDates", 1893441600),
+        ("relevantDate", 1323378000),
+        ("expirationDate", 1893456000),
+        ("eventStartDate", 1893445200),
+    ]
+
+    # only future dates are scheduled
+    updates = UpdateScheduler(scheduler.MemoryJobStore(), clock=ManualClock(1800000000))
+    jobs = updates.schedule_pass(pass_object)
+    assert [job.reason for job in jobs] == [
+        "relevantDates",
+        "expirationDate",
+        "eventStartDate",
+    ]
+    assert updates.store.next_due() == 1893441600
+
+
+def test_job_store(job_store):
+    job_store.add(
+        [
+            ScheduledUpdate(20, "pass.demo", "2", "expirationDate"),
+            ScheduledUpdate(10, "pass.demo", "1", "expirationDate"),
+            ScheduledUpdate(10, "pass.demo", "1", "expirationDate"),
+            ScheduledUpdate(30, "pass.demo", "3"),
+            ScheduledUpdate(40, "pass.demo", "3"),
+        ]
+    )
+    assert len(job_store) == 4
+    assert job_store.next_due() == 10
+    assert job_store.remove("pass.demo", "3") == 2
+    assert job_store.pop_batch(5) == []
+    assert job_store.pop_batch(20) == [
+        ScheduledUpdate(10, "pass.demo", "1", "expirationDate"),
+    ]
+    assert job_store.pop_batch(15) == []
+    assert job_store.pop_batch(20) == [
+        ScheduledUpdate(20, "pass.demo", "2", "expirationDate"),
+    ]
+    assert job_store.next_due() is None
+
+
+def test_run_due_in_batches(job_store):
+    batches = []
+
+    async def trigger(jobs):
+        batches.append(jobs)
+
+    clock = ManualClock(100)
+    updates = UpdateScheduler(job_store, clock=clock, trigger=trigger)
+    updates.schedule("pass.demo", "1", 110, "doors open")
+    updates.schedule("pass.demo", "2", 110.5, "doors open")
+    updates.schedule("pass.demo", "3", 111)
+    updates.schedule(
+        "pass.demo",
+        "4",
+        datetime.datetime(1970, 1, 1, 0, 2, tzinfo=datetime.timezone.utc),
+    )
+
+    assert asyncio.run(updates.run_due()) == 0
+    clock.advance(11)
+    assert asyncio.run(updates.run_due()) == 3
+    assert [[job.serial_number for job in batch] for batch in batches] == [
+        ["1", "2"],
+        ["3"],
+    ]
+    assert updates.unschedule("pass.demo", "4") == 1
+
+
+def test_run(job_store):
+    triggered = []
+    clock = ManualClock(0)
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def trigger(jobs):
+            triggered.extend((clock.now(), job.serial_number) for job in jobs)
+            if len(triggered) == 2:
+                stop.set()
+
+        updates = UpdateScheduler(
+            job_store, clock=clock, trigger=trigger, poll_interval=30
+        )
+        updates.schedule("pass.demo", "1", 100)
+        updates.schedule("pass.demo", "2", 250)
+        await asyncio.wait_for(updates.run(stop), timeout=5)
+
+    asyncio.run(run())
+    assert triggered == [(100, "1"), (250, "2")]
+
+
+def test_failed_batch_is_put_back(job_store):
+    batches = []
+
+    async def trigger(jobs):
+        batches.append([job.serial_number for job in jobs])
+        if jobs[0].serial_number == "1":
+            raise RuntimeError("APNs unavailable")
+
+    clock = ManualClock(100)
+    updates = UpdateScheduler(job_store, clock=clock, trigger=trigger)
+    updates.schedule("pass.demo", "1", 10)
+    updates.schedule("pass.demo", "2", 20)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(updates.run_due())
+    # the later batch ran, the failed one is due again
+    assert batches == [["1"], ["2"]]
+    assert len(job_store) == 1
+    assert job_store.next_due() == 10
+
+
+def test_run_continues_after_errors(job_store):
+    triggered = []
+    clock = ManualClock(0)
+
+    async def run():
+        stop = asyncio.Event()
+
+        async def trigger(jobs):
+            triggered.append((clock.now(), jobs[0].serial_number))
+            if len(triggered) == 1:
+                raise RuntimeError("APNs unavailable")
+            if len(triggered) == 3:
+                stop.set()
+
+        updates = UpdateScheduler(
+            job_store, clock=clock, trigger=trigger, poll_interval=30
+        )
+        updates.schedule("pass.demo", "1", 100)
+        updates.schedule("pass.demo", "2", 250)
+        await asyncio.wait_for(updates.run(stop), timeout=5)
+
+    asyncio.run(run())
+    # retried after the poll interval
+    assert triggered == [(100, "1"), (130, "1"), (250, "2")]
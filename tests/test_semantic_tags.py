@@ -385,3 +385,54 @@ def test_ecca_gala_dinner():
     pkpass1 = apple_api.new(data=json.loads(pkpass_json))
 
     assert pkpass1 is not None
+
+
+@pytest.mark.parametrize(
+    "semantics, expected",
+    [
+        ({"totalPrice": {"amount": "10", "currencyCode": "EUR"}}, "SemanticTags"),
+        ({"eventName": "Gala Dinner"}, "EventTicketSemanticTags"),
+        ({"eventName": "Final", "awayTeamName": "B"}, "SportEventTypeSemanticTags"),
+        ({"flightCode": "EX123"}, "BoardingPassSemanticTags"),
+        ({"flightCode": "EX123", "airlineCode": "EX"}, "PKTransitTypeAirSemanticTags"),
+        ({"carNumber": "7"}, "PKTransitTypeTrainSemanticTags"),
+    ],
+)
+def test_fields_are_resolved_by_their_keys(semantics, expected):
+    info = passes.PassInformation.model_validate(
+        {
+            "primaryFields": [
+                {"key": "plain", "value": "1"},
+                {"key": "tagged", "value": "2", "semantics": semantics},
+            ]
+        }
+    )
+    plain, tagged = info.primaryFields
+    assert type(plain) is passes.PassFieldContent
+    assert type(tagged) is passes.SemanticPassFieldContent
+    assert type(tagged.semantics).__name__ == expected
+
+
+def test_field_instances_keep_their_class():
+    tagged = passes.SemanticPassFieldContent(
+        key="tagged",
+        value="1",
+        semantics=semantic_tags.PKTransitTypeBusSemanticTags(vehicleNumber="42"),
+    )
+    auxiliary = passes.AuxiliaryFields(key="aux", value="2", row=1)
+    info = passes.PassInformation(auxiliaryFields=[tagged, auxiliary])
+    assert info.auxiliaryFields == [tagged, auxiliary]
+    assert isinstance(
+        info.auxiliaryFields[0].semantics, semantic_tags.PKTransitTypeBusSemanticTags
+    )
+
+
+def test_unknown_semantic_tags_must_fail():
+    with pytest.raises(ValidationError):
+        passes.SemanticPassFieldContent.model_validate(
+            {"key": "k", "value": "v", "semantics": {"venueAddress": "Platzl 9"}}
+        )
+    with pytest.raises(ValidationError):
+        passes.PassInformation.model_validate(
+            {"backFields": [{"key": "k", "value": "v", "semantics": "no object"}]}
+        )
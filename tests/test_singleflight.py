@@ -0,0 +1,87 @@
+from edutap.wallet_apple.singleflight import SingleFlight
+
+import asyncio
+import pytest
+
+
+def test_concurrent_calls_are_coalesced():
+    flights = SingleFlight()
+    calls = []
+
+    async def render():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"pass"
+
+    async def run():
+        requests = [flights.do(("pass.demo", "1234", True), render) for _ in range(5)]
+        other = flights.do(("pass.demo", "5678", True), render)
+        results = await asyncio.gather(*requests, other)
+        assert len(flights) == 0
+        # once landed, the next request renders anew
+        await flights.do(("pass.demo", "1234", True), render)
+        return results
+
+    assert asyncio.run(run()) == [b"pass"] * 6
+    assert len(calls) == 3
+    stats = flights.stats()
+    assert stats.calls == 3
+    assert stats.coalesced == 4
+    assert stats.waiters == {}
+
+
+def test_waiters():
+    flights = SingleFlight()
+    started = None
+
+    async def render():
+        await started.wait()
+        return 42
+
+    async def run():
+        nonlocal started
+        started = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(flights.do(("pass.demo", "1234", False), render))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        assert flights.waiters(("pass.demo", "1234", False)) == 3
+        assert flights.stats().waiters == {"pass.demo/1234/False": 3}
+        started.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [42, 42, 42]
+    assert flights.waiters(("pass.demo", "1234", False)) == 0
+
+
+def test_exceptions_and_cancellation():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise LookupError("Pass not found")
+
+    async def render():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def run():
+        results = await asyncio.gather(
+            flights.do("failing", fail),
+            flights.do("failing", fail),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, LookupError) for result in results)
+
+        # the first request goes away, the others still get the result
+        first = asyncio.ensure_future(flights.do("key", render))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.do("key", render))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
@@ -0,0 +1,170 @@
+from edutap.wallet_apple.archive import PkPassStream
+from edutap.wallet_apple.settings import Settings
+from edutap.wallet_apple.store import get_pass_store
+from edutap.wallet_apple.store import PassStore
+from io import BytesIO
+
+import hashlib
+import os
+import pytest
+
+PTID = "pass.demo.lmu.de"
+
+
+def test_put_and_get(tmp_path):
+    store = PassStore(tmp_path / "store")
+    assert store.get_path(PTID, "1") is None
+    assert store.get_digest(PTID, "1") is None
+
+    path = store.put(PTID, "1", b"first")
+    assert path.read_bytes() == b"first"
+    assert store.get_path(PTID, "1") == path
+    assert store.get_digest(PTID, "1") == hashlib.sha256(b"first").hexdigest()
+    assert store.object_path(store.get_digest(PTID, "1")) == path
+
+    # a new rendering replaces the current one
+    path2 = store.put(PTID, "1", b"second")
+    assert store.get_path(PTID, "1") == path2
+    assert path2.read_bytes() == b"second"
+
+    # the index is per pass
+    assert store.get_path(PTID, "2") is None
+    assert store.get_path("pass.other", "1") is None
+
+    # no leftovers from the atomic writes
+    assert list((tmp_path / "store" / "tmp").iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"PK archive",
+        BytesIO(b"PK archive"),
+        [b"PK ", memoryview(b"archive")],
+    ],
+)
+def test_put_input_types(tmp_path, data):
+    store = PassStore(tmp_path)
+    path = store.put(PTID, "1", data)
+    assert path.read_bytes() == b"PK archive"
+
+
+def test_put_stream(tmp_path):
+    store = PassStore(tmp_path)
+    stream = PkPassStream({"pass.json": b"{}"})
+    path = store.put(PTID, "1", stream)
+    assert path.read_bytes() == stream.getvalue()
+
+
+def test_identical_content_is_shared(tmp_path):
+    store = PassStore(tmp_path)
+    path1 = store.put(PTID, "1", b"same")
+    path2 = store.put(PTID, "2", b"same")
+    assert path1 == path2
+    assert store.size() == len(b"same")
+
+
+def test_invalidate(tmp_path):
+    store = PassStore(tmp_path)
+    store.put(PTID, "1", b"data")
+    store.invalidate(PTID, "1")
+    assert store.get_path(PTID, "1") is None
+    # invalidating a missing pass is fine
+    store.invalidate(PTID, "1")
+
+
+def test_lru_eviction(tmp_path):
+    store = PassStore(tmp_path, max_size=250)
+    paths = []
+    for serial in range(3):
+        paths.append(store.put(PTID, str(serial), bytes([serial]) * 100))
+        # distinct mtimes regardless of the filesystem resolution
+        os.utime(paths[-1], (serial, serial))
+
+    # the oldest was evicted to stay below the cap, its index entry is a miss
+    assert store.size() <= 250
+    assert store.get_path(PTID, "0") is None
+    assert store.get_path(PTID, "2") == paths[2]
+
+    # a hit marks the pass as recently used, so it survives the next eviction
+    assert store.get_path(PTID, "1") == paths[1]
+    os.utime(paths[2], (10, 10))
+    store.put(PTID, "3", b"\x03" * 100)
+    assert store.get_path(PTID, "1") == paths[1]
+    assert store.get_path(PTID, "2") is None
+    assert store.get_path(PTID, "3") is not None
+
+
+def test_eviction_keeps_current_write(tmp_path):
+    store = PassStore(tmp_path, max_size=10)
+    path = store.put(PTID, "1", b"x" * 100)
+    assert store.get_path(PTID, "1") == path
+
+
+def test_get_pass_store(tmp_path):
+    assert get_pass_store(Settings(pass_store_dir=None)) is None
+    settings = Settings(pass_store_dir=tmp_path)
+    store = get_pass_store(settings)
+    assert isinstance(store, PassStore)
+    # one store per configuration, shared by all requests
+    assert get_pass_store(settings) is store
+
+
+def test_stale_rendering_does_not_become_current(tmp_path):
+    store = PassStore(tmp_path)
+    store.put(PTID, "1", b"first")
+
+    # a rendering starts, the pass is updated meanwhile
+    version = store.version(PTID, "1")
+    store.invalidate(PTID, "1")
+    assert store.version(PTID, "1") != version
+    path = store.put(PTID, "1", b"stale", version=version)
+    assert path.read_bytes() == b"stale"
+    assert store.get_path(PTID, "1") is None
+
+    # a rendering of the current version is kept
+    path = store.put(PTID, "1", b"fresh", version=store.version(PTID, "1"))
+    assert store.get_path(PTID, "1") == path
+
+
+def test_invalidation_while_setting_current(tmp_path, monkeypatch):
+    store = PassStore(tmp_path)
+    version = store.version(PTID, "1")
+    path = store.add(b"stale")
+    move = store._move
+
+    def move_and_invalidate(tmp_name, target):
+        move(tmp_name, target)
+        if target.parent.parent.name == "index":
+            # another worker invalidates between the check and the write
+            monkeypatch.setattr(store, "_move", move)
+            store.invalidate(PTID, "1")
+            move(store._write_tmp([path.stem.encode()])[0], target)
+
+    monkeypatch.setattr(store, "_move", move_and_invalidate)
+    assert not store.set_current(PTID, "1", path, version)
+    assert store.get_path(PTID, "1") is None
+
+
+def test_update_renderings_are_kept_apart(tmp_path):
+    store = PassStore(tmp_path)
+    download = store.put(PTID, "1", b"download")
+    assert store.get_path(PTID, "1", update=True) is None
+    update = store.put(PTID, "1", b"update", update=True)
+    assert store.get_path(PTID, "1") == download
+    assert store.get_path(PTID, "1", update=True) == update
+
+    store.invalidate(PTID, "1")
+    assert store.get_path(PTID, "1") is None
+    assert store.get_path(PTID, "1", update=True) is None
+
+
+def test_max_age(tmp_path):
+    store = PassStore(tmp_path, max_age=60)
+    path = store.put(PTID, "1", b"first")
+    assert store.get_path(PTID, "1") == path
+
+    index_path = store._index_path(PTID, "1")
+    old = index_path.stat().st_mtime - 61
+    os.utime(index_path, (old, old))
+    assert store.get_path(PTID, "1") is None
@@ -0,0 +1,137 @@
+from edutap.wallet_apple.models import passes
+from edutap.wallet_apple.sweeper import SweepCandidate
+from edutap.wallet_apple.sweeper import SweepCheckpoint
+from edutap.wallet_apple.sweeper import Sweeper
+from edutap.wallet_apple.templates import PassTemplate
+
+import asyncio
+import conftest
+import json
+import pytest
+
+NOW = 1893456000  # 2030-01-01
+
+
+@pytest.fixture
+def voided_template():
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["voided"] = True
+    return PassTemplate.compile(
+        passes.Pass.model_validate(data), {"serial": "serialNumber"}
+    )
+
+
+def candidates(count):
+    return [
+        SweepCandidate(
+            pass_type_id="pass.demo.lmu.de",
+            serial_number=f"{number:04}",
+            # every second pass expired
+            expiration_date=(
+                "2029-06-01T00:00Z" if number % 2 else "2030-06-01T00:00+02:00"
+            ),
+            values={"serial": f"{number:04}"},
+        )
+        for number in range(count)
+    ]
+
+
+def source_of(items):
+    def source(after):
+        return [item for item in items if after is None or item.key > after]
+
+    return source
+
+
+def test_sweep(voided_template):
+    saved = {}
+    batches = []
+
+    async def save(candidate, pkpass):
+        saved[candidate.serial_number] = pkpass
+
+    async def trigger(keys):
+        batches.append(keys)
+
+    sweeper = Sweeper(
+        voided_template, save=save, batch_size=3, sign=False, trigger=trigger
+    )
+    report = asyncio.run(sweeper.run(source_of(candidates(10)), now=NOW))
+    assert (report.scanned, report.expired, report.voided) == (10, 5, 5)
+    assert report.batches == 2
+    assert [[serial for _, serial in batch] for batch in batches] == [
+        ["0001", "0003", "0005"],
+        ["0007", "0009"],
+    ]
+    assert json.loads(saved["0001"].files["pass.json"])["voided"] is True
+    assert report.seconds_per_pass > 0
+
+
+def test_dry_run(voided_template):
+    async def save(candidate, pkpass):
+        raise AssertionError("a dry run saves nothing")
+
+    sweeper = Sweeper(voided_template, save=save, sign=False, sample_size=2)
+    report = asyncio.run(sweeper.run(source_of(candidates(10)), dry_run=True, now=NOW))
+    assert report.dry_run
+    assert (report.scanned, report.expired, report.voided) == (10, 5, 0)
+    assert report.estimated_seconds == pytest.approx(report.seconds_per_pass * 5)
+
+
+def test_resume_after_interruption(voided_template, tmp_path):
+    checkpoint = SweepCheckpoint(tmp_path / "sweep.json")
+    saved = []
+    pushed = []
+
+    async def save(candidate, pkpass):
+        if candidate.serial_number == "0007" and "0007" not in saved:
+            saved.append("0007")
+            raise RuntimeError("interrupted")
+        saved.append(candidate.serial_number)
+
+    async def trigger(keys):
+        pushed.extend(serial for _, serial in keys)
+
+    sweeper = Sweeper(
+        voided_template,
+        save=save,
+        checkpoint=checkpoint,
+        batch_size=2,
+        sign=False,
+        trigger=trigger,
+    )
+    items = candidates(10)
+    with pytest.raises(RuntimeError):
+        asyncio.run(sweeper.run(source_of(items), now=NOW))
+    assert checkpoint.load() == {"after": ["pass.demo.lmu.de", "0003"], "now": NOW}
+    assert pushed == ["0001", "0003"]
+
+    # the time of the interrupted sweep is kept
+    report = asyncio.run(sweeper.run(source_of(items)))
+    assert report.resumed_after == ("pass.demo.lmu.de", "0003")
+    assert (report.scanned, report.voided) == (6, 3)
+    assert pushed == ["0001", "0003", "0005", "0007", "0009"]
+    assert checkpoint.load() is None
+
+
+def test_render_checks_the_pass_of_the_candidate(voided_template):
+    async def save(candidate, pkpass):
+        raise AssertionError("a mismatching pass is not saved")
+
+    sweeper = Sweeper(voided_template, save=save, sign=False)
+    candidate = candidates(2)[1]
+    assert json.loads(sweeper.render(candidate).files["pass.json"])["serialNumber"] == (
+        "0001"
+    )
+    with pytest.raises(ValueError, match="serialNumber"):
+        sweeper.render(candidate.model_copy(update={"values": {"serial": "0002"}}))
+    with pytest.raises(ValueError, match="passTypeIdentifier"):
+        asyncio.run(
+            sweeper.run(
+                source_of(
+                    [candidate.model_copy(update={"pass_type_id": "pass.other"})]
+                ),
+                now=NOW,
+            )
+        )
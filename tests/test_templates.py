@@ -0,0 +1,165 @@
+from edutap.wallet_apple import api
+from edutap.wallet_apple.models import passes
+from edutap.wallet_apple.templates import PassTemplate
+from pydantic import ValidationError
+
+import conftest
+import copy
+import hashlib
+import json
+import pytest
+
+STYLES = ["boardingPass", "coupon", "eventTicket", "generic", "storeCard"]
+
+VALUES = [
+    "plain",
+    'quo"ted \\ back\\slash',
+    "Jähn Dœ – ünïcode 🎫",
+    "control\nchars\tand\x01more",
+    "</script>",
+]
+
+
+def set_path(data: dict, path: str, value):
+    parts = path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target[int(part)] if isinstance(target, list) else target[part]
+    last = parts[-1]
+    if isinstance(target, list):
+        target[int(last)] = value
+    else:
+        target[last] = value
+
+
+def placeholders_for(data: dict) -> dict[str, str]:
+    placeholders = {"serial": "serialNumber"}
+    style = next(style for style in STYLES if style in data)
+    for group in ("primaryFields", "secondaryFields", "backFields"):
+        if data[style].get(group):
+            placeholders[group] = f"{style}.{group}.0.value"
+    if data.get("barcodes"):
+        placeholders["barcode"] = "barcodes.0.message"
+    return placeholders
+
+
+def slow_path(data: dict) -> bytes:
+    pkpass = api.new(data=data)
+    return pkpass._pass_json.encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "json_file",
+    [
+        "boarding_pass.json",
+        "coupon.json",
+        "ecca25-gala.json",
+        "event_ticket.json",
+        "generic_pass.json",
+        "minimal_generic_pass.json",
+        "minimal_storecard.json",
+        "semantic-fields-pass.json",
+        "storecard_with_nfc.json",
+    ],
+)
+@pytest.mark.parametrize("value", VALUES)
+def test_render_matches_slow_path(json_file, value):
+    with open(conftest.jsons / json_file, encoding="utf-8") as fh:
+        data = json.load(fh)
+    placeholders = placeholders_for(data)
+    template = api.new_template(data, placeholders)
+
+    values = {name: f"{name}-{value}" for name in placeholders}
+    expected_data = copy.deepcopy(data)
+    for name, path in placeholders.items():
+        set_path(expected_data, path, values[name])
+
+    assert template.render(**values) == slow_path(expected_data)
+
+
+def test_render_typed_values():
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["maxDistance"] = 10
+    template = api.new_template(
+        data,
+        {"name": "storeCard.primaryFields.0.value", "distance": "maxDistance"},
+    )
+
+    # field values may be strings or numbers, like in the model
+    for name, distance in [(42, 100), (1.5, 0), ("42", 7)]:
+        expected_data = copy.deepcopy(data)
+        expected_data["storeCard"]["primaryFields"][0]["value"] = name
+        expected_data["maxDistance"] = distance
+        assert template.render(name=name, distance=distance) == slow_path(expected_data)
+
+    with pytest.raises(ValidationError):
+        template.render(name="x", distance="far away")
+
+
+def test_render_errors():
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    template = api.new_template(data, {"serial": "serialNumber"})
+    assert template.placeholders == ["serial"]
+
+    with pytest.raises(ValidationError):
+        template.render(serial=1234)
+    with pytest.raises(ValueError):
+        template.render()
+    with pytest.raises(ValueError):
+        template.render(serial="1", unknown="2")
+
+    with pytest.raises(ValueError):
+        api.new_template(data, {"nope": "noSuchField"})
+    with pytest.raises(ValueError):
+        # not a scalar value
+        api.new_template(data, {"card": "storeCard"})
+    with pytest.raises(ValueError):
+        # not set in the template
+        api.new_template(data, {"nfc": "nfc.message"})
+
+
+def test_template_pkpass():
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    with open(conftest.resources / "white_square.png", "rb") as fh:
+        icon = fh.read()
+    template = PassTemplate.compile(
+        passes.Pass.model_validate(data),
+        {"serial": "serialNumber"},
+        files={"icon.png": icon},
+    )
+
+    pkpass = template.pkpass(serial="abc")
+    assert pkpass.pass_object is None
+    assert pkpass.files["icon.png"] == icon
+
+    manifest = json.loads(pkpass._create_manifest())
+    assert set(manifest) == {"icon.png", "pass.json"}
+
+    # the exported zip can be loaded as a regular pass
+    reloaded = api.new(file=api.pkpass(pkpass))
+    assert reloaded.pass_object_safe.serialNumber == "abc"
+
+
+@pytest.mark.skipif(not conftest.key_files_exist(), reason="key files missing")
+def test_sign_template_pass(settings_test):
+    with open(conftest.jsons / "minimal_storecard.json", encoding="utf-8") as fh:
+        data = json.load(fh)
+    data["passTypeIdentifier"] = settings_test.get_available_passtype_ids()[0]
+    data["teamIdentifier"] = settings_test.team_identifier
+    template = api.new_template(data, {"serial": "serialNumber"})
+
+    pkpass = template.pkpass(serial="abc")
+    api.sign(pkpass, settings=settings_test)
+    assert pkpass.is_signed
+    # the pass type identifier is read from the rendered pass.json
+    assert pkpass.pass_object is None
+
+    manifest = json.loads(pkpass.files["manifest.json"])
+    reloaded = api.new(file=api.pkpass(pkpass))
+    assert reloaded.pass_object_safe.serialNumber == "abc"
+    assert (
+        manifest["pass.json"] == hashlib.sha1(reloaded.files["pass.json"]).hexdigest()
+    )
@@ -0,0 +1,75 @@
+from edutap.wallet_apple.throttling import AuthGuard
+from edutap.wallet_apple.throttling import FailedTokens
+from edutap.wallet_apple.throttling import TokenBuckets
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_buckets_refill():
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=0.5, burst=2, clock=clock)
+    assert buckets.allows("ip:192.0.2.1")
+    buckets.take("ip:192.0.2.1")
+    buckets.take("ip:192.0.2.1")
+    assert not buckets.allows("ip:192.0.2.1")
+    assert buckets.allows("ip:192.0.2.2")
+    clock.now = 2.0
+    assert buckets.allows("ip:192.0.2.1")
+    # never more than the burst
+    clock.now = 100.0
+    buckets.take("ip:192.0.2.1")
+    buckets.take("ip:192.0.2.1")
+    assert not buckets.allows("ip:192.0.2.1")
+
+
+def test_token_buckets_are_bounded():
+    buckets = TokenBuckets(rate=0.1, burst=1, max_keys=2)
+    for client in ("a", "b", "c"):
+        buckets.take(client)
+    assert len(buckets) == 2
+    # dropped buckets start full again
+    assert buckets.allows("a")
+    assert not buckets.allows("c")
+
+
+def test_failed_tokens_expire():
+    clock = FakeClock()
+    failed_tokens = FailedTokens(ttl=60, max_entries=2, clock=clock)
+    failed_tokens.add(("token", "pass.demo", "1"))
+    assert ("token", "pass.demo", "1") in failed_tokens
+    assert ("token", "pass.demo", "2") not in failed_tokens
+    clock.now = 61
+    assert ("token", "pass.demo", "1") not in failed_tokens
+    for token in ("a", "b", "c"):
+        failed_tokens.add((token,))
+    assert len(failed_tokens) == 2
+    assert ("a",) not in failed_tokens
+
+
+def test_guard():
+    clock = FakeClock()
+    guard = AuthGuard(
+        TokenBuckets(rate=0.1, burst=3, clock=clock), FailedTokens(60, clock=clock)
+    )
+    clients = ["ip:192.0.2.1", "device:abc"]
+    assert guard.check(clients, ("token-1",)) is None
+    guard.failed(clients, ("token-1",))
+    assert guard.check(clients, ("token-1",)) == "failed token"
+    assert guard.check(clients, ("token-2",)) is None
+    guard.failed(clients, ("token-2",))
+    # the device is throttled from any address
+    assert guard.check(["ip:192.0.2.2", "device:abc"], ("token-3",)) == "throttled"
+    assert guard.check(["ip:192.0.2.2"], ("token-3",)) is None
+
+    stats = guard.stats()
+    assert stats.failures == 2
+    assert stats.rejected_failed_token == 1
+    assert stats.rejected_throttled == 1
+    assert stats.clients == 2
+    assert stats.failed_tokens == 2
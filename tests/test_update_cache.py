@@ -0,0 +1,84 @@
+from edutap.wallet_apple.models.handlers import SerialNumbers
+from edutap.wallet_apple.update_cache import get_updatable_passes_cache
+from edutap.wallet_apple.update_cache import UpdatablePassesCache
+from plugins import SettingsTest
+
+import time
+
+
+def serial_numbers(*numbers):
+    return SerialNumbers(serialNumbers=list(numbers), lastUpdated="now")
+
+
+def test_get_put():
+    cache = UpdatablePassesCache(ttl=60)
+    assert cache.get("device", "pass.demo", None) is None
+    cache.put("device", "pass.demo", None, serial_numbers("1"))
+    cache.put("device", "pass.demo", "tag", serial_numbers("2"))
+    assert cache.get("device", "pass.demo", None) == serial_numbers("1")
+    assert cache.get("device", "pass.demo", "tag") == serial_numbers("2")
+    assert cache.get("other", "pass.demo", None) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_ttl():
+    cache = UpdatablePassesCache(ttl=0.01)
+    cache.put("device", "pass.demo", None, serial_numbers("1"))
+    time.sleep(0.02)
+    assert cache.get("device", "pass.demo", None) is None
+    assert len(cache) == 0
+
+
+def test_bounded():
+    cache = UpdatablePassesCache(ttl=60, max_entries=2)
+    cache.put("a", "pass.demo", None, serial_numbers("1"))
+    cache.put("b", "pass.demo", None, serial_numbers("2"))
+    cache.get("a", "pass.demo", None)
+    cache.put("c", "pass.demo", None, serial_numbers("3"))
+    assert len(cache) == 2
+    # the least recently used answer is dropped
+    assert cache.get("b", "pass.demo", None) is None
+    assert cache.get("a", "pass.demo", None) is not None
+
+
+def test_invalidate():
+    cache = UpdatablePassesCache(ttl=60)
+    for device in ("a", "b"):
+        for tag in (None, "tag"):
+            cache.put(device, "pass.demo", tag, serial_numbers("1"))
+    cache.put("a", "pass.other", None, serial_numbers("1"))
+
+    cache.invalidate("pass.demo", "a")
+    assert cache.get("a", "pass.demo", None) is None
+    assert cache.get("a", "pass.demo", "tag") is None
+    assert cache.get("b", "pass.demo", "tag") is not None
+
+    cache.invalidate("pass.demo")
+    assert cache.get("b", "pass.demo", None) is None
+    assert cache.get("b", "pass.demo", "tag") is None
+    assert cache.get("a", "pass.other", None) is not None
+
+    # answers of the new generation are cached again
+    cache.put("b", "pass.demo", None, serial_numbers("2"))
+    assert cache.get("b", "pass.demo", None) == serial_numbers("2")
+
+
+def test_empty_answers(monkeypatch):
+    cache = UpdatablePassesCache(ttl=60)
+    # another worker may push an update meanwhile, no way to tell
+    cache.put("device", "pass.demo", "tag", serial_numbers())
+    assert cache.get("device", "pass.demo", "tag") is None
+
+    # outdated by the next update in the ledger
+    cache.put("device", "pass.demo", "tag", serial_numbers(), sequence=1)
+    assert cache.get("device", "pass.demo", "tag", sequence=1) == serial_numbers()
+    assert cache.get("device", "pass.demo", "tag", sequence=2) is None
+
+
+def test_get_updatable_passes_cache(monkeypatch):
+    assert get_updatable_passes_cache(SettingsTest()) is None
+    monkeypatch.setenv("EDUTAP_WALLET_APPLE_UPDATABLE_PASSES_CACHE_TTL", "5")
+    cache = get_updatable_passes_cache(SettingsTest())
+    assert cache is not None
+    assert cache.ttl == 5
+    assert get_updatable_passes_cache(SettingsTest()) is cache
@@ -0,0 +1,154 @@
+from conftest import key_files_exist
+from conftest import only_test_if_crypto_supports_verification
+from edutap.wallet_apple import api
+from edutap.wallet_apple.archive import IngestionLimits
+from edutap.wallet_apple.verification import main
+from edutap.wallet_apple.verification import verify_archive
+from edutap.wallet_apple.verification import verify_many
+from io import BytesIO
+from plugins import SettingsTest
+
+import pytest
+import shutil
+import zipfile
+
+settings = SettingsTest()
+
+APPLE_PASSES = ["BoardingPass", "Coupon", "Event", "Generic", "StoreCard"]
+
+
+def rewrite(source, target, changes: dict[str, bytes | None]):
+    """copies a zip file, replacing (or with None removing) members"""
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, "w") as zout:
+        for name in zin.namelist():
+            if name in changes:
+                data = changes[name]
+                if data is not None:
+                    zout.writestr(name, data)
+            else:
+                zout.writestr(name, zin.read(name))
+        for name, data in changes.items():
+            if name not in zin.namelist() and data is not None:
+                zout.writestr(name, data)
+
+
+@pytest.mark.parametrize("filename", APPLE_PASSES)
+def test_verify_apple_passes(apple_passes_dir, filename):
+    result = verify_archive(apple_passes_dir / f"{filename}.pkpass")
+    assert result.ok, result.errors
+    assert result.source.endswith(f"{filename}.pkpass")
+
+
+def test_verify_tampered(apple_passes_dir, tmp_path):
+    source = apple_passes_dir / "BoardingPass.pkpass"
+    with zipfile.ZipFile(source) as zf:
+        pass_json = zf.read("pass.json")
+
+    target = tmp_path / "changed.pkpass"
+    rewrite(source, target, {"pass.json": pass_json.replace(b"}", b" }", 1)})
+    assert verify_archive(target).errors == ["pass.json does not match the manifest"]
+
+    rewrite(source, target, {"logo.png": None, "extra.png": b"x"})
+    assert verify_archive(target).errors == [
+        "extra.png is not in the manifest",
+        "logo.png of the manifest is missing",
+    ]
+
+    rewrite(source, target, {"manifest.json": None})
+    assert verify_archive(target).errors == ["manifest.json is missing"]
+
+    rewrite(source, target, {"manifest.json": b"[]"})
+    assert verify_archive(target).errors == ["manifest.json is not an object"]
+
+    result = verify_archive(BytesIO(b"no zip"))
+    assert result.source == "<stream>"
+    assert result.errors[0].startswith("unreadable archive")
+
+    result = verify_archive(source, limits=IngestionLimits(max_members=2))
+    assert result.errors[0].startswith("unreadable archive")
+
+
+@only_test_if_crypto_supports_verification
+@pytest.mark.skipif(not key_files_exist(), reason="key files are missing")
+@pytest.mark.parametrize("pass_type_id", settings.get_available_passtype_ids())
+def test_verify_signature(apple_passes_dir, tmp_path, pass_type_id):
+    with open(apple_passes_dir / "BoardingPass.pkpass", "rb") as fh:
+        pkpass = api.new(file=fh)
+    pkpass.pass_object_safe.passTypeIdentifier = pass_type_id
+    pkpass.pass_object_safe.teamIdentifier = settings.team_identifier
+    api.sign(pkpass, settings=settings)
+
+    result = verify_archive(api.pkpass(pkpass))
+    assert result.ok, result.errors
+    assert result.signature_checked
+
+    signed = tmp_path / "signed.pkpass"
+    signed.write_bytes(api.pkpass(pkpass).read())
+    target = tmp_path / "broken.pkpass"
+    rewrite(signed, target, {"signature": b"\x30\x00"})
+    result = verify_archive(target)
+    assert result.errors[0].startswith("signature is invalid")
+
+
+def test_verify_errors_are_reported(apple_passes_dir, tmp_path, monkeypatch):
+    from edutap.wallet_apple import crypto
+
+    import struct
+
+    source = apple_passes_dir / "Coupon.pkpass"
+    deflated = tmp_path / "deflated.pkpass"
+    with zipfile.ZipFile(source) as zin:
+        with zipfile.ZipFile(deflated, "w", zipfile.ZIP_DEFLATED) as zout:
+            for name in zin.namelist():
+                zout.writestr(name, zin.read(name))
+    # corrupt the compressed pass.json, zlib fails to decompress it
+    raw = bytearray(deflated.read_bytes())
+    with zipfile.ZipFile(deflated) as zf:
+        offset = zf.getinfo("pass.json").header_offset
+    name_length, extra_length = struct.unpack_from("<HH", raw, offset + 26)
+    raw[offset + 30 + name_length + extra_length] = 0xFF
+    (tmp_path / "corrupt.pkpass").write_bytes(bytes(raw))
+
+    def verify_manifest(manifest, signature):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(crypto, "supports_verification", lambda: True)
+    monkeypatch.setattr(crypto, "verify_manifest", verify_manifest)
+    results = list(verify_many([tmp_path], workers=1))
+    assert [result.source.rsplit("/", 1)[-1] for result in results] == [
+        "corrupt.pkpass",
+        "deflated.pkpass",
+    ]
+    assert results[0].errors[0].startswith("unreadable archive: Error -3")
+    assert results[1].errors == ["verification failed: RuntimeError('unexpected')"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_verify_many(apple_passes_dir, tmp_path, workers):
+    for filename in APPLE_PASSES:
+        shutil.copy(apple_passes_dir / f"{filename}.pkpass", tmp_path)
+    (tmp_path / "sub").mkdir()
+    rewrite(
+        apple_passes_dir / "Coupon.pkpass",
+        tmp_path / "sub" / "broken.pkpass",
+        {"pass.json": b"{}"},
+    )
+
+    results = list(verify_many([tmp_path], workers=workers))
+    assert len(results) == 6
+    assert [result.ok for result in results].count(False) == 1
+
+
+def test_cli(apple_passes_dir, tmp_path, capsys):
+    assert main(["-j", "1", str(apple_passes_dir)]) == 0
+    assert "5 archives verified, 0 failed" in capsys.readouterr().err
+
+    rewrite(
+        apple_passes_dir / "Coupon.pkpass",
+        tmp_path / "broken.pkpass",
+        {"pass.json": b"{}"},
+    )
+    assert main(["-j", "1", "--no-signature", str(tmp_path)]) == 1
+    captured = capsys.readouterr()
+    assert "broken.pkpass: pass.json does not match the manifest" in captured.out
+    assert "1 archives verified, 1 failed" in captured.err